@@ -19,7 +19,7 @@ let b:current_syntax = ''
 unlet b:current_syntax
 syntax include @PYTHON syntax/python.vim
 
-syn match operator    /{\|}\|<\|>\|&\|!\||\|\[\|\]\|+\|\*\|,\|?/
+syn match operator    /{\|}\|<\|>\|&\|!\|\~\||\|\[\|\]\|+\|\*\|,\|?/
 
 syn match commentRule "#.*$" contains=@NoSpell,Todo
 syn keyword Todo FIXME TODO XXX contained
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+    Measure how long the pwpeg modules take to import, and how long a large
+    grammar takes to build, which is what short-lived tools wait for.
+
+    Each module is imported in a new interpreter, the best of --repeat runs
+    being kept, and what it takes on top of the standard modules pwpeg
+    imports, which depends on the machine more than on pwpeg, is checked
+    against its budget in milliseconds ; the script exits with 1 when one
+    is over it.
+
+    Usage: benchmarks/startup.py [options]
+"""
+
+from os.path import dirname, join, abspath
+import subprocess
+import sys
+import time
+import types
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+
+from pwpeg import *
+from pwpeg.pwpeglang_parser import toplevel
+from pwpeg.visitor_python import PythonVisitor
+
+from threads import document
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+# The standard modules pwpeg imports.
+baseline = "bisect, codecs, collections, itertools, re, threading, time, weakref"
+
+# The import time budgets of the modules on top of the baseline, in
+# milliseconds.
+budgets = [
+    ("pwpeg", 6),
+    ("pwpeg.helpers", 8),
+    ("pwpeg.pwpeglang", 15),
+    ("pwpeg.pwpeglang_parser", 15),
+]
+
+def import_time(module, repeat):
+    """ The best time module takes to import in a new interpreter, in seconds.
+    """
+    script = "import time, sys\n" \
+        "clock = getattr(time, 'perf_counter', time.time)\n" \
+        "sys.path.insert(0, {0!r})\n" \
+        "start = clock()\n" \
+        "import {1}\n" \
+        "print(clock() - start)\n".format(abspath(join(dirname(__file__), "..")), module)
+    # The first run writes the bytecode of the modules.
+    return min(float(subprocess.check_output([sys.executable, "-c", script])) for i in range(repeat + 1))
+
+
+def build_time(n, repeat):
+    """ The best time the module the python backend writes from a grammar of
+        n rules takes to run, and then a Parser of its first rule to be
+        built, in seconds.
+    """
+    code = compile(PythonVisitor().compile(Parser(toplevel).parse(document(n))), "grammar", "exec")
+    best = None
+    for i in range(repeat):
+        module = types.ModuleType("grammar")
+        start = _clock()
+        exec(code, module.__dict__)
+        built = _clock()
+        Parser(module.entry_0)
+        parser = _clock()
+        if best is None or parser - start < sum(best):
+            best = (built - start, parser - built)
+    return best
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    optparser = OptionParser(usage="%prog [options]")
+    optparser.add_option("-n", "--repeat", type="int", default=5,
+        help="how many times each measure is taken, the best time is kept [default: %default]")
+    optparser.add_option("-f", "--factor", type="float", default=1.0,
+        help="multiply the budgets, for slower machines [default: %default]")
+    optparser.add_option("-r", "--rules", type="int", default=1600,
+        help="how many rules the built grammar has [default: %default]")
+
+    options, args = optparser.parse_args()
+
+    base = import_time(baseline, options.repeat) * 1000
+    print(u("import the standard modules        {0:>8.1f} ms").format(base))
+
+    over = []
+    for module, budget in budgets:
+        ms = import_time(module, options.repeat) * 1000 - base
+        budget *= options.factor
+        print(u("import {0:<28} {1:>+8.1f} ms  budget {2:>6.1f} ms").format(module, ms, budget))
+        if ms > budget:
+            over.append(module)
+
+    module, parser = build_time(options.rules // 4, options.repeat)
+    print(u("build {0:>5} rules                  {1:>8.1f} ms  Parser {2:>8.1f} ms").format(options.rules, module * 1000, parser * 1000))
+
+    if over:
+        print(u("\n{0} modules are over their budget: {1}").format(len(over), ", ".join(over)))
+        sys.exit(1)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+    Measure how fast representative grammars parse inputs of several sizes,
+    and how fast the backends write modules from grammars.
+
+    For each benchmark and size, it reports the characters parsed per second
+    (the best of --repeat runs), the peak memory of a run, and the memory
+    blocks its result keeps, which python 3.4 and later can count. They are
+    not the blocks allocated during the run, which CPython does not count.
+
+    Usage:
+        benchmarks/suite.py [options] [benchmark...]
+        benchmarks/suite.py --json baseline.json
+        benchmarks/suite.py --compare baseline.json
+"""
+
+from os.path import dirname, join
+import gc
+import json
+import re
+import sys
+import time
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+
+from pwpeg import *
+from pwpeg.helpers import AllBut, Balanced, LeftAssociative
+from pwpeg.pwpeglang import toplevel
+from pwpeg.visitor_python import PythonVisitor
+from pwpeg.visitor_standalone import StandaloneVisitor
+
+from threads import document
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+#####################################################
+# Grammars
+
+def arithmetic():
+    number = Rule(re.compile("[0-9]+")).set_action(lambda n: int(n))
+    expression = Rule().set_name("expression")
+    atom = Either(number, Rule("(", expression, ")").set_action(lambda o, e, c: e))
+    term = LeftAssociative(atom, Either("*", "/"))
+    expression.set_productions(LeftAssociative(term, Either("+", "-")))
+    return Rule(expression).set_skip(re.compile("[ ]*"))
+
+def arithmetic_text(n):
+    operators = "+-*/"
+    terms = []
+    for i in range(n):
+        term = str(i * 7919 % 1000)
+        if i % 5 == 4:
+            term = u("({0} - {1})").format(term, i)
+        terms.append(term)
+        terms.append(operators[i % 4])
+    return " ".join(terms + ["1"])
+
+
+def json_like():
+    value = Rule().set_name("value")
+    string = Rule(re.compile(r'"(?:[^"\\]|\\.)*"')).set_action(lambda s: s[1:-1])
+    number = Rule(re.compile(r"-?[0-9]+(?:\.[0-9]+)?")).set_action(lambda n: float(n))
+    pair = Rule(string, ":", value).set_action(lambda k, colon, v: (k, v))
+    obj = Rule("{", Optional(pair, ZeroOrMore(",", pair)), "}").set_action(
+        lambda o, pairs, c: dict([pairs[0]] + [p for comma, p in pairs[1]]) if pairs else {})
+    array = Rule("[", Optional(value, ZeroOrMore(",", value)), "]").set_action(
+        lambda o, values, c: [values[0]] + [v for comma, v in values[1]] if values else [])
+    value.set_productions(Either(obj, array, string, number,
+        Rule("true").set_action(lambda t: True), Rule("false").set_action(lambda f: False), Rule("null").set_action(lambda n: None)))
+    return Rule(value).set_skip(re.compile(r"\s*"))
+
+def json_lexer():
+    return Lexer([("string", r'"(?:[^"\\]|\\.)*"'), ("number", r"-?[0-9]+(?:\.[0-9]+)?"), ("punctuation", r"[{}\[\]:,]"),
+        ("word", "true|false|null"), ("space", r"\s+")], skip=["space"])
+
+def json_tokens():
+    value = Rule().set_name("value")
+    string = Rule(Token("string")).set_action(lambda s: s[1:-1])
+    number = Rule(Token("number")).set_action(lambda n: float(n))
+    pair = Rule(string, ":", value).set_action(lambda k, colon, v: (k, v))
+    obj = Rule("{", Optional(pair, ZeroOrMore(",", pair)), "}").set_action(
+        lambda o, pairs, c: dict([pairs[0]] + [p for comma, p in pairs[1]]) if pairs else {})
+    array = Rule("[", Optional(value, ZeroOrMore(",", value)), "]").set_action(
+        lambda o, values, c: [values[0]] + [v for comma, v in values[1]] if values else [])
+    value.set_productions(Either(obj, array, string, number,
+        Rule("true").set_action(lambda t: True), Rule("false").set_action(lambda f: False), Rule("null").set_action(lambda n: None)))
+    return Rule(value)
+
+def json_text(n):
+    return json.dumps([{"id": i, "name": u("item {0}").format(i), "tags": ["a", "b\\\"c"][:i % 3],
+        "price": i * 1.25, "stock": None if i % 7 else True, "parts": [{"n": j} for j in range(i % 4)]}
+        for i in range(n)], indent=1)
+
+
+def balanced():
+    return Rule(ZeroOrMore(Either(Balanced("(", ")", "\\"), AllBut(Either("(", ")"), "\\"))))
+
+def balanced_text(n):
+    parts = []
+    for i in range(n):
+        depth = i % 6 + 1
+        parts.append("call " + "(" * depth + u("arg {0}, \\) ").format(i) + ")" * depth + " then ")
+    return "".join(parts)
+
+
+def grammar_text(n):
+    return document(max(n // 10, 1))
+
+
+class Benchmark(object):
+    """ A grammar parsing the texts text() generates for sizes, or the
+        tokens lexer() finds in them, or for the code generators, compiling
+        them.
+    """
+
+    def __init__(self, name, rule, text, sizes, compile=None, lexer=None):
+        self.name = name
+        self.rule = rule
+        self.text = text
+        self.sizes = sizes
+        self.compile = compile
+        self.lexer = lexer
+
+    def prepare(self, engine):
+        """ Get a function taking a text and parsing or compiling it.
+        """
+        if self.compile is not None:
+            # Only the compilation is measured.
+            parser = Parser(toplevel)
+            trees = {}
+
+            def compile(text):
+                if text not in trees:
+                    trees[text] = parser.parse(text)
+                return self.compile().compile(trees[text])
+            return compile
+        if self.lexer is not None:
+            # The text is lexed as a part of the parse.
+            parser, lexer = Parser(self.rule(), engine=engine), self.lexer()
+            return lambda text: parser.parse_tokens(text, lexer)
+        return Parser(self.rule(), engine=engine).parse
+
+
+benchmarks = [
+    Benchmark("pwpeglang", lambda: toplevel, grammar_text, [10, 100, 1000]),
+    Benchmark("arithmetic", arithmetic, arithmetic_text, [10, 100, 1000]),
+    Benchmark("json", json_like, json_text, [10, 100, 1000]),
+    Benchmark("json-tokens", json_tokens, json_text, [10, 100, 1000], lexer=json_lexer),
+    Benchmark("balanced", balanced, balanced_text, [10, 100, 1000]),
+    Benchmark("python-visitor", None, grammar_text, [10, 100, 1000], PythonVisitor),
+    Benchmark("standalone-visitor", None, grammar_text, [10, 100, 1000], StandaloneVisitor),
+]
+
+
+#####################################################
+# Measures
+
+def measure(fn, text, repeat):
+    """ Run fn on text, and get its best time, the peak memory of a run and
+        the blocks its result keeps allocated, or None for the ones that
+        can't be measured.
+    """
+    fn(text)
+
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        best = None
+        for i in range(repeat):
+            start = _clock()
+            fn(text)
+            elapsed = _clock() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if enabled:
+            gc.enable()
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        fn(text)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    kept = None
+    if hasattr(sys, "getallocatedblocks"):
+        gc.collect()
+        before = sys.getallocatedblocks()
+        result = fn(text)
+        gc.collect()
+        kept = sys.getallocatedblocks() - before
+        del result
+
+    return dict(chars=len(text), seconds=best, throughput=len(text) / best if best else None,
+        peak_memory=peak, kept_blocks=kept)
+
+
+def run(names, engines, repeat, scale):
+    """ Run the benchmarks and get their measures per "name/size/engine".
+    """
+    results = {}
+    for benchmark in benchmarks:
+        if names and benchmark.name not in names:
+            continue
+        for engine in (engines if benchmark.compile is None else ["-"]):
+            fn = benchmark.prepare(engine)
+            for size in benchmark.sizes:
+                key = u("{0}/{1}/{2}").format(benchmark.name, size * scale, engine)
+                results[key] = measure(fn, benchmark.text(size * scale), repeat)
+                report(key, results[key])
+    return results
+
+
+def report(key, m, baseline=None):
+    line = u("{0:<36} {1:>9} chars {2:>12.0f} chars/s").format(key, m["chars"], m["throughput"])
+    if m["peak_memory"] is not None:
+        line += u(" {0:>10.1f} KiB peak").format(m["peak_memory"] / 1024.0)
+    if m["kept_blocks"] is not None:
+        line += u(" {0:>8} blocks kept").format(m["kept_blocks"])
+    if baseline is not None:
+        line += u(" {0:>+7.1f}%").format(100.0 * (m["throughput"] / baseline["throughput"] - 1))
+    print(line)
+
+
+def compare(results, baseline, threshold):
+    """ Print the measures against the baseline ones, and get the keys of the
+        benchmarks that became slower by more than threshold percents.
+    """
+    slower = []
+    print(u("\nAgainst the baseline ({0}):").format(baseline.get("python", "?")))
+    for key in sorted(results):
+        if key not in baseline["results"]:
+            continue
+        report(key, results[key], baseline["results"][key])
+        if results[key]["throughput"] < baseline["results"][key]["throughput"] * (1 - threshold / 100.0):
+            slower.append(key)
+    return slower
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    optparser = OptionParser(usage="%prog [options] [benchmark...]")
+    optparser.add_option("-e", "--engine", action="append", choices=list(Parser.engines),
+        help="the engines to parse with, can be repeated [default: all]")
+    optparser.add_option("-n", "--repeat", type="int", default=5,
+        help="how many times each benchmark runs, the best time is kept [default: %default]")
+    optparser.add_option("-s", "--scale", type="int", default=1,
+        help="multiply the sizes of the inputs [default: %default]")
+    optparser.add_option("-j", "--json",
+        help="write the measures to this file, to be used as a baseline")
+    optparser.add_option("-c", "--compare",
+        help="compare the throughputs against the ones of this file, and exit with 1 if some are slower")
+    optparser.add_option("-t", "--threshold", type="float", default=10.0,
+        help="how many percents slower a benchmark can be than in the baseline [default: %default]")
+    optparser.add_option("-l", "--list", action="store_true", default=False,
+        help="list the benchmarks")
+
+    options, names = optparser.parse_args()
+
+    if options.list:
+        for b in benchmarks:
+            print(u("{0:<20} sizes {1}").format(b.name, ", ".join(str(s) for s in b.sizes)))
+        optparser.exit()
+
+    results = run(names, options.engine or list(Parser.engines), options.repeat, options.scale)
+
+    if options.json:
+        f = open(options.json, "w")
+        json.dump(dict(python=sys.version.split()[0], results=results), f, indent=1, sort_keys=True)
+        f.close()
+
+    if options.compare:
+        f = open(options.compare, "r")
+        baseline = json.load(f)
+        f.close()
+        slower = compare(results, baseline, options.threshold)
+        if slower:
+            print(u("\n{0} benchmarks are more than {1}% slower: {2}").format(len(slower), options.threshold, ", ".join(slower)))
+            sys.exit(1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+    Measure the throughput of one Parser shared by several threads.
+
+    The same grammar parses copies of a generated .pwpeg file from 1, 2, 4...
+    threads. With the GIL, the throughput stays about the same ; with a
+    free-threaded build of CPython, it grows with the threads.
+
+    Usage: benchmarks/threads.py [max threads] [documents per thread]
+"""
+
+from os.path import dirname, join
+import sys
+import threading
+import time
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+
+from pwpeg import Parser
+from pwpeg.pwpeglang import toplevel
+
+
+def document(n):
+    """ A grammar of n rules, with the constructs of the language.
+    """
+    rules = []
+    for i in range(n):
+        rules.append("entry_{0} skip /\\s*/ = k:key_{0} \"=\" v:value_{1}+ \";\"? -> (k, v)\n".format(i, (i + 1) % n))
+        rules.append("key_{0} = !\"end\" name:/[a-z]+/i {{len(name) < {0}}} -> name.lower()\n".format(i))
+        rules.append("value_{0} = /[0-9]+/ | /\"[^\"]*\"/ | &\"(\" Balanced(\"(\", \")\", \"\\\\\") | pair_{0}(key_{0}, entry_{0})\n".format(i))
+        rules.append("pair_{0}(a, b) = a \",\" b ->\n    x = (_0, _2)\n    return x\n".format(i))
+    return "\n".join(rules)
+
+
+def run(parser, text, threads, documents):
+    """ Parse text documents times from each thread, and get the number of
+        characters parsed per second.
+    """
+    def work():
+        for i in range(documents):
+            parser.parse(text)
+
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(text) * documents * threads / (time.time() - start)
+
+
+if __name__ == "__main__":
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    documents = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    text = document(50)
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print("{0} characters per document, GIL {1}".format(len(text), "enabled" if gil else "disabled"))
+
+    for engine in Parser.engines:
+        parser = Parser(toplevel, engine=engine)
+        parser.parse(text)
+        base = None
+        threads = 1
+        while threads <= max_threads:
+            speed = run(parser, text, threads, documents)
+            base = base or speed
+            print("{0:8} {1:3} threads {2:12.0f} chars/s  x{3:.2f}".format(engine, threads, speed, speed / base))
+            threads *= 2
@@ -0,0 +1,155 @@
+"""
+    A cache of the modules the backends write from grammars, so that
+    the grammars that did not change are not parsed and compiled again.
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+
+from . import __version__
+from .pwpeg import u
+
+
+def default_directory():
+    """ Get the directory the cache is kept in by default.
+    """
+    if os.environ.get("PWPEG_CACHE_DIR"):
+        return os.environ["PWPEG_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pwpeg")
+
+
+class CompileCache(object):
+    """ The modules written from grammars, with their bytecode, kept in a
+        directory under the hash of the grammar, the backend and the
+        version of pwpeg.
+
+        When the files of the directory take more than max_size bytes, the
+        ones that were used the longest ago are removed.
+    """
+
+    def __init__(self, directory=None, max_size=32 * 1024 * 1024):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        implementation = getattr(sys, "implementation", None)
+        self.tag = implementation.cache_tag if implementation else u("py{0}{1}").format(*sys.version_info[:2])
+
+    def key(self, grammar, backend):
+        """ Get the hash a grammar is kept under for a backend.
+        """
+        if not isinstance(grammar, bytes):
+            grammar = grammar.encode("utf-8")
+        h = hashlib.sha256(u("pwpeg {0} {1}\n").format(__version__, backend).encode("utf-8"))
+        h.update(grammar)
+        return h.hexdigest()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def source(self, grammar, backend, write):
+        """ Get the module backend writes from grammar, calling write() to
+            get it if it is not in the cache yet.
+        """
+        key = self.key(grammar, backend)
+        path = self.path(key, ".py")
+        source = self.read(path, "r")
+        if source is not None:
+            self.hits += 1
+            return source
+
+        self.misses += 1
+        source = write()
+        self.write(path, source, "w")
+        self.write(self.path(key, u(".{0}.code").format(self.tag)), marshal.dumps(self.bytecode(source, key)), "wb")
+        self.trim()
+        return source
+
+    def code(self, grammar, backend, write):
+        """ Get the code object of the module backend writes from grammar,
+            to be run with exec.
+        """
+        key = self.key(grammar, backend)
+        data = self.read(self.path(key, u(".{0}.code").format(self.tag)), "rb")
+        if data is not None:
+            try:
+                code = marshal.loads(data)
+                self.hits += 1
+                return code
+            except (EOFError, ValueError, TypeError):
+                pass
+        return self.bytecode(self.source(grammar, backend, write), key)
+
+    def bytecode(self, source, key):
+        return compile(source, u("<grammar {0}>").format(key[:12]), "exec")
+
+    def read(self, path, mode):
+        try:
+            f = open(path, mode)
+        except (IOError, OSError):
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        # Mark the entry as used, for trim() to keep it longer.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def write(self, path, data, mode):
+        """ Write a file of the cache, which only appears once it is complete,
+            so that other processes never read half of it.
+        """
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have made it meanwhile.
+                if not os.path.isdir(directory):
+                    raise
+        temporary = u("{0}.{1}.tmp").format(path, os.getpid())
+        f = open(temporary, mode)
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(temporary, path)
+
+    def entries(self):
+        """ Get the files of the cache as (last use, size, path) tuples.
+        """
+        entries = []
+        for root, directories, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def trim(self):
+        """ Remove the files used the longest ago until the cache takes at
+            most max_size bytes.
+        """
+        entries = sorted(self.entries())
+        size = sum(e[1] for e in entries)
+        for mtime, length, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= length
+
+    def report(self):
+        return u("Compile cache: {0} hits, {1} misses, in {2}").format(self.hits, self.misses, self.directory)
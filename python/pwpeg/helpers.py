@@ -84,7 +84,7 @@ def _RepeatingSeparated(rule, separator, at_least, at_most):
             Repetition(0, at_most - 1,
                 separator,
                 rule
-            ).set_action(lambda l: map(lambda e: e[1], l))
+            ).set_action(lambda l: [e[1] for e in l])
         ).set_action(_repeat_action))
 
     return Rule(
@@ -92,7 +92,7 @@ def _RepeatingSeparated(rule, separator, at_least, at_most):
         Repetition(at_least - 1, at_most - 1,
             separator,
             rule
-        ).set_action(lambda res: map(lambda x: x[1], res))
+        ).set_action(lambda res: [x[1] for x in res])
     ).set_action(_repeat_action)
 
 RepeatingSeparated = FunctionRule(_RepeatingSeparated)
@@ -153,16 +153,15 @@ def _associative(right=True):
         # Default builder
         builder = builder if builder else lambda op, lhs, rhs: (op, lhs, rhs)
 
-        def left_assoc(lst, idx=0):
-            idx = 1
-            l = len(lst)
-            tmpbuild = builder(lst[idx], lst[idx - 1], lst[idx + 1])
-
-            while idx < l - 2:
-                idx += 2
-                tmpbuild = builder(lst[idx], tmpbuild, lst[idx + 1])
-
-            return tmpbuild
+        if not right:
+            # The tree is built while parsing, by a left recursive rule.
+            expression = Rule()
+            expression.set_productions(Either(
+                Rule(expression, operator, production).set_action(lambda lhs, op, rhs: builder(op, lhs, rhs)),
+                production
+            ))
+            expression.left_recursive = True
+            return expression
 
         def right_assoc(lst):
             idx = len(lst) - 3
@@ -183,7 +182,7 @@ def _associative(right=True):
             for item in lst:
                 newlst += item
 
-            return right_assoc(newlst) if right else left_assoc(newlst)
+            return right_assoc(newlst)
 
         return Rule(production, ZeroOrMore(operator, production)).set_action(action)
 
@@ -215,6 +214,22 @@ def delimitedby_regexp(char, escape):
     return re.compile(u("{0}({1}{0}|(?!{0}).)*{0}").format(re.escape(char), re.escape(escape)), re.DOTALL)
 
 
+def delimitedby_regexp_escapes(char, escape):
+    '''
+        Like delimitedby_regexp, except that the escape character can escape
+        more than just the delimiter ; delimitedby_regexp_escapes('"', '\\\\.')
+        matches a double quoted string where a backslash escapes any character.
+
+        Args:
+            char: the delimiter.
+            escape: the escape character, followed by a regular expression
+                of what it can escape.
+        Returns:
+            a regular expression
+    '''
+    return re.compile(u("{0}({1}{2}|(?!{0}).)*{0}").format(re.escape(char), re.escape(escape[0]), escape[1:]), re.DOTALL)
+
+
 def allbut_regexp(patterns, escape):
     '''
         Match anything but *but* the provided patterns.
@@ -1,5 +1,39 @@
+import re
+
 from . import helpers, pwpeg
 
+re_regexp = re.compile("/(\\/|[^/])+/([idsmlux]+)?")
+
+def _regexp_action(contents, flags):
+    args = []
+
+    args.append('\'' + contents.replace('\'', '\\\'') + '\'')
+
+    if flags:
+        fs = []
+        for f in flags:
+            fs.append("re.{0}".format(f.upper()))
+        fs = " & ".join(fs)
+        args.append(fs)
+
+    return "re.compile({0})".format(", ".join(args))
+
+def replace_regexps(t):
+    return re_regexp.sub(lambda m: _regexp_action(m.group(0)[1:-1], m.group(2)), t)
+
+def concat(arr):
+    if arr is None or len(arr) == 0:
+        return ""
+
+    res = []
+    for a in arr:
+        if isinstance(a, list):
+            res.append(concat(a))
+        else:
+            res.append(a)
+
+    return "".join(res)
+
 
 class AstNode(object):
     def __repr__(self):
@@ -52,6 +86,12 @@ class AstLookAhead(AstProduction):
         self.symbol = symbol
 
 
+class AstCut(AstProduction):
+    def __init__(self):
+        super(AstCut, self).__init__()
+        self.code = "~"
+
+
 class AstPredicate(AstProduction):
     def __init__(self, code):
         super(AstPredicate, self).__init__()
@@ -95,6 +135,23 @@ class AstProductionChoices(AstProductionGroup):
         return "{0}{1}".format(rules, action)
 
 
+def misplaced_cut(node, committed=False):
+    """ Tell if node has a cut that is not in one of the choices nor of the
+        repetitions of its rule, which are what it commits.
+    """
+    if isinstance(node, AstCut):
+        return not committed
+    if isinstance(node, AstLookAhead):
+        return misplaced_cut(node.production)
+    if not isinstance(node, AstProductionGroup):
+        return False
+
+    committed = committed or bool(node.repetition)
+    if isinstance(node, AstProductionChoices) and len(node.rules) > 1:
+        committed = True
+    return any(misplaced_cut(r, committed) for r in node.rules)
+
+
 
 class AstRuleDeclaration(AstNode):
     def __init__(self, name):
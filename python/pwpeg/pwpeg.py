@@ -2,36 +2,173 @@
     @author Christophe Eymard <christophe@ravelsoft.com>
 """
 
-from re import _pattern_type
-import inspect
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import islice
+from weakref import WeakSet
+import codecs
 import sys
+import re
+import threading
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 if sys.version_info >= (3, 0):
     # Python 3 removed entirely the unicode type, so to have
     # the input isinstance() still work, we just remap it to str (which
     # is unicode anyways)
     unicode = str
+    unichr = chr
+    basestring = str
 u = unicode
 
+# re._pattern_type went away with python 3.7.
+_pattern_type = type(re.compile(""))
+
 
 class SyntaxError(Exception):
-    """ The way the input is parsed is by trial and error.
+    """ The error raised by Parser.parse when the input does not match
+        the grammar.
 
-        When SyntaxError is caught by the parser, it goes up the caller
-        chain to get to the first Choice() it finds to keep looking
-        for a match.
-    """
-    def __init__(self, error, input, suberrors=[]):
-        self.suberrors = suberrors
-        self.line = input.line
-        self.column = input.column
-        self.pos = input.pos
-        super(SyntaxError, self).__init__(error + "({0}:{1})".format(self.line, self.column))
+        The error is either a message, or an object with a message(input)
+        method such as Failure or Expectation ; in which case the message,
+        as well as the line and column, are only computed when the error
+        is displayed.
 
+        The suberrors are the errors of the rules that were tried and
+        led to this one.
+    """
+    def __init__(self, error, input, suberrors=[], pos=None):
+        super(SyntaxError, self).__init__()
+        self.error = error
+        self.input = input
+        self.pos = input.pos if pos is None else pos
+        self.suberrors = [e.error(input) if isinstance(e, Failure) else e for e in suberrors]
+        self._position = None
+
+    @property
+    def line(self):
+        if self._position is None:
+            self._position = self.input.position(self.pos)
+        return self._position[0]
+
+    @property
+    def column(self):
+        if self._position is None:
+            self._position = self.input.position(self.pos)
+        return self._position[1]
+
+    def __str__(self):
+        error = self.error if isinstance(self.error, (str, unicode)) else self.error.message(self.input)
+        return error + "({0}:{1})".format(self.line, self.column)
 
     def fullmessage(self):
         return unicode(self) + "\n" + "\n".join([ "\n".join(["   " + line for line in e.fullmessage().split("\n")]) for e in self.suberrors])
 
+    def detach(self):
+        """ Compute the message and the position of the error and of its
+            suberrors, so that it does not need its input anymore.
+        """
+        if self.input is not None:
+            if not isinstance(self.error, (str, unicode)):
+                self.error = self.error.message(self.input)
+            if self._position is None:
+                self._position = self.input.position(self.pos)
+            self.input = None
+        for e in self.suberrors:
+            e.detach()
+        return self
+
+    def __reduce__(self):
+        # The input and the rules may not be picklable ; the error is sent
+        # with its message and position instead, see Parser.parse_many().
+        error = self.error if isinstance(self.error, (str, unicode)) else self.error.message(self.input)
+        return _detached_syntax_error, (error, self.pos, (self.line, self.column), self.suberrors)
+
+
+def _detached_syntax_error(error, pos, position, suberrors):
+    """ Rebuild a pickled SyntaxError, without its input.
+    """
+    e = SyntaxError(error, None, suberrors, pos)
+    e._position = position
+    return e
+
+
+class Fail(object):
+    """ The type of FAIL, which is what the parse() methods of the rules
+        return when they don't match the input.
+
+        The parse() methods return None when they match.
+    """
+
+    def __repr__(self):
+        return "FAIL"
+
+FAIL = Fail()
+
+
+class Failure(object):
+    """ The record of a rule that did not match the input.
+
+        The way the input is parsed is by trial and error, so failing is the
+        common case ; a failing rule stores a Failure in input.failure and
+        returns FAIL, which is much cheaper than raising an exception.
+
+        Failures are only recorded when the parser keeps the error tree,
+        and their message is only formatted when the SyntaxError they
+        end up in is displayed.
+    """
+
+    __slots__ = ("template", "args", "pos", "suberrors")
+
+    def __init__(self, template, args, pos, suberrors=()):
+        self.template = template
+        self.args = args
+        self.pos = pos
+        self.suberrors = suberrors
+
+    def message(self, input):
+        return self.template.format(*self.args)
+
+    def error(self, input):
+        """ Build the SyntaxError corresponding to this failure.
+        """
+        return SyntaxError(self, input, self.suberrors, self.pos)
+
+
+class Expectation(object):
+    """ The terminal rules that were expected at the farthest position the
+        parser could get to, which is where a failed parse is reported
+        unless the parser keeps the whole tree of failures.
+    """
+
+    def __init__(self, rules, pos):
+        self.rules = rules
+        self.pos = pos
+
+    def message(self, input):
+        names = []
+        for r in self.rules:
+            if r.name not in names:
+                names.append(r.name)
+
+        found = input.at(self.pos)
+
+        if not names:
+            return u("Unexpected \"{0}\"").format(found)
+
+        if len(names) > 1:
+            names = [", ".join(names[:-1]), names[-1]]
+        return u("Expected {0}, but found \"{1}\"").format(" or ".join(names), found)
+
+    def error(self, input):
+        return SyntaxError(self, input, [], self.pos)
+
 
 class IgnoreResult(object):
     """ This class is used by the parsing rules to determine wether to add the
@@ -43,17 +180,27 @@ class IgnoreResult(object):
 
 
 class Results(list):
-    """
+    """ The results of the productions of a rule, when they are its result.
+
+        The rules only build them for the values they give ; the sequences
+        and choices otherwise parse straight into the results of the rule
+        that parses them.
     """
 
-    def __init__(self, name=""):
+    __slots__ = ("name", "dict")
+
+    def __init__(self, name="", values=()):
+        super(Results, self).__init__(values)
         self.name = name
-        self.dict = {}
+        # Only built by add().
+        self.dict = None
 
     def __repr__(self):
         return u("{0}").format(super(Results, self).__repr__())
 
     def add(self, name, value):
+        if self.dict is None:
+            self.dict = {}
         self.dict[name] = len(self)
         self.append(value)
 
@@ -61,12 +208,326 @@ class Results(list):
         return self[self.dict[name]]
 
 
+class Memo(object):
+    """ The packrat memoization table of a parse.
+
+        It maps a (rule, skip, position) triplet to the outcome of parsing
+        the rule at that position ; either the position where it stopped
+        along with what it added to the results, or its Failure.
+
+        Since an outcome is replayed instead of being parsed again, actions
+        are only called once per rule and position.
+
+        Args:
+            max_entries: the maximum number of outcomes to keep, None for
+                an unbounded table.
+            policy: how room is made when max_entries is reached ; "lru" drops
+                the least recently used outcome, "position" drops the outcomes
+                that start the farthest behind in the input.
+    """
+
+    policies = ("lru", "position")
+
+    def __init__(self, max_entries=None, policy="lru"):
+        if policy not in Memo.policies:
+            raise Exception(u("Unknown memoization policy '{0}', expected one of {1}").format(policy, ", ".join(Memo.policies)))
+
+        self.max_entries = max_entries
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # rule name -> [hits, misses]
+        self.rules = {}
+
+    def apply(self, rule, parse, input, currentresults, skip):
+        """ Parse rule with the parse function, or replay its outcome if it
+            was already parsed at the current position.
+        """
+
+        key = (rule, skip, input.pos)
+        entries = self.entries
+        entry = entries.get(key)
+        counts = self.rules.get(rule.name)
+        if counts is None:
+            counts = self.rules[rule.name] = [0, 0]
+
+        if entry is not None:
+            self.hits += 1
+            counts[0] += 1
+
+            if self.max_entries is not None and self.policy == "lru":
+                # Mark the entry as the most recently used.
+                del entries[key]
+                entries[key] = entry
+
+            end, values, failure = entry
+            if end is None:
+                input.failure = failure
+                return FAIL
+            input.seek(end)
+            currentresults.extend(values)
+            return
+
+        self.misses += 1
+        counts[1] += 1
+
+        marks = input.marks
+        mark = marks[-1] if marks else None
+        results = []
+        if parse(input, results, skip) is FAIL:
+            if not marks or marks[-1] is mark:
+                self.store(key, (None, None, input.failure))
+            return FAIL
+
+        # An outcome where a Cut committed the choice around the rule is
+        # not kept, since replaying it would not commit it again.
+        if not marks or marks[-1] is mark:
+            self.store(key, (input.pos, results, None))
+        currentresults.extend(results)
+
+    def store(self, key, entry):
+        entries = self.entries
+        entries[key] = entry
+
+        if self.max_entries is not None and len(entries) > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        entries = self.entries
+
+        if self.policy == "lru":
+            entries.popitem(last=False)
+            self.evictions += 1
+            return
+
+        # Drop a quarter of the table at once, to avoid sorting it
+        # every time an outcome is stored.
+        keys = sorted(entries, key=lambda k: k[2])
+        for k in keys[:max(1, len(keys) // 4)]:
+            del entries[k]
+            self.evictions += 1
+
+    def forget_before(self, pos):
+        """ Drop all the outcomes of rules that started before pos, typically
+            because the parser will never backtrack behind it.
+        """
+
+        for k in [k for k in self.entries if k[2] < pos]:
+            del self.entries[k]
+            self.evictions += 1
+
+    def size(self):
+        """ Get the number of outcomes in the table.
+        """
+        return len(self.entries)
+
+    def report(self):
+        """ Render the hits and misses per rule, most used rules first.
+        """
+
+        total = self.hits + self.misses
+        lines = [u("Packrat memoization: {0} hits, {1} misses ({2:.1f}% hit rate), {3} evictions, {4} entries").format(
+            self.hits, self.misses, 100.0 * self.hits / total if total else 0.0, self.evictions, self.size())]
+
+        for name, (hits, misses) in sorted(self.rules.items(), key=lambda i: -(i[1][0] + i[1][1])):
+            lines.append(u("  {0:>8} hits {1:>8} misses  {2}").format(hits, misses, name))
+
+        return "\n".join(lines)
+
+
+class IncrementalMemo(Memo):
+    """ A Memo that also remembers the part of the input each outcome
+        depends on, so that the outcomes an edit does not touch are reused
+        when parsing the edited text, see edit().
+
+        The outcomes are kept per position in columns, and their positions
+        are relative to the one they start at, so that an edit only has to
+        move the columns that follow it. Whether an outcome is still valid
+        is only checked when it is used, against the edits since the last
+        time it was.
+
+        Along with the outcome, an entry keeps what the rule expected the
+        farthest, which is replayed for the errors to stay the same, and
+        the span [lo, hi) of the input its terminals looked at, see
+        IncrementalInput. The regexps that can't tell how far they looked
+        are kept as checks (regexp, position, end of the match or None),
+        which are tried again after an edit that follows them.
+
+        Args:
+            size: the length of the input.
+    """
+
+    def __init__(self, size):
+        super(IncrementalMemo, self).__init__()
+        self.columns = [None] * (size + 1)
+        # The (offset, removed, inserted) of the edits so far.
+        self.edits = []
+
+    def size(self):
+        return sum(len(c) for c in self.columns if c)
+
+    def apply(self, rule, parse, input, currentresults, skip):
+        pos = input.pos
+        key = (rule, skip)
+        column = self.columns[pos]
+        entry = column.get(key) if column is not None else None
+        if entry is not None and entry[8] != len(self.edits) and not self.valid(entry, pos, input.input):
+            del column[key]
+            entry = None
+
+        counts = self.rules.get(rule.name)
+        if counts is None:
+            counts = self.rules[rule.name] = [0, 0]
+
+        if entry is not None:
+            self.hits += 1
+            counts[0] += 1
+
+            end, values, failure, farthest, expected, lo, hi, checks = entry[:8]
+            input.see(pos + lo, pos + hi)
+            input.checks.extend((r, pos + p, None if e is None else pos + e) for r, p, e in checks)
+            if farthest is not None:
+                input.expect_all(expected, pos + farthest)
+            if end is None:
+                input.failure = failure
+                return FAIL
+            input.seek(pos + end)
+            currentresults.extend(values)
+            return
+
+        self.misses += 1
+        counts[1] += 1
+
+        farthest, expected, lo, hi = input.farthest, input.expected, input.lo, input.hi
+        input.farthest, input.expected, input.lo, input.hi = -1, [], pos, pos
+        first_check = len(input.checks)
+        marks = input.marks
+        mark = marks[-1] if marks else None
+
+        results = []
+        if parse(input, results, skip) is FAIL:
+            entry = [None, None, input.failure]
+        else:
+            entry = [input.pos - pos, results, None]
+        entry += [None if input.farthest == -1 else input.farthest - pos, tuple(input.expected),
+            input.lo - pos, input.hi - pos,
+            tuple((r, p - pos, None if e is None else e - pos) for r, p, e in input.checks[first_check:]),
+            len(self.edits)]
+
+        # Like in Memo.apply(), a rule that committed a choice is not kept.
+        if not marks or marks[-1] is mark:
+            if column is None:
+                column = self.columns[pos] = {}
+            column[key] = entry
+
+        input.farthest, input.expected, input.lo, input.hi = farthest, expected, lo, hi
+        input.see(pos + entry[5], pos + entry[6])
+        if entry[3] is not None:
+            input.expect_all(entry[4], pos + entry[3])
+
+        if entry[0] is None:
+            return FAIL
+        currentresults.extend(results)
+
+    def valid(self, entry, pos, text):
+        """ Tell if the outcome of entry at pos still holds after the edits
+            that were made since it was last checked.
+        """
+        lo, hi, checks = entry[5:8]
+        recheck = False
+        at = pos
+
+        for offset, removed, inserted in reversed(self.edits[entry[8]:]):
+            # Where the entry was before the edit.
+            if at >= offset + inserted:
+                at -= inserted - removed
+            if at + hi <= offset:
+                recheck = True
+            elif at + lo < offset + removed:
+                return False
+
+        # The failures tell where they happened.
+        if entry[2] is not None and at != pos:
+            return False
+
+        if recheck:
+            for regexp, p, e in checks:
+                m = regexp.match(text, pos + p)
+                if (None if m is None else m.end() - pos) != e:
+                    return False
+
+        entry[8] = len(self.edits)
+        return True
+
+    def edit(self, offset, removed, inserted):
+        """ Replace the columns of the removed characters at offset by the
+            ones of the inserted characters, and remember the edit.
+        """
+        self.columns[offset:offset + removed] = [None] * inserted
+        self.edits.append((offset, removed, inserted))
+        return self
+
+
 class Input(object):
     def __init__(self, input):
         self.input = input
         self.pos = 0
-        self.line = 1
-        self.column = 1
+        self.memo = None
+        # When error_tree is set, the Failure of the last rule that did not
+        # match, with the failures that led to it.
+        self.error_tree = False
+        self.failure = None
+        # The farthest position where a terminal rule did not match, and
+        # the terminals that were tried there.
+        self.farthest = -1
+        self.expected = []
+        # Whether the rules compiled to regular expressions may use them,
+        # and whether one of them matched ; they do not record what they
+        # expected on the way.
+        self.regular = True
+        self.regular_matched = False
+        # Whether the positions are the ones of characters, from which an
+        # Either may pick its choices, see Either.dispatch().
+        self.dispatch = True
+        # The outcome of the skip rules per rule and position, see skip().
+        self.skips = {}
+        # The positions the rules being parsed may backtrack to, such as
+        # the start of an Either trying its choices, see Cut.
+        self.marks = []
+        # The position before which forget_before() dropped everything.
+        self.forgotten = 0
+        # The outcomes of the left recursive rules being grown per
+        # (rule, skip, position), and how many grow at a position, see
+        # Rule.grow().
+        self.seeds = {}
+        self.growing = {}
+        # The Profile of the rules, when the parser is profiling.
+        self.profile = None
+        # The Events of the rules when the parser sends some, the events
+        # that may still be retracted, how many were sent before them, and
+        # the rules with handlers being parsed, see Events.
+        self.events = None
+        self.pending = []
+        self.sent = 0
+        self.listening = []
+        # The rules the MemoRule matched, per MemoRule, since the
+        # FunctionRule being parsed started, see MemoRule.parse().
+        self.memorized = {}
+
+    def forget_before(self, pos):
+        """ Drop the outcomes of the rules and of the skips memorized
+            before pos, which won't be looked up again.
+        """
+        if pos <= self.forgotten:
+            return
+        self.forgotten = pos
+        if self.memo is not None:
+            self.memo.forget_before(pos)
+        for skips in self.skips.values():
+            for p in [p for p in skips if p < pos]:
+                del skips[p]
 
     def rewind(self, n):
         self.pos -= n
@@ -74,17 +535,153 @@ class Input(object):
     def rewind_to(self, pos):
         self.rewind(self.pos - pos)
 
+    def seek(self, pos):
+        """ Go to pos, be it before or after the current position.
+        """
+        if pos <= self.pos:
+            self.rewind_to(pos)
+        else:
+            self.advance(self.input[self.pos:pos])
+
     def has_next(self):
         return self.pos < len(self.input)
 
     def current(self):
         return self.input[self.pos] if self.has_next() else None
 
+    def at(self, pos):
+        return self.input[pos] if pos < len(self.input) else None
+
+    def token(self, kind):
+        """ Get the text of the current token if it is of kind, and go past
+            it, or None ; only a TokenInput has tokens.
+        """
+        raise Exception(u("Can't match the token {0}, which needs a TokenInput").format(kind))
+
+    def expect(self, rule):
+        """ Record that the terminal rule did not match at the current
+            position.
+        """
+        pos = self.pos
+
+        if self.error_tree:
+            self.failure = Failure(u("Expected {0}, but found \"{1}\""), (rule.name, self.current()), pos)
+
+        if pos > self.farthest:
+            self.farthest = pos
+            self.expected = [rule]
+        elif pos == self.farthest:
+            self.expected.append(rule)
+
+    def expect_all(self, rules, pos=None):
+        """ Record that the terminal rules were expected at pos, the current
+            position by default, without trying them.
+        """
+        if pos is None:
+            pos = self.pos
+        if pos > self.farthest:
+            self.farthest = pos
+            self.expected = list(rules)
+        elif pos == self.farthest:
+            self.expected.extend(rules)
+
+    def skip(self, rule):
+        """ Advance past what the skip rule matches at the current position.
+
+            Since the same spaces are skipped again after each backtrack, the
+            outcome is remembered per skip rule and position, unless an error
+            tree is wanted.
+        """
+        if self.error_tree or self.skips is None:
+            outcome = self.parse_skip(rule)
+        else:
+            skips = self.skips.get(rule)
+            if skips is None:
+                skips = self.skips[rule] = {}
+            outcome = skips.get(self.pos)
+            if outcome is None:
+                outcome = skips[self.pos] = self.parse_skip(rule)
+
+        end, farthest, expected = outcome
+        self.seek(end)
+        if farthest != -1:
+            self.expect_all(expected, farthest)
+
+    def parse_skip(self, rule):
+        """ Parse the skip rule, and get a tuple (end, farthest, expected) of
+            where it ended and of what it expected the farthest, which is
+            recorded each time it is skipped.
+        """
+        farthest, expected = self.farthest, self.expected
+        self.farthest, self.expected = -1, []
+        pos = self.pos
+        # What was expected before must stay reachable.
+        self.marks.append(_LookAheadMark(pos if farthest == -1 else min(pos, farthest)))
+        # What was matched is not kept, nor sends events.
+        events, self.events = self.events, None
+
+        try:
+            if rule.parse(self, []) is FAIL:
+                # Nothing to skip, which is not worth reporting.
+                outcome = (pos, -1, ())
+            else:
+                outcome = (self.pos, self.farthest, tuple(self.expected))
+        finally:
+            self.events = events
+            self.marks.pop()
+        self.seek(pos)
+        self.farthest, self.expected = farthest, expected
+        return outcome
+
+    def error(self, toprule):
+        """ Get the SyntaxError explaining why toprule did not match.
+        """
+        if self.error_tree and self.failure is not None:
+            return self.failure.error(self)
+
+        if self.farthest == -1:
+            return SyntaxError(u("Could not match {0} ").format(toprule.name), self, [], 0)
+
+        return Expectation(self.expected, self.farthest).error(self)
+
+    def rest(self):
+        """ Get the input that follows the current position.
+        """
+        return self.input[self.pos:]
+
+    def position(self, pos):
+        """ Get the (line, column) of pos.
+        """
+        return self.input.count("\n", 0, pos) + 1, pos - self.input.rfind("\n", 0, pos)
+
+    @property
+    def line(self):
+        return self.position(self.pos)[0]
+
+    @property
+    def column(self):
+        return self.position(self.pos)[1]
+
 
 class TextInput(Input):
+    """ An input over a string.
+
+        Only the position is maintained while parsing ; lines and columns
+        are computed on demand from the offsets of the newlines, which are
+        indexed lazily up to the farthest position that was asked for.
+    """
+
+    newline = "\n"
+
+    def __init__(self, input):
+        super(TextInput, self).__init__(input)
+        self.newlines = []
+        # All the newlines before this position are in self.newlines.
+        self.indexed = 0
+
     def startswith(self, s):
         if self.input.startswith(s, self.pos):
-            self.advance(s)
+            self.pos += len(s)
             return s
         return None
 
@@ -92,524 +689,3278 @@ class TextInput(Input):
         m = re.match(self.input, self.pos)
         if not m:
             return None
-        matched = m.group()
-        self.advance(matched)
-        return matched
-
-    def advance(self, s):
-        if not s: return
-
-        l = len(s)
-        self.line += s.count("\n")
-        self.column = l - s.rfind("\n") - 1
-        self.pos += l
+        self.pos = m.end()
+        return m.group()
 
-    def rewind(self, n):
-        """
+    def match_object(self, re):
+        """ Like match(), but get the match object.
         """
+        m = re.match(self.input, self.pos)
+        if m:
+            self.pos = m.end()
+        return m
 
-        self.line -= self.input.count("\n", self.pos - n, self.pos)
-        self.pos -= n
-        self.column = self.pos - self.input.rfind("\n", 0, self.pos)
+    def advance(self, s):
+        self.pos += len(s)
 
+    def rewind_to(self, pos):
+        self.pos = pos
 
+    def seek(self, pos):
+        self.pos = pos
 
-class TokenInput(Input):
-    # FIXME Create token input.
+    def position(self, pos):
+        newlines = self.newlines
 
-    def __init__(self, tokens, input):
-        pass
+        if pos > self.indexed:
+            find, newline = self.input.find, self.newline
+            i = find(newline, self.indexed)
+            while i != -1 and i < pos:
+                newlines.append(i)
+                i = find(newline, i + 1)
+            self.indexed = pos
 
-    def match(self, reg): raise Exception("Token Inputs can't match regexps")
-    def startswith(self, txt): raise Exception("Token Inputs can't match strings")
+        line = bisect_left(newlines, pos)
+        return line + 1, pos - (newlines[line - 1] if line else -1)
 
 
-class Rule(object):
-    """ A Grammar rule.
+class BytesInput(TextInput):
+    """ An input over UTF-8 encoded bytes, or anything that behaves like
+        them such as an mmap, which is not decoded as a whole.
+
+        Strings and the regular expressions that match bytes as they would
+        match characters, see regexp_bytes(), are matched against the bytes
+        once encoded, and only what they matched is decoded. The others are
+        matched on a window of decoded text around the position, which grows
+        as long as they may read up to its end. Positions are offsets in the
+        bytes, but columns count characters.
     """
 
-    @staticmethod
-    def getrule(obj):
-        """ Get the rule object corresponding to a given type.
-        """
+    newline = b"\n"
 
-        if isinstance(obj, bytes):
-            return StringRule(obj.decode('utf-8'))
+    # How many bytes are decoded at first after the position, for the
+    # regexps that are matched as text.
+    window = 256
 
-        if isinstance(obj, unicode):
-            return StringRule(obj)
+    def __init__(self, input):
+        super(BytesInput, self).__init__(input)
+        # The encoded strings and the regexp_bytes() of the regular
+        # expressions, per string and regular expression of the grammar.
+        self.strings = {}
+        self.regexps = {}
 
-        if isinstance(obj, _pattern_type):
-            return RegexpRule(obj)
+    def startswith(self, s):
+        encoded = self.strings.get(s)
+        if encoded is None:
+            encoded = self.strings[s] = s.encode("utf-8")
+        end = self.pos + len(encoded)
+        if self.input[self.pos:end] == encoded:
+            self.pos = end
+            return s
+        return None
 
-        if callable(obj):
-            return Predicate(obj)
+    def match(self, regexp):
+        compiled = self.regexps.get(regexp)
+        if compiled is None:
+            compiled = self.regexps[regexp] = regexp_bytes(regexp)
 
-        return obj
+        if compiled[0] is None:
+            return self.match_text(regexp, compiled[1])
+        m = compiled[0].match(self.input, self.pos)
+        if not m:
+            return None
+        self.pos = m.end()
+        return m.group().decode("utf-8")
 
+    def boundary(self, pos):
+        """ Get the first position from pos that starts a character.
+        """
+        while pos < len(self.input) and 0x80 <= ord(self.input[pos:pos + 1]) < 0xc0:
+            pos += 1
+        return pos
 
-    def __init__(self, *args):
-        self.action = None
-        self.name = ""
-        self.productions = None
+    def match_text(self, regexp, behind):
+        """ Match regexp on the decoded text, from behind characters before
+            the position to as far as it may read.
+        """
+        lo = self.boundary(max(0, self.pos - 4 * behind))
+        before = len(self.input[lo:self.pos].decode("utf-8"))
+        size = self.window
+        while True:
+            hi = self.boundary(self.pos + size)
+            text = self.input[lo:hi].decode("utf-8")
+            m = regexp.match(text, before)
+            if hi >= len(self.input):
+                break
+            partial = regexp_partial(regexp)
+            if partial is not None and not partial.match(text, before):
+                break
+            size *= 2
 
-        if len(args) > 0:
-            self.set_productions(*args)
+        if not m:
+            return None
+        result = m.group()
+        self.pos += len(result.encode("utf-8"))
+        return result
 
+    def match_object(self, re):
+        raise Exception("Bytes inputs can't be parsed with the rules of compile_regular()")
 
-    def set_productions(self, *args):
-        """
-        """
+    def advance(self, s):
+        self.pos += len(s.encode("utf-8"))
 
-        if len(args) == 0:
-            raise Exception("Can not have empty rules")
+    def current(self):
+        return self.at(self.pos)
 
-        if len(args) > 1 or not isinstance(args[0], Rule):
-            self.productions = [Rule.getrule(r) for r in args]
-        else:
-            self.productions = args
+    def at(self, pos):
+        if pos >= len(self.input):
+            return None
+        c = ord(self.input[pos:pos + 1])
+        if c < 0x80:
+            return ASCII[c]
+        # The length of the character is told by its first byte.
+        n = 2 if c < 0xe0 else 3 if c < 0xf0 else 4
+        return self.input[pos:pos + n].decode("utf-8")
 
-        self.name = "_"
-        self.post_subrule_name(", ".join([s.name for s in self.productions]))
-        return self
+    def rest(self):
+        return self.input[self.pos:].decode("utf-8")
 
-    def post_subrule_name(self, productions_names):
-        self.name = productions_names
+    def position(self, pos):
+        line, column = super(BytesInput, self).position(pos)
+        return line, len(self.input[pos - column + 1:pos].decode("utf-8", "replace")) + 1
 
-    def set_skip(self, skip):
-        self.skip = Rule.getrule(skip)
-        return self
 
-    def set_name(self, name):
-        self.name = name
-        return self
+class IncrementalInput(TextInput):
+    """ A TextInput that tells the IncrementalMemo what part of the text
+        the terminals look at, from lo to hi.
 
-    def try_skip(self, input, skip):
+        Strings look at what they are compared to, and regexps at what
+        regexp_reach() says, which may read before their position. The
+        regexps it can't bound are added to the checks instead.
+    """
 
-        # Override the provided skip if the rule has its own.
-        skip = self.get_skip(skip)
+    def __init__(self, input):
+        super(IncrementalInput, self).__init__(input)
+        # The regexp_reach() of the regexps of the grammar, per regexp.
+        self.reaches = {}
+        self.lo = self.hi = 0
+        self.checks = []
+        # The skips would not tell what they looked at.
+        self.skips = None
+
+    def see(self, lo, hi):
+        if lo < self.lo:
+            self.lo = lo
+        if hi > self.hi:
+            self.hi = hi
 
-        if skip:
-            try:
-                # We create a new Results() variable since we're not
-                # going to store anything that was matched.
-                skip.parse(input, Results())
-            except SyntaxError as e:
-                # Nothing to skip.
-                pass
+    def startswith(self, s):
+        self.see(self.pos, self.pos + len(s))
+        return super(IncrementalInput, self).startswith(s)
+
+    def match(self, regexp):
+        reach = self.reaches.get(regexp)
+        if reach is None:
+            reach = self.reaches[regexp] = regexp_reach(regexp)
+        first, behind, width, beyond = reach
+
+        pos = self.pos
+        m = regexp.match(self.input, pos)
+
+        hi = None
+        if m is not None:
+            end = m.end()
+            if beyond is not None:
+                hi = end + beyond
+            if width is not None:
+                hi = pos + width if hi is None else min(hi, pos + width)
+        else:
+            end = None
+            if first is not None and not first[1] and (pos >= len(self.input) or not can_start(first[0], self.input[pos])):
+                # It could not even start.
+                hi = pos + 1
+            elif width is not None:
+                hi = pos + width
+
+        self.see(-1 if behind is None else pos - behind, pos if hi is None else hi)
+        if hi is None:
+            self.checks.append((regexp, pos, end))
+
+        if m is None:
+            return None
+        self.pos = end
+        return m.group()
 
-    def get_skip(self, skip):
-        return self.skip if 'skip' in self.__dict__ else skip
+    def has_next(self):
+        self.see(self.pos, self.pos + 1)
+        return self.pos < len(self.input)
 
-    def parse(self, input, currentresults=None, skip=None):
-        """ Execute the rules
-        """
-        results = Results(self.name)
+    def current(self):
+        self.see(self.pos, self.pos + 1)
+        return self.input[self.pos] if self.pos < len(self.input) else None
 
-        if not self.productions:
-            raise Exception("There are no productions defined for " + self.name)
 
-        pos_save = input.pos
+class StreamInput(Input):
+    """ An input read from a file-like object, chunk by chunk.
 
-        for r in self.productions:
-            subrule_result = None
+        Only a window of the text is kept in self.input, starting at the
+        absolute position self.offset. The text before the earliest position
+        the parser may come back to, that is the start of the rules still
+        trying alternatives (see Input.marks) and the farthest failure, is
+        released when a new chunk is read. Everything is kept when an error
+        tree is wanted.
 
-            self.try_skip(input, skip)
+        Regular expressions are matched with at least lookahead characters
+        after the current position, and tried again with more text as long
+        as they may have read up to the end of the window, to match, to
+        fail or to stop, see regexp_partial().
 
-            try:
-                r.parse(input, results, self.get_skip(skip))
-            except SyntaxError as e:
-                input.rewind_to(pos_save)
-                raise SyntaxError(u("In {0} ").format(self.name), input, [e])
+        Binary streams are decoded with encoding.
+    """
 
-        if self.action:
-            currentresults.append(self.action(*results))
+    def __init__(self, stream, chunk_size=65536, lookahead=None, encoding="utf-8"):
+        super(StreamInput, self).__init__(u(""))
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.lookahead = chunk_size if lookahead is None else lookahead
+        self.encoding = encoding
+        self.decoder = None
+        self.offset = 0
+        self.eof = False
+        # The width and beyond of the regexp_reach() of the regexps.
+        self.bounds = {}
+        # The number of newlines in the released text, and the position of
+        # the last one.
+        self.released_lines = 0
+        self.released_newline = -1
+
+    def read(self):
+        """ Read a chunk at the end of the window, releasing what is not
+            needed anymore. Returns False at the end of the stream.
+        """
+        chunk = data = self.stream.read(self.chunk_size)
+        if not isinstance(data, unicode):
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder(self.encoding)()
+            chunk = self.decoder.decode(data, not data)
+
+        if not data:
+            self.eof = True
+            if not chunk:
+                return False
+
+        if not self.error_tree:
+            self.release()
+        self.input += chunk
+        return True
+
+    def release(self):
+        keep = self.pos
+        if self.marks:
+            keep = min(keep, min(self.marks))
+        if self.farthest != -1:
+            keep = min(keep, self.farthest)
+
+        n = keep - self.offset
+        if n <= 0:
             return
 
-        if len(results) == 1:
-            currentresults.append(results[0])
-        else:
-            currentresults.append(results)
+        released = self.input[:n]
+        newlines = released.count("\n")
+        if newlines:
+            self.released_lines += newlines
+            self.released_newline = self.offset + released.rfind("\n")
 
+        self.input = self.input[n:]
+        self.offset = keep
+        self.forget_before(keep)
 
-    def __repr__(self):
-        return self.name
+    def fill(self, pos):
+        """ Read until pos is in the window, and tell if it is.
+        """
+        while pos >= self.offset + len(self.input):
+            if self.eof or not self.read():
+                return False
+        return True
 
+    def startswith(self, s):
+        self.fill(self.pos + len(s) - 1)
+        if self.input.startswith(s, self.pos - self.offset):
+            self.pos += len(s)
+            return s
+        return None
 
-    def set_action(self, fn):
-        """ Add an action function to the rules.
+    def match(self, re):
+        m = self.match_object(re)
+        return None if m is None else m.group()
 
-            This is to be used when the processor function is not directly given to
-            the rule in its constructor.
+    def match_object(self, re):
+        """ Like match(), but get the match object, whose positions are
+            relative to the window.
         """
-        if not fn:
-            return self
+        self.fill(self.pos + self.lookahead)
+        m = re.match(self.input, self.pos - self.offset)
+        if not self.eof:
+            bounds = self.bounds.get(re)
+            if bounds is None:
+                bounds = self.bounds[re] = regexp_reach(re)[2:]
+            width, beyond = bounds
+            end = len(self.input)
+            if (width is None or self.pos - self.offset + width > end) and (m is None or beyond is None or m.end() + beyond >= end):
+                while not self.eof and self.reaches_end(re) and self.read():
+                    m = re.match(self.input, self.pos - self.offset)
+        if m:
+            self.pos = self.offset + m.end()
+        return m
+
+    def reaches_end(self, re):
+        """ Tell if the regexp re may read up to the end of the window when
+            tried at the current position.
+        """
+        partial = regexp_partial(re)
+        return partial is None or partial.match(self.input, self.pos - self.offset) is not None
 
-        if inspect.getargspec(fn)[2]:
-            raise Exception("Actions can't take kwargs")
+    def advance(self, s):
+        self.pos += len(s)
 
-        self.action = fn
-        return self
+    def rewind_to(self, pos):
+        self.pos = pos
 
+    def seek(self, pos):
+        self.pos = pos
 
-class StringRule(Rule):
-    def __init__(self, string):
-        self.string = unicode(string)
-        self.name = "\"" + self.string + "\""
+    def has_next(self):
+        return self.fill(self.pos)
 
-    def parse(self, input, currentresults=None, skip=None):
-        if input.startswith(self.string):
-            currentresults.append(self.string)
-        else:
-            raise SyntaxError(u("Expected {0}, but found \"{1}\"").format(self.name, input.current()), input)
+    def current(self):
+        return self.input[self.pos - self.offset] if self.fill(self.pos) else None
 
+    def at(self, pos):
+        return self.input[pos - self.offset] if pos >= self.offset and self.fill(pos) else None
 
-class RegexpRule(Rule):
-    def __init__(self, regexp):
-        self.regexp = regexp
-        self.name = "/" + self.regexp.pattern + "/"
+    def rest(self):
+        return self.input[self.pos - self.offset:]
 
-    def parse(self, input, currentresults=None, skip=None):
+    def position(self, pos):
+        end = pos - self.offset
+        newline = self.input.rfind("\n", 0, end)
+        line = self.released_lines + self.input.count("\n", 0, end) + 1
+        return line, pos - (self.offset + newline if newline != -1 else self.released_newline)
+
+
+
+class Lexer(object):
+    """ Split texts into tokens for a TokenInput, in a single pass.
+
+        The patterns of the tokens are combined into one regular expression,
+        where the first token that matches at a position wins ; keywords go
+        before identifiers. The tokens of the kinds in skip, such as the
+        spaces and the comments, are matched but not kept.
+
+        Args:
+            tokens: the (kind, pattern) of the tokens in order of precedence,
+                the patterns being regexps or strings of regexps.
+            skip: the kinds of the tokens that are dropped.
+    """
+
+    def __init__(self, tokens, skip=()):
+        self.kinds = []
+        ids = {}
+        patterns = []
+        # The id of the kind of the tokens per index of their group in the
+        # expression, None for the ones that are dropped.
+        self.groups = [None]
+
+        for kind, pattern in tokens:
+            regexp = re.compile(pattern) if isinstance(pattern, (bytes, unicode)) else pattern
+            if not isinstance(regexp.pattern, basestring):
+                raise Exception(u("The pattern of the token {0} is bytes, but the tokens are matched on text").format(kind))
+            # The groups are renumbered once combined.
+            if regexp.groupindex or re.search(r"\\[1-9]|\(\?P=|\(\?\(", regexp.pattern):
+                raise Exception(u("The pattern of the token {0} can't refer to its groups").format(kind))
+            if regexp.flags & _UNSCOPED_FLAGS:
+                raise Exception(u("The pattern of the token {0} has flags that can't be combined").format(kind))
+            if regexp.match(""):
+                raise Exception(u("The token {0} can match nothing").format(kind))
+
+            scoped = "".join(c for f, c in _SCOPED_FLAGS if regexp.flags & f)
+            patterns.append(u("({0})").format(u("(?{0}:{1})").format(scoped, regexp.pattern) if scoped else regexp.pattern))
+
+            if kind in skip:
+                id = None
+            else:
+                id = ids.get(kind)
+                if id is None:
+                    id = ids[kind] = len(self.kinds)
+                    self.kinds.append(kind)
+            self.groups.extend([id] + [None] * regexp.groups)
+
+        self.ids = ids
+        self.regexp = re.compile("|".join(patterns))
+
+    def lex(self, text):
+        """ Get the Tokens of text. Raises a SyntaxError where no token
+            matches.
+        """
+        kinds, starts, ends = array("H"), array("l"), array("l")
+        groups = self.groups
+        end = 0
+
+        for m in self.regexp.finditer(text):
+            start = m.start()
+            if start != end:
+                break
+            end = m.end()
+            if start == end:
+                raise Exception(u("A token matched nothing at {0}").format(start))
+            kind = groups[m.lastindex]
+            if kind is not None:
+                kinds.append(kind)
+                starts.append(start)
+                ends.append(end)
+
+        if end != len(text):
+            raise SyntaxError(u("Unexpected \"{0}\"").format(text[end]), TextInput(text), [], end)
+        return Tokens(text, self, kinds, starts, ends)
+
+
+class Tokens(object):
+    """ The tokens a Lexer found in a text, as arrays of the ids of their
+        kinds (see Lexer.kinds) and of their start and end offsets.
+
+        A token is read as a tuple (kind, text).
+    """
+
+    def __init__(self, text, lexer, kinds, starts, ends):
+        self.text = text
+        self.lexer = lexer
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return self.lexer.kinds[self.kinds[i]], self.text[self.starts[i]:self.ends[i]]
+
+
+class TokenInput(Input):
+    """ An input over the Tokens of a text, whose positions are the indexes
+        of the tokens ; backtracking goes back to an index, and nothing is
+        lexed again.
+
+        A Token rule matches a token of its kind, a string a token with
+        the same text and a regexp a token whose whole text it matches.
+        Any matches any token. Their results are the text of the tokens.
+
+        The rules are not compiled to regular expressions, nor are the
+        choices of an Either picked from the current character. The rules
+        written by the standalone backend need a text, and can't parse
+        tokens.
+    """
+
+    def __init__(self, tokens):
+        super(TokenInput, self).__init__(tokens.text)
+        self.tokens = tokens
+        self.ids = tokens.lexer.ids
+        self.kinds = tokens.kinds
+        self.starts = tokens.starts
+        self.ends = tokens.ends
+        self.size = len(tokens)
+        self.regular = False
+        self.dispatch = False
+        # Finds the lines and the columns of the tokens.
+        self.lines = TextInput(tokens.text)
+
+    def token(self, kind):
+        pos = self.pos
+        if pos < self.size and self.kinds[pos] == self.ids.get(kind):
+            self.pos = pos + 1
+            return self.input[self.starts[pos]:self.ends[pos]]
+        return None
+
+    def startswith(self, s):
+        pos = self.pos
+        if pos < self.size:
+            start = self.starts[pos]
+            if self.ends[pos] - start == len(s) and self.input.startswith(s, start):
+                self.pos = pos + 1
+                return s
+        return None
+
+    def match(self, re):
+        pos = self.pos
+        if pos < self.size:
+            end = self.ends[pos]
+            m = re.match(self.input, self.starts[pos], end)
+            if m is not None and m.end() == end:
+                self.pos = pos + 1
+                return m.group()
+        return None
+
+    def advance(self, s):
+        self.pos += 1
+
+    def rewind_to(self, pos):
+        self.pos = pos
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def has_next(self):
+        return self.pos < self.size
+
+    def current(self):
+        return self.at(self.pos)
+
+    def at(self, pos):
+        return self.input[self.starts[pos]:self.ends[pos]] if pos < self.size else None
+
+    def rest(self):
+        return self.input[self.starts[self.pos]:] if self.pos < self.size else ""
+
+    def position(self, pos):
+        return self.lines.position(self.starts[pos] if pos < self.size else len(self.input))
+
+
+# In the character sets computed by Rule.first(), stands for any character
+# beyond ASCII that is not listed explicitly.
+NON_ASCII = "<non-ascii>"
+
+# In the dispatch tables of Either, stands for the ASCII characters that are
+# not listed.
+OTHER_ASCII = "<other-ascii>"
+
+# What Rule.first() says of the rules it knows nothing about.
+UNKNOWN = (None, True, ())
+
+ASCII = [unichr(i) for i in range(128)]
+
+# The escapes of the categories of parsed regexps.
+_SRE_CATEGORIES = {"DIGIT": "\\d", "NOT_DIGIT": "\\D", "SPACE": "\\s", "NOT_SPACE": "\\S",
+    "WORD": "\\w", "NOT_WORD": "\\W"}
+
+def _sre_category(category, flags):
+    """ The characters of a regexp category such as \\d, as a set.
+    """
+    name = str(category).upper().replace("CATEGORY_", "")
+    if name not in _SRE_CATEGORIES:
+        return None
+    regexp = re.compile(_SRE_CATEGORIES[name], flags & ~re.IGNORECASE)
+    return set(c for c in ASCII if regexp.match(c)) | set([NON_ASCII])
+
+def _sre_set(items, flags):
+    """ The characters matched by a [...] set of a parsed regexp.
+    """
+    chars = set()
+    negate = False
+    for op, av in items:
+        op = str(op).upper()
+        if op == "NEGATE":
+            negate = True
+        elif op == "LITERAL":
+            chars.add(unichr(av))
+        elif op == "RANGE":
+            lo, hi = av
+            chars |= set(c for c in ASCII if lo <= ord(c) <= hi)
+            if hi > 127:
+                chars.add(NON_ASCII)
+        elif op == "CATEGORY":
+            category = _sre_category(av, flags)
+            if category is None:
+                return None
+            chars |= category
+        else:
+            return None
+    if negate:
+        return set(c for c in ASCII if c not in chars) | set([NON_ASCII])
+    return chars
+
+def _sre_first(items, flags):
+    """ Get (chars, nullable) for a sequence of parsed regexp items, or None
+        if it can't be determined.
+    """
+    chars = set()
+    for op, av in items:
+        op = str(op).upper()
+        nullable = False
+
+        if op == "LITERAL":
+            first = set([unichr(av)])
+        elif op == "NOT_LITERAL":
+            first = set(c for c in ASCII if ord(c) != av) | set([NON_ASCII])
+        elif op == "ANY":
+            first = set(c for c in ASCII if c != "\n" or flags & re.DOTALL) | set([NON_ASCII])
+        elif op == "IN":
+            first = _sre_set(av, flags)
+            if first is None:
+                return None
+        elif op == "BRANCH":
+            first = set()
+            for branch in av[1]:
+                sub = _sre_first(branch, flags)
+                if sub is None:
+                    return None
+                first |= sub[0]
+                nullable = nullable or sub[1]
+        elif op == "SUBPATTERN":
+            # (group, add_flags, del_flags, pattern) or (group, pattern)
+            subflags = flags | av[1] if len(av) == 4 else flags
+            sub = _sre_first(av[-1], subflags)
+            if sub is None:
+                return None
+            first, nullable = sub
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            sub = _sre_first(av[2], flags)
+            if sub is None:
+                return None
+            first, nullable = sub[0], sub[1] or av[0] == 0
+        elif op in ("AT", "ASSERT", "ASSERT_NOT"):
+            # Zero-width ; they only make the match less likely.
+            first, nullable = set(), True
+        else:
+            return None
+
+        if flags & re.IGNORECASE and first:
+            # Beware of the unicode case folding, which makes some ASCII
+            # letters match characters beyond ASCII.
+            first = first | set(c.swapcase() for c in first if len(c) == 1) | set([NON_ASCII])
+
+        chars |= first
+        if not nullable:
+            return chars, False
+
+    return chars, True
+
+def regexp_first(regexp):
+    """ Get the characters a match of a compiled regexp can start with and
+        whether it can match an empty string, as a tuple (chars, nullable),
+        or None if the regexp is too involved to tell.
+    """
+    if not isinstance(regexp.pattern, basestring):
+        return None
+    key = (regexp.pattern, regexp.flags)
+    if key in _regexp_firsts:
+        return _regexp_firsts[key]
+    try:
+        parsed = sre_parse.parse(regexp.pattern, regexp.flags)
+    except Exception:
+        return None
+    flags = regexp.flags
+    if hasattr(parsed, "state"):
+        flags |= parsed.state.flags
+    elif hasattr(parsed, "pattern"):
+        flags |= parsed.pattern.flags
+    first = _sre_first(list(parsed), flags)
+    if first is not None:
+        chars = first[0]
+        if not isinstance(regexp.pattern, unicode) and any(len(c) == 1 and ord(c) > 127 for c in chars):
+            # The bytes of a python 2 str pattern beyond ASCII are not the
+            # characters of the same code.
+            chars = set(c for c in chars if len(c) > 1 or ord(c) < 128) | set([NON_ASCII])
+        first = (frozenset(chars), first[1])
+    _regexp_firsts[key] = first
+    return first
+
+# The results of regexp_first() per pattern and flags, since grammars use the
+# same regexps in many rules.
+_regexp_firsts = {}
+
+def _sre_width(items):
+    """ Get the most characters a sequence of parsed regexp items can read
+        from where it starts, look-aheads included, or None if it is not
+        bounded.
+    """
+    width = 0
+    for op, av in items:
+        op = str(op).upper()
+        if op in ("LITERAL", "NOT_LITERAL", "ANY", "IN"):
+            width += 1
+        elif op == "AT":
+            pass
+        elif op in ("SUBPATTERN", "ATOMIC_GROUP"):
+            sub = _sre_width(av[-1] if op == "SUBPATTERN" else av)
+            if sub is None:
+                return None
+            width += sub
+        elif op == "BRANCH":
+            subs = [_sre_width(branch) for branch in av[1]]
+            if None in subs:
+                return None
+            width += max(subs)
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            sub = _sre_width(av[2])
+            if sub is None or (sub and av[1] == sre_parse.MAXREPEAT):
+                return None
+            width += sub * av[1]
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            if av[0] < 0:
+                # Look-behinds read before the start.
+                continue
+            sub = _sre_width(av[1])
+            if sub is None:
+                return None
+            width += sub
+        else:
+            return None
+    return width
+
+def _sre_behind(items):
+    """ Get how many characters before where it is tried a sequence of
+        parsed regexp items can read.
+    """
+    behind = 0
+    for op, av in items:
+        op = str(op).upper()
+        if op == "AT":
+            # Anchors and word boundaries look at the previous character.
+            behind = max(behind, 1)
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            if av[0] < 0:
+                behind = max(behind, _sre_width(av[1]) or 0)
+            behind = max(behind, _sre_behind(av[1]))
+        elif op in ("SUBPATTERN", "ATOMIC_GROUP"):
+            behind = max(behind, _sre_behind(av[-1] if op == "SUBPATTERN" else av))
+        elif op == "BRANCH":
+            for branch in av[1]:
+                behind = max(behind, _sre_behind(branch))
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            behind = max(behind, _sre_behind(av[2]))
+    return behind
+
+def _sre_beyond(items, follow, flags):
+    """ Get how many characters past the end of its match a sequence of
+        parsed regexp items can read, when what follows it starts with
+        the characters of follow, or None if it can't be told.
+
+        This is only known when the sequence never has to backtrack, that is
+        when its repetitions and choices are decided by the next character.
+    """
+    beyond = 0
+    for i, (op, av) in enumerate(items):
+        op = str(op).upper()
+
+        rest = _sre_first(items[i + 1:], flags)
+        if rest is None:
+            return None
+        after = rest[0] | follow if rest[1] else rest[0]
+
+        if op in ("LITERAL", "NOT_LITERAL", "ANY", "IN"):
+            continue
+        elif op == "AT":
+            beyond = max(beyond, 1)
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            if av[0] >= 0:
+                width = _sre_width(av[1])
+                if width is None:
+                    return None
+                beyond = max(beyond, width + 1)
+        elif op in ("SUBPATTERN", "ATOMIC_GROUP"):
+            sub = _sre_beyond(av[-1] if op == "SUBPATTERN" else av, after, flags)
+            if sub is None:
+                return None
+            beyond = max(beyond, sub)
+        elif op == "BRANCH":
+            # Only one of the choices must be able to start with a given
+            # character, the last one being the only one that may be empty,
+            # after the others read what they could.
+            seen = set()
+            last = len(av[1]) - 1
+            for j, branch in enumerate(av[1]):
+                first = _sre_first(branch, flags)
+                if first is None or first[0] & seen or (first[1] and j != last):
+                    return None
+                seen |= first[0]
+                sub = _sre_beyond(branch, after, flags)
+                if sub is None:
+                    return None
+                beyond = max(beyond, sub, 1)
+                if j == last and first[1]:
+                    widths = [_sre_width(b) for b in av[1][:-1]]
+                    if None in widths:
+                        return None
+                    beyond = max([beyond] + widths)
+        elif op in ("MAX_REPEAT", "POSSESSIVE_REPEAT"):
+            first = _sre_first(av[2], flags)
+            width = _sre_width(av[2])
+            if first is None or first[1] or width is None:
+                return None
+            if op == "MAX_REPEAT" and av[0] != av[1] and first[0] & after:
+                # It may give back what it matched for the rest to match.
+                return None
+            sub = _sre_beyond(av[2], first[0] | after, flags)
+            if sub is None:
+                return None
+            # The last repetition that was tried may read a whole body.
+            beyond = max(beyond, sub + width)
+        else:
+            return None
+    return beyond
+
+def regexp_reach(regexp):
+    """ Tell how much of the input a compiled regexp can look at, as a
+        tuple (first, behind, width, beyond) where first is the result of
+        regexp_first(), behind how many characters before the position it
+        is tried at it can read, width how many it can read from there, and
+        beyond how many past the end of a match. width and beyond are None
+        when they can't be bounded, and behind is None if it can't be
+        told at all.
+    """
+    key = (regexp.pattern, regexp.flags)
+    if key in _regexp_reaches:
+        return _regexp_reaches[key]
+    first = regexp_first(regexp)
+    if first is None:
+        reach = None, None, None, None
+    else:
+        parsed = list(sre_parse.parse(regexp.pattern, regexp.flags))
+        width = _sre_width(parsed)
+        reach = first, _sre_behind(parsed), None if width is None else width + 1, _sre_beyond(parsed, set(), regexp.flags)
+    _regexp_reaches[key] = reach
+    return reach
+
+# The results of regexp_reach() per pattern and flags.
+_regexp_reaches = {}
+
+# The anchors of parsed regexps.
+_SRE_ANCHORS = {"AT_BEGINNING": "^", "AT_BEGINNING_STRING": "\\A", "AT_BOUNDARY": "\\b",
+    "AT_NON_BOUNDARY": "\\B", "AT_END": "$", "AT_END_STRING": "\\Z"}
+
+# The letters of the flags a group of a parsed regexp may set, without
+# re.VERBOSE which only matters to the parsing.
+_SRE_FLAGS = [(re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.LOCALE, "L"),
+    (re.UNICODE, "u"), (getattr(re, "ASCII", 0), "a"), (re.VERBOSE, "")]
+
+def _sre_flags(flags):
+    letters = ""
+    for flag, letter in _SRE_FLAGS:
+        if flag and flags & flag:
+            letters += letter
+            flags &= ~flag
+    if flags:
+        raise ValueError("Unknown flags {0}".format(flags))
+    return letters
+
+def _sre_group(av):
+    """ Open a non capturing group with the flags of a SUBPATTERN.
+    """
+    if len(av) < 4:
+        return "(?:"
+    add, remove = _sre_flags(av[1]), _sre_flags(av[2])
+    return "(?" + add + ("-" + remove if remove else "") + ":"
+
+def _sre_atomic(items):
+    """ Turn the look-aheads followed by a back reference to what they
+        matched, with which atomic groups are written without them, into
+        the atomic groups they are.
+    """
+    items = list(items)
+    result = []
+    i = 0
+    while i < len(items):
+        op, av = items[i]
+        i += 1
+        if str(op).upper() == "ASSERT" and av[0] >= 0 and len(av[1]) == 1 and i < len(items):
+            sub_op, sub_av = av[1][0]
+            ref_op, ref_av = items[i]
+            if str(sub_op).upper() == "SUBPATTERN" and str(ref_op).upper() == "GROUPREF" and ref_av == sub_av[0]:
+                op, av = "ATOMIC", sub_av
+                i += 1
+        result.append((op, av))
+    return result
+
+def _sre_pattern(items):
+    """ Write a sequence of parsed regexp items back as a pattern, without
+        its groups. Back references are written as anything.
+    """
+    out = []
+    for op, av in _sre_atomic(items):
+        op = str(op).upper()
+        if op == "LITERAL":
+            out.append(re.escape(unichr(av)))
+        elif op == "NOT_LITERAL":
+            out.append("[^" + re.escape(unichr(av)) + "]")
+        elif op == "ANY":
+            out.append(".")
+        elif op == "IN":
+            out.append(_sre_class(av))
+        elif op == "AT":
+            out.append(_SRE_ANCHORS[str(av).upper()])
+        elif op == "BRANCH":
+            out.append("(?:" + "|".join(_sre_pattern(branch) for branch in av[1]) + ")")
+        elif op == "SUBPATTERN":
+            out.append(_sre_group(av) + _sre_pattern(av[-1]) + ")")
+        elif op == "ATOMIC":
+            out.append(_sre_group(av) + _sre_pattern(av[-1]) + ")")
+        elif op == "ATOMIC_GROUP":
+            out.append("(?>" + _sre_pattern(av) + ")")
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            lo, hi, sub = av
+            count = "{{{0},}}".format(lo) if hi == sre_parse.MAXREPEAT else "{{{0},{1}}}".format(lo, hi)
+            lazy = {"MAX_REPEAT": "", "MIN_REPEAT": "?", "POSSESSIVE_REPEAT": "+"}[op]
+            out.append("(?:" + _sre_pattern(sub) + ")" + count + lazy)
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            kind = "=" if op == "ASSERT" else "!"
+            out.append("(?" + ("<" if av[0] < 0 else "") + kind + _sre_pattern(av[1]) + ")")
+        elif op == "GROUPREF":
+            out.append("[\\s\\S]*")
+        elif op == "GROUPREF_EXISTS":
+            out.append("(?:" + _sre_pattern(av[1]) + "|" + _sre_pattern(av[2] or []) + ")")
+        else:
+            raise ValueError("Unknown regexp item {0}".format(op))
+    return "".join(out)
+
+def _sre_class(items):
+    out = "["
+    for op, av in items:
+        op = str(op).upper()
+        if op == "NEGATE":
+            out += "^"
+        elif op == "LITERAL":
+            out += re.escape(unichr(av))
+        elif op == "RANGE":
+            out += re.escape(unichr(av[0])) + "-" + re.escape(unichr(av[1]))
+        elif op == "CATEGORY":
+            out += _SRE_CATEGORIES[str(av).upper().replace("CATEGORY_", "")]
+        else:
+            raise ValueError("Unknown regexp set item {0}".format(op))
+    return out + "]"
+
+def _sre_partial(items):
+    """ Write a pattern that matches where a sequence of parsed regexp
+        items could read up to the end of the text when tried there, be it
+        to match, to fail or to stop.
+    """
+    partial = None
+    for op, av in reversed(_sre_atomic(items)):
+        op = str(op).upper()
+        if op in ("LITERAL", "NOT_LITERAL", "ANY", "IN"):
+            here = "\\Z"
+        elif op == "AT":
+            name = str(av).upper()
+            # ^ and \A look behind, and $ also tells a last newline.
+            here = "(?!)" if name.startswith("AT_BEGINNING") else "\\n?\\Z" if name == "AT_END" else "\\Z"
+        elif op in ("SUBPATTERN", "ATOMIC"):
+            here = _sre_group(av) + _sre_partial(av[-1]) + ")"
+        elif op == "ATOMIC_GROUP":
+            here = "(?:" + _sre_partial(av) + ")"
+        elif op == "BRANCH":
+            here = "(?:" + "|".join(_sre_partial(branch) for branch in av[1]) + ")"
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            lo, hi, sub = av
+            if hi == 0:
+                here = "(?!)"
+            else:
+                count = "*" if hi == sre_parse.MAXREPEAT else "{{0,{0}}}".format(hi - 1)
+                here = "(?:" + _sre_pattern(sub) + ")" + count + "(?:" + _sre_partial(sub) + ")"
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            here = "(?!)" if av[0] < 0 else "(?:" + _sre_partial(av[1]) + ")"
+        elif op == "GROUPREF":
+            # It may read as far as what it refers to is long.
+            here = ""
+        elif op == "GROUPREF_EXISTS":
+            here = "(?:" + _sre_partial(av[1]) + "|" + _sre_partial(av[2] or []) + ")"
+        else:
+            raise ValueError("Unknown regexp item {0}".format(op))
+        if partial is not None:
+            here = "(?:" + here + "|" + _sre_pattern([(op, av)]) + partial + ")"
+        partial = here
+    return "(?!)" if partial is None else partial
+
+def regexp_partial(regexp):
+    """ Get a compiled regexp that matches where regexp, tried at the same
+        position, could read up to the end of the text, so that it may
+        match differently once more text is there. It is None if regexp is
+        too involved to tell.
+    """
+    key = (regexp.pattern, regexp.flags)
+    if key in _regexp_partials:
+        return _regexp_partials[key]
+    try:
+        parsed = list(sre_parse.parse(regexp.pattern, regexp.flags))
+        partial = re.compile(_sre_partial(parsed), regexp.flags & ~re.VERBOSE)
+    except Exception:
+        partial = None
+    _regexp_partials[key] = partial
+    return partial
+
+# The results of regexp_partial() per pattern and flags.
+_regexp_partials = {}
+
+def _sre_bytewise(items):
+    """ Tell if a sequence of parsed regexp items matches UTF-8 bytes as it
+        matches the characters they encode, that is when it only tells
+        ASCII characters apart from the others.
+    """
+    for op, av in items:
+        op = str(op).upper()
+        if op == "LITERAL":
+            if av > 127:
+                return False
+        elif op == "IN":
+            for item_op, item_av in av:
+                item_op = str(item_op).upper()
+                if item_op not in ("LITERAL", "RANGE") or max(item_av if item_op == "RANGE" else [item_av]) > 127:
+                    return False
+        elif op == "AT":
+            # Word boundaries look at a single byte.
+            if str(av).upper() in ("AT_BOUNDARY", "AT_NON_BOUNDARY"):
+                return False
+        elif op == "SUBPATTERN":
+            if len(av) == 4 and av[1] & re.IGNORECASE:
+                return False
+            if not _sre_bytewise(av[-1]):
+                return False
+        elif op == "ATOMIC_GROUP":
+            if not _sre_bytewise(av):
+                return False
+        elif op == "BRANCH":
+            if not all(_sre_bytewise(branch) for branch in av[1]):
+                return False
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            if not _sre_bytewise(av[2]):
+                return False
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            if not _sre_bytewise(av[1]):
+                return False
+        elif op != "GROUPREF":
+            # The . and the negations match a byte of a character.
+            return False
+    return True
+
+def regexp_bytes(regexp):
+    """ Get how to match a compiled regexp on UTF-8 bytes, as a tuple
+        (compiled, behind) where compiled is the regexp for the bytes if
+        it matches them as it would match the characters, and None if it
+        must be matched on the decoded text, from behind characters before
+        the position.
+    """
+    key = (regexp.pattern, regexp.flags)
+    if key in _regexp_bytes:
+        return _regexp_bytes[key]
+    pattern = regexp.pattern
+    if not isinstance(pattern, basestring):
+        result = regexp, 0
+    else:
+        parsed = list(sre_parse.parse(pattern, regexp.flags))
+        if regexp.flags & re.IGNORECASE or not _sre_bytewise(parsed):
+            result = None, _sre_behind(parsed)
+        else:
+            if isinstance(pattern, unicode):
+                pattern = pattern.encode("utf-8")
+            result = re.compile(pattern, regexp.flags & ~re.UNICODE), 0
+    _regexp_bytes[key] = result
+    return result
+
+# The results of regexp_bytes() per pattern and flags.
+_regexp_bytes = {}
+
+def can_start(chars, c):
+    """ Tell if the character c, or OTHER_ASCII or NON_ASCII, is in a set
+        computed by Rule.first().
+    """
+    if c in chars:
+        return True
+    if c == OTHER_ASCII:
+        return False
+    return NON_ASCII in chars and (c == NON_ASCII or ord(c) > 127)
+
+
+# The flag of inspect.CO_VARKEYWORDS.
+_CO_VARKEYWORDS = 0x08
+
+def _takes_kwargs(fn):
+    """ Whether fn takes **kwargs, read from its code when it has some
+        rather than with the inspect module, which is slow to import.
+    """
+    code = getattr(getattr(fn, "__func__", fn), "__code__", None)
+    if code is not None:
+        return bool(code.co_flags & _CO_VARKEYWORDS)
+    import inspect
+    # getargspec() is gone from python 3.11, and python 2 only has it.
+    getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
+    try:
+        return bool(getargspec(fn)[2])
+    except TypeError:
+        # Builtins such as int do not tell their arguments.
+        return False
+
+
+class Rule(object):
+    """ A Grammar rule.
+    """
+
+    productions = None
+
+    # The Regular versions of the rule per skip, see compile_regular().
+    regular = None
+
+    # Whether the rule may parse itself again at the same position, see
+    # find_left_recursion().
+    left_recursive = False
+
+    # The production of a rule that only has one, which parses straight into
+    # the results of the rule. Predicates do not, since they are given the
+    # results of their own rule.
+    single = None
+
+    @staticmethod
+    def getrule(obj):
+        """ Get the rule object corresponding to a given type.
+        """
+
+        if isinstance(obj, bytes):
+            return StringRule(obj.decode('utf-8'))
+
+        if isinstance(obj, unicode):
+            return StringRule(obj)
+
+        if isinstance(obj, _pattern_type):
+            return RegexpRule(obj)
+
+        # FunctionRule are callable, but are rules nonetheless.
+        if callable(obj) and not isinstance(obj, Rule):
+            return Predicate(obj)
+
+        return obj
+
+
+    def __init__(self, *args):
+        self.action = None
+        self.productions = None
+
+        if len(args) > 0:
+            self.set_productions(*args)
+
+    def __getattr__(self, attribute):
+        # The name of a rule is only written from the ones of its sub rules
+        # when it is first asked for, as most never are. A rule that was not
+        # given a name nor productions yet has an empty one.
+        if attribute != "name":
+            raise AttributeError(attribute)
+
+        # A recursive rule sees this one while its name is being written.
+        self.name = "_"
+        names = self.subrule_names()
+        if names is None:
+            del self.name
+            return ""
+        self.post_subrule_name(names)
+        return self.name
+
+
+    def set_productions(self, *args):
+        """
+        """
+
+        if len(args) == 0:
+            raise Exception("Can not have empty rules")
+
+        if len(args) > 1 or not isinstance(args[0], Rule):
+            self.productions = [Rule.getrule(r) for r in args]
+        else:
+            self.productions = args
+
+        self.single = self.productions[0] if len(self.productions) == 1 and not isinstance(self.productions[0], Predicate) else None
+        return self
+
+    def subrule_names(self):
+        """ The names the one of the rule is written from, or None.
+        """
+        if self.productions is None:
+            return None
+        return ", ".join([s.name for s in self.productions])
+
+    def post_subrule_name(self, productions_names):
+        self.name = productions_names
+
+    def set_skip(self, skip):
+        self.skip = Rule.getrule(skip)
+        return self
+
+    def set_name(self, name):
+        self.name = name
+        return self
+
+    def try_skip(self, input, skip):
+
+        # Override the provided skip if the rule has its own.
+        skip = self.get_skip(skip)
+
+        if skip:
+            input.skip(skip)
+
+    def get_skip(self, skip):
+        return self.skip if 'skip' in self.__dict__ else skip
+
+    def parse_at(self, input, pos, skip=None):
+        """ Parse the rule at pos and get a tuple (end position, result), or
+            None if it did not match.
+
+            This is how the parsers written by the standalone backend call
+            the rules they did not generate.
+        """
+        input.seek(pos)
+        results = []
+        if self.parse(input, results, skip) is FAIL:
+            return None
+        return input.pos, results[0] if results else None
+
+    def skip_from(self, input, pos):
+        """ Get the position after this rule used as a skip at pos.
+        """
+        input.seek(pos)
+        input.skip(self)
+        return input.pos
+
+    def first(self, skip=None, seen=None):
+        """ Tell what the rule can start with when it inherits skip.
+
+            Returns a tuple (chars, nullable, terminals) ; chars are the
+            characters a match can start with (see can_start()), or None
+            if they can't be told. nullable is True if the rule may match
+            without consuming anything, and terminals are the terminal rules
+            it tries first, which are the ones it expects when it is not
+            tried at all.
+
+            seen holds the rules that are being analyzed ; a rule that
+            comes back to itself is UNKNOWN.
+        """
+        if seen is None:
+            seen = {}
+        key = (self, skip)
+        if key in seen:
+            return seen[key] or UNKNOWN
+        seen[key] = None
+        seen[key] = self._first(skip, seen)
+        return seen[key]
+
+    def _first(self, skip, seen):
+        if not self.productions:
+            return UNKNOWN
+
+        skip = self.get_skip(skip)
+        skip_first = skip.first(None, seen) if skip else (frozenset(), True, ())
+        if skip_first[0] is None:
+            return UNKNOWN
+
+        chars, terminals = set(), []
+        for r in self.productions:
+            # The skip is tried before each production.
+            chars |= skip_first[0]
+            c, nullable, t = r.first(skip, seen)
+            if c is None:
+                return UNKNOWN
+            chars |= c
+            terminals.extend(t)
+            if not nullable:
+                return frozenset(chars), False, tuple(terminals)
+
+        return frozenset(chars), True, tuple(terminals)
+
+    def parse_regular(self, input, currentresults, skip):
+        """ Parse with the regular expression the rule was compiled to
+            for this skip, if any.
+
+            Failures are reported by parsing the rule as usual, so this
+            returns FAIL for them as well as when the rule was not compiled
+            or when the input does not want them.
+        """
+        regular = self.regular.get(skip)
+        if regular is None or not input.regular:
+            return FAIL
+        return regular.parse(input, currentresults)
+
+    def subrules(self, skip):
+        """ Get the (rule, skip) tuples the rule parses with when it
+            inherits skip.
+        """
+        if not self.productions:
+            return []
+        subskip = self.get_skip(skip)
+        subrules = [(r, subskip) for r in self.productions]
+        if subskip:
+            subrules.append((subskip, None))
+        return subrules
+
+    def left_subrules(self, skip):
+        """ Get the subrules() the rule may parse at the position it
+            is parsed at, before it consumes anything.
+        """
+        if not self.productions:
+            return self.subrules(skip)
+        subskip = self.get_skip(skip)
+        left = [(subskip, None)] if subskip else []
+        for r in self.productions:
+            left.append((r, subskip))
+            if not r.first(subskip)[1]:
+                break
+        return left
+
+    def _regular(self, skip, compiler):
+        """ Get a tuple (pattern, build) for the rule, where build gets the
+            result of the rule from the match, or is None if the rule has no
+            result. Returns None when the rule is not regular.
+        """
+        if self.__class__ is not Rule or not self.productions:
+            return None
+
+        sequence = compiler.sequence(self.productions, self.get_skip(skip))
+        if sequence is None:
+            return None
+        pattern, builds = sequence
+
+        def build(m):
+            results = Results(self.name)
+            for b in builds:
+                results.append(b(m))
+            if self.action:
+                return self.action(*results)
+            if len(results) == 1:
+                return results[0]
+            return results
+
+        return pattern, build
+
+    def parse(self, input, currentresults=None, skip=None):
+        """ Execute the rules, or replay their outcome if the parser
+            does packrat memoization.
+        """
+        if self.regular is not None and self.parse_regular(input, currentresults, skip) is not FAIL:
+            return
+
+        if self.left_recursive:
+            return self.grow(input, currentresults, skip)
+
+        # The outcomes at a position where a left recursive rule grows
+        # depend on its seed.
+        if input.memo is not None and input.pos not in input.growing:
+            return input.memo.apply(self, self._parse, input, currentresults, skip)
+        return self._parse(input, currentresults, skip)
+
+    def grow(self, input, currentresults, skip):
+        """ Parse a left recursive rule, by growing a seed.
+
+            Where the rule comes back to itself at the same position, it
+            gets the outcome of its previous parse there, which is first
+            a failure. The rule is parsed again as long as this makes it
+            match farther, so that `e = e "-" n | n` builds ((n - n) - n).
+        """
+        pos = input.pos
+        # The skip it is given does not matter when it has its own.
+        key = (self, self.get_skip(skip), pos)
+        seed = input.seeds.get(key)
+        if seed is not None:
+            end, values, used, pending = seed
+            seed[2] = True
+            if end is None:
+                if input.error_tree:
+                    input.failure = Failure(u("In {0}, left recursion"), (self.name,), pos)
+                return FAIL
+            input.seek(end)
+            currentresults.extend(values)
+            input.pending.extend(pending)
+            return
+
+        if input.memo is not None and pos not in input.growing:
+            return input.memo.apply(self, self._grow, input, currentresults, skip)
+        return self._grow(input, currentresults, skip)
+
+    def _grow(self, input, currentresults, skip):
+        pos = input.pos
+        key = (self, self.get_skip(skip), pos)
+        seeds, growing = input.seeds, input.growing
+        # The outcome and the events of the last parse that grew.
+        seed = seeds[key] = [None, None, False, ()]
+        growing[pos] = growing.get(pos, 0) + 1
+        pending = input.pending
+        n = len(pending)
+
+        try:
+            while True:
+                results = []
+                if self._parse(input, results, skip) is FAIL or (seed[0] is not None and input.pos <= seed[0]):
+                    break
+                seed[0], seed[1], seed[3] = input.pos, results, pending[n:]
+                del pending[n:]
+                if not seed[2]:
+                    # It did not come back to itself.
+                    break
+                seed[2] = False
+                input.seek(pos)
+        finally:
+            del seeds[key]
+            del pending[n:]
+            growing[pos] -= 1
+            if not growing[pos]:
+                del growing[pos]
+
+        if seed[0] is None:
+            return FAIL
+        input.seek(seed[0])
+        currentresults.extend(seed[1])
+        pending.extend(seed[3])
+
+    def _parse(self, input, currentresults=None, skip=None):
+        if not self.productions:
+            raise Exception("There are no productions defined for " + self.name)
+
+        pos_save = input.pos
+        subskip = self.get_skip(skip)
+        single = self.single
+
+        if single is not None:
+            n = len(currentresults)
+            self.try_skip(input, skip)
+            if single.parse(input, currentresults, subskip) is FAIL:
+                input.rewind_to(pos_save)
+                if input.error_tree:
+                    input.failure = Failure(u("In {0} "), (self.name,), pos_save, [input.failure])
+                return FAIL
+            return self.gather(currentresults, n)
+
+        # The values only need to be a Results when they are the result.
+        results = [] if self.action else Results(self.name)
+
+        for r in self.productions:
+            self.try_skip(input, skip)
+
+            if r.parse(input, results, subskip) is FAIL:
+                input.rewind_to(pos_save)
+                if input.error_tree:
+                    input.failure = Failure(u("In {0} "), (self.name,), pos_save, [input.failure])
+                return FAIL
+
+        if self.action:
+            currentresults.append(self.action(*results))
+            return
+
+        if len(results) == 1:
+            currentresults.append(results[0])
+        else:
+            currentresults.append(results)
+
+    def gather(self, currentresults, n):
+        """ Turn the values a single production added to currentresults
+            after n into the result of the rule.
+        """
+        if len(currentresults) == n + 1:
+            if self.action:
+                currentresults[n] = self.action(currentresults[n])
+            return
+
+        # A look-ahead, which has no value.
+        results = Results(self.name, currentresults[n:])
+        del currentresults[n:]
+        if self.action:
+            currentresults.append(self.action(*results))
+        else:
+            currentresults.append(results)
+
+
+    def __repr__(self):
+        return self.name
+
+
+    def set_action(self, fn):
+        """ Add an action function to the rules.
+
+            This is to be used when the processor function is not directly given to
+            the rule in its constructor.
+        """
+        if not fn:
+            return self
+
+        if _takes_kwargs(fn):
+            raise Exception("Actions can't take kwargs")
+
+        self.action = fn
+        return self
+
+
+class StringRule(Rule):
+    def __init__(self, string):
+        self.string = unicode(string)
+        self.name = "\"" + self.string + "\""
+
+    def first(self, skip=None, seen=None):
+        if not self.string:
+            return frozenset(), True, ()
+        return frozenset([self.string[0]]), False, (self,)
+
+    def _regular(self, skip, compiler):
+        return re.escape(self.string), lambda m: self.string
+
+    def parse(self, input, currentresults=None, skip=None):
+        if input.startswith(self.string):
+            currentresults.append(self.string)
+        else:
+            input.expect(self)
+            return FAIL
+
+
+# The flags of regexps as plain integers, since the operators of the RegexFlag
+# enum are slow.
+# Python 2 has no flags that apply to a part of a pattern, and its patterns
+# only match unicode with re.UNICODE.
+_UNSCOPED_FLAGS = int(re.VERBOSE | re.LOCALE | re.DEBUG | (re.UNICODE if sys.version_info < (3, 0) else 0))
+_FLAGS_SCOPE = sys.version_info >= (3, 7)
+_SCOPED_FLAGS = ((int(re.IGNORECASE), "i"), (int(re.MULTILINE), "m"), (int(re.DOTALL), "s"), (int(getattr(re, "ASCII", 0)), "a"))
+
+class RegexpRule(Rule):
+    def __init__(self, regexp):
+        self.regexp = regexp
+        self.name = "/" + self.regexp.pattern + "/"
+
+    def first(self, skip=None, seen=None):
+        first = regexp_first(self.regexp)
+        if first is None:
+            return UNKNOWN
+        if first[1]:
+            # It never fails.
+            return frozenset(first[0]), True, ()
+        return frozenset(first[0]), False, (self,)
+
+    def _regular(self, skip, compiler):
+        pattern, flags = self.regexp.pattern, self.regexp.flags
+        # The groups are renumbered once embedded, and names could clash.
+        if not isinstance(pattern, basestring) or self.regexp.groupindex or re.search(r"\\[1-9]|\(\?P=|\(\?\(", pattern):
+            return None
+        if flags & _UNSCOPED_FLAGS:
+            return None
+        if not isinstance(pattern, unicode):
+            try:
+                pattern = pattern.decode("ascii")
+            except UnicodeDecodeError:
+                return None
+
+        scoped = "".join(c for f, c in _SCOPED_FLAGS if flags & f)
+        if scoped and not _FLAGS_SCOPE:
+            return None
+        group = compiler.group()
+        return compiler.named(group, compiler.atomic(u("(?{0}:{1})").format(scoped, pattern))), lambda m: m.group(group)
+
+    def parse(self, input, currentresults=None, skip=None):
         match = input.match(self.regexp)
         if match is not None:
             currentresults.append(match)
         else:
-            raise SyntaxError(u("Expected {0}, but found \"{1}\"").format(self.name, input.current()), input)
+            input.expect(self)
+            return FAIL
+
+
+class Token(Rule):
+    """ A token of the kind when parsing a TokenInput, whose result is its
+        text.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.name = kind
+
+    def first(self, skip=None, seen=None):
+        return UNKNOWN
+
+    def parse(self, input, currentresults=None, skip=None):
+        token = input.token(self.kind)
+        if token is not None:
+            currentresults.append(token)
+        else:
+            input.expect(self)
+            return FAIL
+
+
+class Predicate(Rule):
+    def __init__(self, fn):
+        self.fn = fn
+        self.name = u("Predicate {0}").format(fn.__name__)
+
+    def first(self, skip=None, seen=None):
+        return frozenset(), True, ()
+
+    def parse(self, input, currentresults=[], skip=None):
+        if self.fn(*currentresults) is False:
+            # None actually is a valid result.
+            if input.error_tree:
+                input.failure = Failure(u("{0} was not satisfied"), (self.name,), input.pos)
+            return FAIL
+
+
+class FunctionRule(Rule):
+    """ A rule builder that builds rules using a function.
+
+        It is created using either a function as its constructor argument,
+        or by calling set_fn() with the function a posteriori, for situations
+        where a forward declaration of the rule is needed.
+
+        The function must return either a Rule or a tuple of productions.
+
+        To create a rule from the FunctionRule, use the instanciate method or
+        just call it ; the arguments to __call__() or instanciate() are
+        forwarded to the building function that returns the final Rule.
+
+        For examples, see the helpers module.
+
+        Beware, set_skip and set_action should NOT be set directly on this rule.
+    """
+
+    class InstanciatedRule(Rule):
+        def __init__(self, fn, name, args, kwargs):
+            self.fn = fn
+            self.name = name
+            self.args = args
+            self.kwargs = kwargs
+            self.action = None
+            self.rule = None
+            # self.skip = None
+
+        def get_rule(self):
+            # Instanciate the rule if it wasn't already. Threads parsing with
+            # the same rules must not see it before its skip is set.
+            rule = self.rule
+            if rule is None:
+                with _building:
+                    rule = self.rule
+                    if rule is None:
+                        rule = self.fn(*self.args, **self.kwargs).set_name("*" + self.name)
+
+                        if hasattr(self, "skip") and not hasattr(rule, "skip"):
+                            rule.set_skip(self.skip)
+
+                        self.rule = rule
+
+            return rule
+
+        def _first(self, skip, seen):
+            return self.get_rule().first(skip, seen)
+
+        def subrules(self, skip):
+            return [(self.get_rule(), skip)]
+
+        def _regular(self, skip, compiler):
+            regular = compiler.pattern(self.get_rule(), skip)
+            if regular is None or regular[1] is None:
+                return None
+            pattern, inner = regular
+
+            def build(m):
+                result = inner(m)
+                return self.action(result) if self.action else result
+
+            return pattern, build
+
+        def _parse(self, input, currentresults, skip):
+            n = len(currentresults)
+            if self.get_rule().parse(input, currentresults, skip) is FAIL:
+                return FAIL
+            return self.gather(currentresults, n)
+
+
+    def __init__(self, fn=None):
+        if fn:
+            self.set_fn(fn)
+            self.name = fn.__name__
+            self.__doc__ = fn.__doc__
+        else:
+            self.fn = None
+            self.name = "Param rule <no function>"
+
+        self.action = None
+        self.instance = None
+
+    def set_fn(self, fn):
+        self.fn = fn
+        self.name = fn.__name__
+        self.instance = None
+        return self
+
+    def instanciate(self, *args, **kwargs):
+        # FIXME : should show kw args as well
+        arg_names = u("({0})").format(", ".join([repr(a) for a in args]))
+        # r = self.fn(*args).set_name(self.name + arg_names)
+        r = FunctionRule.InstanciatedRule(self.fn, self.name + arg_names, args, kwargs)
+
+        if self.action:
+            r.set_action(self.action)
+
+        if "skip" in self.__dict__:
+            r.set_skip(self.skip)
+
+        return r
+
+    def __call__(self, *args, **kw):
+        return self.instanciate(*args, **kw)
+
+    def first(self, skip=None, seen=None):
+        # Its function may only be given once the rules using it are built.
+        return UNKNOWN
+
+    def get_instance(self):
+        """ Get the rule the function builds without arguments, which is
+            built the first time it is parsed.
+        """
+        instance = self.instance
+        if instance is None:
+            with _building:
+                instance = self.instance
+                if instance is None:
+                    instance = self.instance = self.instanciate()
+        return instance
+
+    def parse(self, input, currentresults=None, skip=None):
+        # Works if the rule doesn't need any arguments. The MemoRule it
+        # contains memorize anew each time it is parsed, as when it was
+        # instanciated each time.
+        memorized = input.memorized
+        input.memorized = {}
+        result = self.get_instance().parse(input, currentresults, self.get_skip(skip))
+        input.memorized = memorized
+        return result
+
+# Taken while FunctionRule builds the rules it parses with.
+_building = threading.Lock()
+
+
+
+class Repetition(Rule):
+    """ A set of rules that can be repeated, like {m,n} in regular expressions.
+    """
+
+
+    def __init__(self, _from, _to, *args):
+        self._from = _from
+        self._to = _to
+        self.rule = Rule(*args)
+        super(Repetition, self).__init__()
+
+
+    def parse(self, input, currentresults=None, skip=None):
+        if self.regular is not None and self.parse_regular(input, currentresults, skip) is not FAIL:
+            return
+        return self.repeat(input, currentresults, skip)
+
+    def repeat(self, input, currentresults=None, skip=None):
+        results = Results(self.name)
+
+        times = 0
+        _from, _to = self._from, self._to
+
+        save_pos = input.pos
+        last_error = [] if input.error_tree else None
+        subskip = self.get_skip(skip)
+        # A failed repetition resumes from where it started.
+        marks = input.marks
+        marks.append(save_pos)
+        try:
+            while input.has_next() and (_to == -1 or times < _to):
+                # Get the results.
+                if self.rule.parse(input, results, subskip) is FAIL:
+                    if marks[-1] is _COMMITTED:
+                        raise Committed(self.name)
+                    if input.error_tree:
+                        last_error.append(input.failure.suberrors[0])
+                    break
+                times += 1
+                marks[-1] = input.pos
+        finally:
+            marks.pop()
+
+        if _from != -1 and times < _from:
+            input.rewind_to(save_pos)
+            if input.error_tree:
+                input.failure = Failure(u("{1} needs to be repeated at least {0} times"), (_from, self.name), save_pos, last_error)
+            return FAIL
+
+        if self.action:
+            # Actions in repetitions are in the form of lists.
+            currentresults.append(self.action(results))
+        else:
+            currentresults.append(results)
+
+    def _first(self, skip, seen):
+        chars, nullable, terminals = self.rule.first(self.get_skip(skip), seen)
+        if chars is None:
+            return UNKNOWN
+        return chars, nullable or self._from <= 0, terminals
+
+    def subrules(self, skip):
+        return [(self.rule, self.get_skip(skip))]
+
+    def _regular(self, skip, compiler):
+        skip = self.get_skip(skip)
+        # A rule that matches the empty string would be repeated forever.
+        if self.rule.first(skip)[1]:
+            return None
+
+        inner = compiler.pattern(self.rule, skip, capture=False)
+        if inner is None or inner[1] is None:
+            return None
+
+        # The results of each repetition are read again from what the whole
+        # repetition matched.
+        repeated = RegularCompiler().compile(self.rule, skip)
+        if repeated is None:
+            return None
+
+        def build(m):
+            results = Results(self.name)
+            pos, end = m.span(group)
+            while pos < end:
+                pos = repeated.build_at(m.string, pos, results)
+            if self.action:
+                return self.action(results)
+            return results
+
+        group = compiler.group()
+        bounds = u("{0},{1}").format(max(self._from, 0), "" if self._to == -1 else self._to)
+        return compiler.named(group, compiler.atomic(u("(?:{0}){{{1}}}").format(inner[0], bounds))), build
+
+    def subrule_names(self):
+        return self.rule.name
+
+    def post_subrule_name(self, sn):
+        self.name = sn + u("<{0}, {1}>").format(self._from, self._to)
+
+
+
+class OneOrMore(Repetition):
+    """ A Repetition that acts like the + in regular expressions.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(OneOrMore, self).__init__(1, -1, *args, **kwargs)
+
+    def post_subrule_name(self, subn):
+        self.name = u("[{0}]+").format(subn)
+
+
+class ZeroOrMore(Repetition):
+    """ A Repetition that acts like the * in regular expressions.
+    """
 
+    def __init__(self, *args, **kwargs):
+        super(ZeroOrMore, self).__init__(0, -1, *args, **kwargs)
 
-class Predicate(Rule):
-    def __init__(self, fn):
-        self.fn = fn
-        self.name = u("Predicate {0}").format(fn.__name__)
+    def post_subrule_name(self, subn):
+        self.name = u("[{0}]*").format(subn)
 
-    def parse(self, input, currentresults=[], skip=None):
-        if self.fn(*currentresults) is False:
-            # None actually is a valid result.
-            raise SyntaxError(u("{0} was not satisfied").format(self.name), input)
 
+class Exactly(Repetition):
+    """ A Repetition that wants to match excatly `times` elements.
+    """
 
-class FunctionRule(Rule):
-    """ A rule builder that builds rules using a function.
+    def __init__(self, times, *args, **kwargs):
+        super(Exactly, self).__init__(times, times, *args, **kwargs)
 
-        It is created using either a function as its constructor argument,
-        or by calling set_fn() with the function a posteriori, for situations
-        where a forward declaration of the rule is needed.
+    def post_subrule_name(self, subn):
+        self.name = u("[{0}]<{1}>").format(subn, self._from)
 
-        The function must return either a Rule or a tuple of productions.
 
-        To create a rule from the FunctionRule, use the instanciate method or
-        just call it ; the arguments to __call__() or instanciate() are
-        forwarded to the building function that returns the final Rule.
+class Optional(Repetition):
+    """ The equivalent of the ? in regular expressions.
+    """
 
-        For examples, see the helpers module.
+    def __init__(self, *args, **kwargs):
+        super(Optional, self).__init__(0, 1, *args, **kwargs)
 
-        Beware, set_skip and set_action should NOT be set directly on this rule.
+
+    def parse(self, input, currentresults=None, skip=None):
+        if self.regular is not None and self.parse_regular(input, currentresults, skip) is not FAIL:
+            return
+
+        if self.action:
+            if self.repeat(input, currentresults, self.get_skip(skip)) is FAIL:
+                return FAIL
+            results = currentresults.pop()
+            currentresults.append(None if len(results) == 0 else results[0])
+            return
+
+        # Without an action, there is no need for the list of repetitions.
+        n = len(currentresults)
+        if input.has_next():
+            marks = input.marks
+            marks.append(input.pos)
+            try:
+                if self.rule.parse(input, currentresults, self.get_skip(skip)) is FAIL and marks[-1] is _COMMITTED:
+                    raise Committed(self.name)
+            finally:
+                marks.pop()
+        if len(currentresults) == n:
+            currentresults.append(None)
+
+    def _regular(self, skip, compiler):
+        regular = super(Optional, self)._regular(skip, compiler)
+        if regular is None:
+            return None
+        pattern, repeated = regular
+
+        def build(m):
+            results = repeated(m)
+            return None if len(results) == 0 else results[0]
+
+        return pattern, build
+
+    def post_subrule_name(self, sn):
+        self.name = "[" + sn + "]?"
+
+
+class Not(Rule):
+    """ Look ahead in the input. If its rules can be applied, then
+        fail.
+
+        This rule is used to check that a rule does not apply on the input
+        following the current position.
+
+        It does *not* advance the parser position.
     """
 
-    class InstanciatedRule(Rule):
-        def __init__(self, fn, name, args, kwargs):
-            self.fn = fn
-            self.name = name
-            self.args = args
-            self.kwargs = kwargs
-            self.action = None
-            self.rule = None
-            # self.skip = None
+    def parse(self, input, currentresults=None, skip=None):
+        save_pos = input.pos
+        n = len(currentresults)
+        input.marks.append(_LookAheadMark(save_pos))
+        try:
+            # Results are ignored, and removed once parsed.
+            matched = super(Not, self).parse(input, currentresults, self.get_skip(skip)) is not FAIL
+        finally:
+            input.marks.pop()
+        if not matched:
+            # Couldn't match the next rule, which is what we want ; the
+            # parser's position was already restored so it will continue
+            # parsing as normal.
+            return
+        input.rewind_to(save_pos)
+        if input.error_tree:
+            input.failure = Failure(u("In <{0}> Matched \"{1}\""), (self.name, currentresults[n:]), save_pos)
+        del currentresults[n:]
+        return FAIL
 
-        def parse(self, input, currentresults, skip):
-            # Instanciate the rule if it wasn't already.
-            if not self.rule:
-                self.rule = self.fn(*self.args, **self.kwargs).set_name("*" + self.name)
+    def _first(self, skip, seen):
+        return frozenset(), True, ()
 
-                if hasattr(self, "skip") and not hasattr(self.rule, "skip"):
-                    self.rule.set_skip(self.skip)
+    def _regular(self, skip, compiler):
+        sequence = compiler.sequence(self.productions, self.get_skip(skip), capture=False)
+        return None if sequence is None else ("(?!" + sequence[0] + ")", None)
 
-            results = Results(self.name)
-            self.rule.parse(input, results, skip)
-            if self.action:
-                currentresults.append(self.action(*results))
+    def post_subrule_name(self, productions):
+        self.name = "Not " + productions
+
+
+
+class And(Rule):
+    """ Look ahead in the input. If its rules can be applied, then continue
+        parsing from the same place we were before executing this rule.
+
+        This rule is used to check that the following input contains a rule we
+        want.
+
+        It does *not* advance the parser position.
+    """
+
+
+    def parse(self, input, currentresults=None, skip=None):
+        save_pos = input.pos
+        n = len(currentresults)
+        input.marks.append(_LookAheadMark(save_pos))
+        try:
+            # Try to parse our rules, whose results are ignored.
+            matched = super(And, self).parse(input, currentresults, self.get_skip(skip)) is not FAIL
+        finally:
+            input.marks.pop()
+        if not matched:
+            return FAIL
+        del currentresults[n:]
+
+        # If there was no failure, we don't advance, which is what we want.
+        input.rewind_to(save_pos)
+
+    def _first(self, skip, seen):
+        return frozenset(), True, ()
+
+    def _regular(self, skip, compiler):
+        sequence = compiler.sequence(self.productions, self.get_skip(skip), capture=False)
+        return None if sequence is None else ("(?=" + sequence[0] + ")", None)
+
+    def post_subrule_name(self, sn):
+        self.name = u("Look-Ahead {0}").format(sn)
+
+
+class Committed(Exception):
+    """ Raised by a choice or a repetition that a Cut committed when what
+        follows the Cut does not match. The Parser turns it into the
+        SyntaxError of the parse.
+    """
+
+
+class _CutMark(int):
+    """ The mark of a rule committed by a Cut in Input.marks. Since the rule
+        won't go back to any position, it is past all of them.
+    """
+
+_COMMITTED = _CutMark(sys.maxsize)
+
+
+class _LookAheadMark(int):
+    """ A position of Input.marks pushed by a look-ahead or a skip, which
+        a Cut does not commit.
+    """
+
+
+class Cut(Rule):
+    """ Commit to the choice of the Either, or to the repetition, being
+        tried when it is parsed: the next choices are not tried, nor does
+        the repetition stop, and if what follows the Cut does not match the
+        parse fails right away with a SyntaxError.
+
+        It is the ~ of the .pwpeg files. In
+
+            Either(Rule("{", Cut(), members, "}"), Rule("[", Cut(), items, "]"), ...)
+
+        once "{" matched the other choices are not tried, and an error in
+        the members is reported there. Since the parser won't backtrack
+        before the positions the rules being parsed may still go back to,
+        the outcomes memorized before them are dropped, as well as, for
+        a StreamInput, the text. The rule that was committed does not keep
+        anything.
+
+        It matches the empty string and has no result. The choices of the
+        look-aheads and of the skips can be committed, but not the
+        look-aheads themselves.
+    """
+
+    def __init__(self):
+        self.name = "~"
+
+    def first(self, skip=None, seen=None):
+        return frozenset(), True, ()
+
+    def parse(self, input, currentresults=None, skip=None):
+        marks = input.marks
+        if marks and marks[-1].__class__ is not _LookAheadMark:
+            marks[-1] = _COMMITTED
+            input.forget_before(min(min(marks), input.pos))
+
+
+
+# Taken while an Either builds a dispatch table from the rules it shares
+# with the other threads.
+_dispatching = threading.Lock()
+
+
+class Either(Rule):
+    """ Try parsing with several rules and return the result of the first
+        one that works.
+
+        The rules are given to the constructor as its arguments.
+
+        Unless the failures are kept for an error tree, only the choices
+        that can start with the current character are tried, see dispatch().
+    """
+
+    # The number of times the choices are tried in order before building the
+    # dispatch tables ; the choices that are seldom parsed are not worth it.
+    # Threads may miss trials, but build the tables one at a time.
+    dispatch_after = 8
+
+    def __init__(self, *args):
+        self.dispatches = {}
+        self.trials = 0
+        self.direct = True
+        super(Either, self).__init__(*args)
+
+    def set_productions(self, *args):
+        self.dispatches = {}
+        self.trials = 0
+        super(Either, self).set_productions(*args)
+        self.direct = not any(isinstance(r, Predicate) for r in self.productions)
+        return self
+
+    def dispatch(self, skip):
+        """ Build the dispatch table of the choices for a given skip, or
+            None if no choice can be ruled out beforehand.
+
+            The table maps the current character (OTHER_ASCII and NON_ASCII
+            for the ones it does not list) to the choices that can start
+            with it, in order. The choices that can't are replaced
+            by the terminals they would have expected, as tuples, so that the
+            errors stay the same. At the end of the input, all the choices
+            are tried, since repetitions do not try anything there.
+        """
+        seen = {}
+        firsts = [(rule, rule.first(skip, seen)) for rule in self.productions]
+        known = [chars for rule, (chars, nullable, t) in firsts if chars is not None and not nullable]
+        if not known:
+            return None
+
+        table = {None: self.productions}
+        for c in set().union(*known) | set([OTHER_ASCII, NON_ASCII]):
+            steps, expected = [], []
+            for rule, (chars, nullable, terminals) in firsts:
+                if chars is None or nullable or can_start(chars, c):
+                    if expected:
+                        steps.append(tuple(expected))
+                        expected = []
+                    steps.append(rule)
+                else:
+                    expected.extend(terminals)
+            if expected:
+                steps.append(tuple(expected))
+            table[c] = tuple(steps)
+        return table
+
+    def _parse(self, input, currentresults=None, skip=None):
+        all_errors = [] if input.error_tree else None
+        subskip = self.get_skip(skip)
+        steps = self.productions
+
+        # The choices parse straight into currentresults, unless predicates
+        # would see them.
+        results = currentresults if self.direct else Results()
+        n = len(results)
+
+        if not input.error_tree and input.dispatch:
+            table = self.dispatches.get(subskip)
+            if table is None:
+                self.trials += 1
+                if self.trials > self.dispatch_after:
+                    with _dispatching:
+                        table = self.dispatches.get(subskip)
+                        if table is None:
+                            table = self.dispatches[subskip] = self.dispatch(subskip) or False
+            if table:
+                c = input.current()
+                steps = table.get(c)
+                if steps is None:
+                    steps = table[NON_ASCII if ord(c) > 127 else OTHER_ASCII]
+
+        marks = input.marks
+        marks.append(input.pos)
+        try:
+            for rule in steps:
+                if rule.__class__ is tuple:
+                    input.expect_all(rule)
+                    continue
+
+                if rule.parse(input, results, subskip) is FAIL:
+                    if marks[-1] is _COMMITTED:
+                        raise Committed(self.name)
+                    if all_errors is not None:
+                        all_errors.append(input.failure)
+                    # We continue since the failure just means that we didn't match and
+                    # must try the next choice.
+                    continue
+                break
+            else:
+                rule = None
+        finally:
+            marks.pop()
+
+        if rule is not None:
+            if results is currentresults:
+                if self.action:
+                    currentresults[n] = self.action(currentresults[n])
                 return
-            if len(results) == 1:
-                currentresults.append(results[0])
+
+            res = results[0]
+
+            if self.action:
+                currentresults.append(self.action(res))
             else:
-                currentresults.append(results)
+                currentresults.append(res)
+            return
 
+        if input.error_tree:
+            input.failure = Failure(u("In [{0}], none of the provided choices matched"), (self.name,), input.pos, all_errors)
+        return FAIL
 
-    def __init__(self, fn=None):
-        if fn:
-            self.set_fn(fn)
-            self.name = fn.__name__
-            self.__doc__ = fn.__doc__
-        else:
-            self.fn = None
-            self.name = "Param rule <no function>"
+    def left_subrules(self, skip):
+        return self.subrules(skip)
 
-        self.action = None
+    def _first(self, skip, seen):
+        skip = self.get_skip(skip)
+        chars, nullable, terminals = set(), False, []
+        for rule in self.productions:
+            c, n, t = rule.first(skip, seen)
+            if c is None:
+                return UNKNOWN
+            chars |= c
+            nullable = nullable or n
+            terminals.extend(t)
+        return frozenset(chars), nullable, tuple(terminals)
+
+    def _regular(self, skip, compiler):
+        skip = self.get_skip(skip)
+        patterns, choices = [], []
+        for rule in self.productions:
+            regular = compiler.pattern(rule, skip)
+            if regular is None or regular[1] is None:
+                return None
+            group = compiler.group()
+            patterns.append(compiler.named(group, regular[0]))
+            choices.append((group, regular[1]))
 
-    def set_fn(self, fn):
-        self.fn = fn
-        self.name = fn.__name__
-        return self
+        def build(m):
+            for group, b in choices:
+                if m.start(group) != -1:
+                    result = b(m)
+                    return self.action(result) if self.action else result
 
-    def instanciate(self, *args, **kwargs):
-        # FIXME : should show kw args as well
-        arg_names = u("({0})").format(", ".join([repr(a) for a in args]))
-        # r = self.fn(*args).set_name(self.name + arg_names)
-        r = FunctionRule.InstanciatedRule(self.fn, self.name + arg_names, args, kwargs)
+        return compiler.atomic("|".join(patterns)), build
 
-        if self.action:
-            r.set_action(self.action)
+    def post_subrule_name(self, subn):
+        self.name = u("either({0})").format(subn)
 
-        if "skip" in self.__dict__:
-            r.set_skip(self.skip)
 
-        return r
+class Any(Rule):
+    ''' a Rule matching any single token in the stream.
+    '''
 
-    def __call__(self, *args, **kw):
-        return self.instanciate(*args, **kw)
+    def __init__(self):
+        self.name = "Any"
+
+    def first(self, skip=None, seen=None):
+        return UNKNOWN
+
+    def _regular(self, skip, compiler):
+        skip = compiler.skip(self.get_skip(skip))
+        if skip is None:
+            return None
+        group = compiler.group()
+        return skip + compiler.named(group, r"[\s\S]"), lambda m: m.group(group)
 
     def parse(self, input, currentresults=None, skip=None):
-        # Works if the rule doesn't need any arguments
-        rule = self.instanciate()
-        rule.parse(input, currentresults, self.get_skip(skip))
 
+        save_pos = input.pos
 
+        self.try_skip(input, skip)
 
-class Repetition(Rule):
-    """ A set of rules that can be repeated, like {m,n} in regular expressions.
+        if not input.has_next():
+            input.rewind_to(save_pos)
+            if input.error_tree:
+                input.failure = Failure("Want anything, but no more input", (), save_pos)
+            else:
+                input.expect(self)
+            return FAIL
+
+        any = input.current()
+        input.advance(any)
+        currentresults.append(any)
+
+class MemoRule(Rule):
+    """ A rule that memorizes itself for future uses.
+
+        Once it matched, it only matches the same results again until the
+        FunctionRule being parsed is done, or the parsing is.
     """
 
+    def __init__(self, rule):
+        self.rule = rule
 
-    def __init__(self, _from, _to, *args):
-        self._from = _from
-        self._to = _to
-        self.rule = Rule(*args)
-        super(Repetition, self).__init__()
-        self.post_subrule_name(self.rule.name)
+    def subrule_names(self):
+        return self.rule.name
+
+    def post_subrule_name(self, sn):
+        self.name = u("Memorizing({0})").format(sn)
+
+    def first(self, skip=None, seen=None):
+        return UNKNOWN
+
+    def subrules(self, skip):
+        return [(self.rule, self.get_skip(skip))]
+
+    def parse(self, input, currentresults=None, skip=None):
+        """
+        """
+        memorized = input.memorized.get(self)
+        if memorized is None:
+            # act = self.__dict__.get("action", None)
+            # if act: del self.__dict__["action"]
+            if self.rule.parse(input, currentresults, self.get_skip(skip)) is FAIL:
+                return FAIL
+
+            res = currentresults[len(currentresults) - 1]
+            if not isinstance(res, list) and not isinstance(res, tuple):
+                input.memorized[self] = Rule(res)
+            else:
+                input.memorized[self] = Rule(*res)
+        else:
+            # The rule is now memorized, and we can execute it.
+            return memorized.parse(input, currentresults, self.get_skip(skip))
+
+
+class CompiledRule(Rule):
+    """ A rule implemented by a plain function, such as the ones written by
+        the standalone backend (see visitor_standalone.)
+
+        The function is called with (input, pos, skip) and returns a tuple
+        (end position, result), or None if the rule did not match.
+    """
+
+    def __init__(self, fn, name=None):
+        self.fn = fn
+        self.action = None
+        self.name = name or fn.__name__
+
+    def parse(self, input, currentresults=None, skip=None):
+        pos = input.pos
+        r = self.fn(input, pos, skip)
+        if r is None:
+            input.seek(pos)
+            return FAIL
+        input.seek(r[0])
+        currentresults.append(r[1])
+
+    def first(self, skip=None, seen=None):
+        return UNKNOWN
+
+    def parse_at(self, input, pos, skip=None):
+        return self.fn(input, pos, skip)
+
+    def skip_from(self, input, pos):
+        r = self.fn(input, pos, None)
+        return pos if r is None else r[0]
+
+
+def grow_compiled(fn, input, pos, skip):
+    """ Parse a left recursive rule implemented by the function fn of a
+        CompiledRule, by growing a seed like Rule.grow() does.
+    """
+    key = (fn, skip, pos)
+    seed = input.seeds.get(key)
+    if seed is not None:
+        seed[1] = True
+        return seed[0]
+
+    # The outcome of the last parse that grew, and whether it came back to
+    # itself.
+    seed = input.seeds[key] = [None, False]
+    try:
+        while True:
+            r = fn(input, pos, skip)
+            if r is None or (seed[0] is not None and r[0] <= seed[0][0]):
+                break
+            seed[0] = r
+            if not seed[1]:
+                break
+            seed[1] = False
+    finally:
+        del input.seeds[key]
+    return seed[0]
+
+
+# Atomic groups, that give regular expressions the semantics of PEG, appeared
+# with python 3.11 ; RegularCompiler emulates them before.
+try:
+    re.compile("(?>a)")
+    ATOMIC_GROUPS = True
+except re.error:
+    ATOMIC_GROUPS = False
+
+
+class Regular(object):
+    """ A rule compiled into a single regular expression.
 
+        The build function gets the result of the rule from the match object,
+        as if the rule had been parsed.
+    """
 
-    def parse(self, input, currentresults=None, skip=None):
-        results = Results(self.name)
+    def __init__(self, pattern, build):
+        self.regexp = re.compile(pattern)
+        self.build = build
 
-        times = 0
-        _from, _to = self._from, self._to
+    def parse(self, input, currentresults):
+        m = input.match_object(self.regexp)
+        if m is None:
+            return FAIL
+        input.regular_matched = True
+        currentresults.append(self.build(m))
 
-        save_pos = input.pos
-        last_error = []
+    def build_at(self, s, pos, results):
+        """ Append the result of the rule at pos to results, and get the end
+            of the match. The rule must match at pos.
+        """
+        m = self.regexp.match(s, pos)
+        results.append(self.build(m))
+        return m.end()
 
-        while input.has_next() and (_to == -1 or times < _to):
-            try:
-                # Get the resultss.
-                self.rule.parse(input, results, self.get_skip(skip))
-                times += 1
-            except SyntaxError as e:
-                last_error.append(e.suberrors[0])
-                break
 
+class RegularCompiler(object):
+    """ Turns regular rules into the patterns of a Regular.
 
-        if _from != -1 and times < _from:
-            input.rewind_to(save_pos)
-            raise SyntaxError(u("{1} needs to be repeated at least {0} times").format(_from, self.name), input, last_error)
+        Each rule tells how it translates with its _regular() method ; the
+        PEG semantics are kept by making every choice and repetition an
+        atomic group, and the results are built back from named groups.
+    """
 
-        if self.action:
-            # Actions in repetitions are in the form of lists.
-            currentresults.append(self.action(results))
-        else:
-            currentresults.append(results)
+    def __init__(self):
+        self.groups = 0
+        # Whether the results are wanted ; they aren't for skips, look-aheads
+        # and what is repeated, which can then appear several times.
+        self.capture = True
+        # The rules being translated, which are recursive if met again.
+        self.active = set()
+
+    def group(self):
+        """ Get the name of a new group.
+        """
+        self.groups += 1
+        return u("g{0}").format(self.groups)
 
-    def post_subrule_name(self, sn):
-        self.name = sn + u("<{0}, {1}>").format(self._from, self._to)
+    def atomic(self, pattern):
+        """ Get an atomic group of pattern, which is never backtracked into
+            once it matched. Without them, a look-ahead does not backtrack
+            either, and a back reference then reads what it matched.
+        """
+        if ATOMIC_GROUPS:
+            return u("(?>{0})").format(pattern)
+        group = self.group()
+        return u("(?=(?P<{0}>{1}))(?P={0})").format(group, pattern)
+
+    def named(self, group, pattern):
+        if not self.capture:
+            return u("(?:{0})").format(pattern)
+        return u("(?P<{0}>{1})").format(group, pattern)
+
+    def pattern(self, rule, skip, capture=True):
+        key = (rule, skip)
+        if key in self.active:
+            return None
+        self.active.add(key)
+        outer, self.capture = self.capture, self.capture and capture
+        try:
+            return rule._regular(skip, self)
+        finally:
+            self.active.remove(key)
+            self.capture = outer
+
+    def skip(self, skip):
+        """ Get the pattern of an optional skip, or None if it is not regular.
+        """
+        if not skip:
+            return ""
+        regular = self.pattern(skip, None, capture=False)
+        if regular is None:
+            return None
+        return self.atomic(u("(?:{0})?").format(regular[0]))
+
+    def sequence(self, productions, skip, capture=True):
+        """ Get a tuple (pattern, builds) for productions parsed one after
+            the other with skip, where builds are the build functions of the
+            productions that have a result.
+        """
+        patterns, builds = [], []
+        for r in productions:
+            # Each has its own groups.
+            skip_pattern = self.skip(skip)
+            regular = self.pattern(r, skip, capture)
+            if skip_pattern is None or regular is None:
+                return None
+            patterns.append(skip_pattern + regular[0])
+            if regular[1] is not None:
+                builds.append(regular[1])
+
+        return u("(?:{0})").format("".join(patterns)), builds
+
+    def compile(self, rule, skip):
+        """ Get the Regular of rule when it inherits skip, or None if it is
+            not regular.
+        """
+        regular = self.pattern(rule, skip)
+        if regular is None or regular[1] is None:
+            return None
+        try:
+            return Regular(regular[0], regular[1])
+        except (re.error, AssertionError):
+            # Python 2 refuses the patterns of more than 100 groups with an
+            # AssertionError.
+            return None
 
 
+def compile_regular(*rules):
+    """ Compile the regular parts of the grammars starting at rules into
+        single regular expressions.
 
-class OneOrMore(Repetition):
-    """ A Repetition that acts like the + in regular expressions.
+        The largest rules made only of strings, regexps, sequences, choices,
+        repetitions and look-aheads, that are not recursive, get a Regular per
+        skip they are parsed with. They then parse with one match instead of
+        going through their sub rules, which they still do when they do not
+        match, to report the errors. Since the terminals they expected while
+        matching are not known, Parser parses again without them when it has
+        to report an error.
+
+        The rules must not be modified afterwards.
     """
+    seen = set()
+    todo = [(rule, None) for rule in rules if rule not in compile_regular.done]
+    compile_regular.done.update(rules)
+    while todo:
+        rule, skip = todo.pop()
+        if (rule, skip) in seen:
+            continue
+        seen.add((rule, skip))
+
+        # Not and And do not parse by themselves.
+        if rule.__class__ is Rule or isinstance(rule, (Either, Repetition, FunctionRule.InstanciatedRule)):
+            regular = RegularCompiler().compile(rule, skip)
+            if regular is not None:
+                if rule.regular is None:
+                    rule.regular = {}
+                rule.regular[skip] = regular
+                continue
 
-    def __init__(self, *args, **kwargs):
-        super(OneOrMore, self).__init__(1, -1, *args, **kwargs)
+        todo.extend(rule.subrules(skip))
 
-    def post_subrule_name(self, subn):
-        self.name = u("[{0}]+").format(subn)
+# The rules compile_regular() already started from.
+compile_regular.done = WeakSet()
 
 
-class ZeroOrMore(Repetition):
-    """ A Repetition that acts like the * in regular expressions.
+def find_left_recursion(*rules):
+    """ Find the rules of the grammars starting at rules that can parse
+        themselves again at the same position, and set their
+        left_recursive so that they are parsed with Rule.grow().
+
+        One rule is marked per cycle of rules ; the first one reached from
+        rules that parses like a Rule. The rules that FunctionRule builds while parsing are not
+        looked at, and the rules must not be modified afterwards.
     """
+    reached = []
+    seen = set()
+    todo = [(rule, None) for rule in rules if rule not in find_left_recursion.done]
+    find_left_recursion.done.update(rules)
+    while todo:
+        node = todo.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        reached.append(node)
+        todo.extend(reversed(node[0].subrules(node[1])))
+
+    # A depth first search of the rules parsed at the same position, where
+    # coming back to a rule that is still being searched closes a cycle.
+    visited = set()
+    for start in reached:
+        if start in visited:
+            continue
+        visited.add(start)
+        searching = set([start])
+        stack = [(start, iter(start[0].left_subrules(start[1])))]
+        while stack:
+            node, subrules = stack[-1]
+            for sub in subrules:
+                if sub in searching:
+                    cycle = [n for n, s in stack]
+                    for rule, s in cycle[cycle.index(sub):]:
+                        if rule.__class__ is Rule or isinstance(rule, (Either, FunctionRule.InstanciatedRule)):
+                            rule.left_recursive = True
+                            break
+                elif sub not in visited:
+                    visited.add(sub)
+                    searching.add(sub)
+                    stack.append((sub, iter(sub[0].left_subrules(sub[1]))))
+                    break
+            else:
+                stack.pop()
+                searching.discard(node)
 
-    def __init__(self, *args, **kwargs):
-        super(ZeroOrMore, self).__init__(0, -1, *args, **kwargs)
+# The rules find_left_recursion() already started from.
+find_left_recursion.done = WeakSet()
 
-    def post_subrule_name(self, subn):
-        self.name = u("[{0}]*").format(subn)
 
+class Machine(object):
+    """ A parsing machine, that parses with the rules of a grammar compiled
+        to a flat list of instructions instead of calling them.
 
-class Exactly(Repetition):
-    """ A Repetition that wants to match excatly `times` elements.
-    """
+        Each rule is compiled once per skip it is parsed with to a
+        procedure, that CALL jumps to and RETURN leaves. The terminals test
+        the input, and a failure backtracks to the last CHOICE, which
+        remembers where to resume along with the position and the size of
+        the stacks. Sequences OPEN a frame on the stack of values, that
+        CLOSE turns into their result.
 
-    def __init__(self, times, *args, **kwargs):
-        super(Exactly, self).__imit__(times, times, *args, **kwargs)
+        Since the machine keeps its own stacks, it parses inputs that
+        nest deeper than the recursion limit of python. The results are
+        the ones of the rules, whose actions are called the same way.
 
-    def post_subrule_name(self, subn):
-        self.name = u("[{0}]<{1}>").format(subn, self._from)
+        The rules it does not know how to compile, such as the left
+        recursive ones, MemoRule and CompiledRule, are parsed by themselves
+        with PARSE, as well as the FunctionRule whose MemoRule must forget
+        what they matched once they are parsed.
 
+        The look-aheads push the marks a Cut does not commit, and a failure
+        that resumes at a committed choice raises Committed. With Cuts, the
+        last choice of an Either has a CHOICE of its own for them to commit.
 
-class Optional(Repetition):
-    """ The equivalent of the ? in regular expressions.
+        The rules must not be modified once they are compiled.
     """
 
-    def __init__(self, *args, **kwargs):
-        super(Optional, self).__init__(0, 1, *args, **kwargs)
+    (STRING, REGEXP, ANY, PREDICATE, SKIP, CALL, RETURN, PARSE, CHOICE, COMMIT,
+        BACK_COMMIT, FAIL_TWICE, FAILURE, OPEN, CLOSE, ACTION, REPEAT_OPEN, REPEAT_TEST,
+        REPEAT_COMMIT, REPEAT_CLOSE, OPTIONAL_OPEN, OPTIONAL_CLOSE, HAS_NEXT, UNWRAP, END) = range(25)
 
+    def __init__(self, toprule):
+        # Whether the grammar has Cuts, which is only known once it was
+        # compiled, in which case it is compiled again.
+        self.cuts = False
+        self.compile(toprule)
+        if self.cuts:
+            self.compile(toprule)
+
+    def compile(self, toprule):
+        self.code = []
+        # (rule, skip) -> address of its procedure.
+        self.procedures = {}
+        self.todo = []
+        # The instructions to point to the procedures once they are compiled.
+        self.calls = []
+
+        self.call(toprule, None)
+        self.emit(Machine.END)
+        while self.todo:
+            rule, skip = key = self.todo.pop()
+            self.procedures[key] = len(self.code)
+            self.procedure(rule, skip)
+            self.emit(Machine.RETURN)
+
+        code = self.code
+        for i in self.calls:
+            code[i] = (Machine.CALL, self.procedures[code[i][1]], None)
+        self.code = [tuple(c) for c in code]
+
+    def emit(self, op, a=None, b=None):
+        self.code.append([op, a, b])
+        return len(self.code) - 1
+
+    def target(self, i):
+        """ Make the instruction at i jump to the next one emitted.
+        """
+        self.code[i][1] = len(self.code)
 
-    def parse(self, input, currentresults=None, skip=None):
-        results = Results()
-        super(Optional, self).parse(input, results, self.get_skip(skip))
+    def call(self, rule, skip):
+        key = (rule, skip)
+        if key not in self.procedures:
+            self.procedures[key] = None
+            self.todo.append(key)
+        self.calls.append(self.emit(Machine.CALL, key))
 
-        if len(results[0]) == 0:
-            currentresults.append(None)
+    def rule(self, rule, skip):
+        """ Emit the instructions that parse rule where it is a production.
+        """
+        cls = rule.__class__
+        if cls is StringRule:
+            self.emit(Machine.STRING, rule.string, rule)
+        elif cls is RegexpRule:
+            self.emit(Machine.REGEXP, rule.regexp, rule)
+        elif cls is Any:
+            self.emit(Machine.ANY, rule, rule.get_skip(skip))
+        elif cls is Predicate:
+            self.emit(Machine.PREDICATE, rule.fn)
         else:
-            currentresults.append(results[0][0])
+            self.call(rule, skip)
 
-    def post_subrule_name(self, sn):
-        self.name = "[" + sn + "]?"
+    def sequence(self, rule, skip):
+        """ Emit the instructions of Rule._parse().
+        """
+        subskip = rule.get_skip(skip)
+        self.emit(Machine.OPEN)
+        for r in rule.productions:
+            if subskip:
+                self.emit(Machine.SKIP, subskip)
+            self.rule(r, subskip)
+        self.emit(Machine.CLOSE, rule.action, rule.name)
+
+    def repetition(self, rule, skip):
+        """ Emit the instructions of Repetition.repeat().
+        """
+        self.emit(Machine.REPEAT_OPEN)
+        loop = self.emit(Machine.REPEAT_TEST, None, rule._to)
+        choice = self.emit(Machine.CHOICE)
+        self.rule(rule.rule, rule.get_skip(skip))
+        self.emit(Machine.REPEAT_COMMIT, loop)
+        self.target(loop)
+        self.target(choice)
+        self.emit(Machine.REPEAT_CLOSE, rule._from, rule)
+
+    def procedure(self, rule, skip):
+        """ Emit the instructions that parse rule with skip.
+        """
+        cls = rule.__class__
+
+        if rule.left_recursive or (cls in (Rule, Either, Not, And) and not rule.productions):
+            self.emit(Machine.PARSE, rule, skip)
+
+        elif cls is Rule:
+            self.sequence(rule, skip)
+
+        elif cls is Either and rule.direct:
+            subskip = rule.get_skip(skip)
+            commits = []
+            for r in rule.productions[:-1]:
+                choice = self.emit(Machine.CHOICE)
+                self.rule(r, subskip)
+                commits.append(self.emit(Machine.COMMIT))
+                self.target(choice)
+            if self.cuts:
+                choice = self.emit(Machine.CHOICE)
+                self.rule(rule.productions[-1], subskip)
+                commits.append(self.emit(Machine.COMMIT))
+                self.target(choice)
+                self.emit(Machine.FAILURE)
+            else:
+                self.rule(rule.productions[-1], subskip)
+            for i in commits:
+                self.target(i)
+            if rule.action:
+                self.emit(Machine.ACTION, rule.action)
+
+        elif cls in (Repetition, OneOrMore, ZeroOrMore, Exactly):
+            self.repetition(rule, skip)
+
+        elif cls is Optional:
+            if rule.action:
+                self.repetition(rule, skip)
+                self.emit(Machine.UNWRAP)
+            else:
+                self.emit(Machine.OPTIONAL_OPEN)
+                end = self.emit(Machine.HAS_NEXT)
+                choice = self.emit(Machine.CHOICE)
+                self.rule(rule.rule, rule.get_skip(skip))
+                commit = self.emit(Machine.COMMIT)
+                self.target(choice)
+                self.target(end)
+                self.target(commit)
+                self.emit(Machine.OPTIONAL_CLOSE)
+
+        elif cls is Not:
+            choice = self.emit(Machine.CHOICE, None, True)
+            self.sequence(rule, rule.get_skip(skip))
+            self.emit(Machine.FAIL_TWICE)
+            self.target(choice)
+
+        elif cls is And:
+            choice = self.emit(Machine.CHOICE, None, True)
+            self.sequence(rule, rule.get_skip(skip))
+            commit = self.emit(Machine.BACK_COMMIT)
+            self.target(choice)
+            self.emit(Machine.FAILURE)
+            self.target(commit)
+
+        elif cls is FunctionRule.InstanciatedRule:
+            self.emit(Machine.OPEN)
+            self.rule(rule.get_rule(), skip)
+            self.emit(Machine.CLOSE, rule.action, rule.name)
+
+        elif cls is FunctionRule:
+            if self.memorizes(rule.get_instance(), rule.get_skip(skip)):
+                self.emit(Machine.PARSE, rule, skip)
+            else:
+                self.rule(rule.get_instance(), rule.get_skip(skip))
 
+        elif cls in (StringRule, RegexpRule, Any, Predicate):
+            self.rule(rule, skip)
 
-class Not(Rule):
-    """ Look ahead in the input. If no syntax error is received, then
-        raise a SyntaxError.
+        else:
+            if cls is Cut:
+                self.cuts = True
+            self.emit(Machine.PARSE, rule, skip)
 
-        This rule is used to check that a rule does not apply on the input
-        following the current position.
+    def memorizes(self, rule, skip):
+        """ Whether rule parses with a MemoRule, other than in the
+            FunctionRule it parses with.
+        """
+        seen = set()
+        todo = [(rule, skip)]
+        while todo:
+            node = todo.pop()
+            if node in seen or node[0].__class__ is FunctionRule:
+                continue
+            if node[0].__class__ is MemoRule:
+                return True
+            seen.add(node)
+            todo.extend(node[0].subrules(node[1]))
+        return False
+
+    def parse(self, input, values):
+        """ Parse input, adding the result to values. Returns FAIL if it
+            did not match.
+        """
+        marks = input.marks
+        depth = len(marks)
+        try:
+            return self.run(input, values)
+        except Committed:
+            # The choices it was trying are given up.
+            del marks[depth:]
+            raise
+
+    def run(self, input, values):
+        (STRING, REGEXP, ANY, PREDICATE, SKIP, CALL, RETURN, PARSE, CHOICE, COMMIT,
+            BACK_COMMIT, FAIL_TWICE, FAILURE, OPEN, CLOSE, ACTION, REPEAT_OPEN, REPEAT_TEST,
+            REPEAT_COMMIT, REPEAT_CLOSE, OPTIONAL_OPEN, OPTIONAL_CLOSE, HAS_NEXT, UNWRAP, END) = range(25)
+
+        code = self.code
+        marks = input.marks
+        # Where to go back to when returning from a procedure.
+        returns = []
+        # (address, position, values, returns, frames) to resume at on failure.
+        choices = []
+        # Where the values of the sequences start, and the number of times
+        # the repetitions matched.
+        frames = []
+        ip = 0
+
+        while True:
+            op, a, b = code[ip]
+            ip += 1
+
+            if op == CALL:
+                returns.append(ip)
+                ip = a
+                continue
 
-        It does *not* advance the parser position.
-    """
+            if op == RETURN:
+                ip = returns.pop()
+                continue
 
-    def parse(self, input, currentresults=None, skip=None):
-        save_pos = input.pos
-        results = Results()
-        try:
-            # Results are ignored.
-            super(Not, self).parse(input, results, self.get_skip(skip))
-        except SyntaxError as e:
-            # Couldn't match the next rule, which is what we want, so
-            # we just restore the parser's position so it will continue
-            # parsing as normal.
-            return
-        input.rewind_to(save_pos)
-        raise SyntaxError(u("In <{0}> Matched \"{1}\"").format(self.name, results), input)
+            if op == SKIP:
+                input.skip(a)
+                continue
 
-    def post_subrule_name(self, productions):
-        self.name = "Not " + productions
+            if op == OPEN:
+                frames.append(len(values))
+                continue
 
+            if op == CLOSE:
+                base = frames.pop()
+                if len(values) == base + 1:
+                    if a:
+                        values[base] = a(values[base])
+                    continue
+                results = Results(b, values[base:])
+                del values[base:]
+                values.append(a(*results) if a else results)
+                continue
 
+            if op == STRING:
+                if input.startswith(a):
+                    values.append(a)
+                    continue
+                input.expect(b)
+
+            elif op == REGEXP:
+                match = input.match(a)
+                if match is not None:
+                    values.append(match)
+                    continue
+                input.expect(b)
+
+            elif op == CHOICE:
+                pos = input.pos
+                choices.append((a, pos, len(values), len(returns), len(frames)))
+                # b is set for the look-aheads.
+                marks.append(_LookAheadMark(pos) if b else pos)
+                continue
 
-class And(Rule):
-    """ Look ahead in the input. If its rules can be applied, then continue
-        parsing from the same place we were before executing this rule.
+            elif op == COMMIT:
+                choices.pop()
+                marks.pop()
+                ip = a
+                continue
 
-        This rule is used to check that the following input contains a rule we
-        want.
+            elif op == REPEAT_TEST:
+                if not input.has_next() or (b != -1 and frames[-1] >= b):
+                    ip = a
+                continue
 
-        It does *not* advance the parser position.
-    """
+            elif op == REPEAT_COMMIT:
+                choices.pop()
+                marks.pop()
+                frames[-1] += 1
+                ip = a
+                continue
 
+            elif op == REPEAT_OPEN:
+                frames.append(len(values))
+                frames.append(0)
+                continue
 
-    def parse(self, input, currentresults=None, skip=None):
-        results = Results() # We're going to ignore any results.
-        save_pos = input.pos
-        # Try to parse our rules
-        super(And, self).parse(input, results, self.get_skip(skip))
+            elif op == REPEAT_CLOSE:
+                times = frames.pop()
+                base = frames.pop()
+                if a == -1 or times >= a:
+                    results = Results(b.name, values[base:])
+                    del values[base:]
+                    values.append(b.action(results) if b.action else results)
+                    continue
+
+            elif op == OPTIONAL_OPEN:
+                frames.append(len(values))
+                continue
 
-        # If there was no error, we don't advance, which is what we want.
-        # A syntax error is raised otherwise in our super() parse.
-        input.rewind_to(save_pos)
+            elif op == OPTIONAL_CLOSE:
+                if len(values) == frames.pop():
+                    values.append(None)
+                continue
 
-    def post_subrule_name(self, sn):
-        self.name = u("Look-Ahead {0}").format(sn)
+            elif op == HAS_NEXT:
+                if not input.has_next():
+                    ip = a
+                continue
+
+            elif op == ACTION:
+                values[-1] = a(values[-1])
+                continue
 
+            elif op == PREDICATE:
+                if a(*values[frames[-1] if frames else 0:]) is not False:
+                    continue
+
+            elif op == ANY:
+                pos = input.pos
+                if b:
+                    input.skip(b)
+                if input.has_next():
+                    c = input.current()
+                    input.advance(c)
+                    values.append(c)
+                    continue
+                input.rewind_to(pos)
+                input.expect(a)
+
+            elif op == PARSE:
+                if a.parse(input, values, b) is not FAIL:
+                    continue
+
+            elif op == BACK_COMMIT:
+                pos, n = choices.pop()[1:3]
+                marks.pop()
+                input.rewind_to(pos)
+                del values[n:]
+                ip = a
+                continue
 
+            elif op == FAIL_TWICE:
+                choices.pop()
+                marks.pop()
 
-class Either(Rule):
-    """ Try parsing with several rules and return the result of the first
-        one that works.
+            elif op == UNWRAP:
+                results = values.pop()
+                values.append(None if len(results) == 0 else results[0])
+                continue
 
-        The rules are given to the constructor as its arguments.
+            elif op == END:
+                return
+
+            # The instruction failed ; resume at the last choice.
+            if not choices:
+                return FAIL
+            ip, pos, n, r, f = choices.pop()
+            if marks.pop() is _COMMITTED:
+                raise Committed(u("choice at {0}").format(pos))
+            input.rewind_to(pos)
+            del values[n:]
+            del returns[r:]
+            del frames[f:]
+
+
+class Profile(object):
+    """ What the rules did during a parse, per rule name, see
+        Parser(profile=True).
+
+        For each name, rules keeps a list of the number of calls, how many
+        matched and failed, the time spent in the rules, with and without
+        the rules they called, the characters they matched, and the ones
+        they had matched before failing, which were parsed for nothing.
+
+        The rules are counted by their Instrumented copies, which only the
+        parses that profile go through.
     """
 
-    def parse(self, input, currentresults=None, skip=None):
-        all_errors = []
-        results = Results()
+    def __init__(self):
+        # name -> [calls, matched, failed, inclusive time, exclusive time,
+        # matched characters, backtracked characters]
+        self.rules = {}
+        # A frame per rule being parsed : [rule, position, time spent in the
+        # rules it called, farthest position they matched up to]
+        self.stack = []
+        # How many rules are being parsed per name, so that the time of the
+        # recursive ones is only counted once.
+        self.depths = {}
 
-        for rule in self.productions:
+    @staticmethod
+    def counting(parse):
+        def counting_parse(self, input, currentresults=None, skip=None):
+            profile = input.profile
+            if profile is None:
+                return parse(self, input, currentresults, skip)
+            stack = profile.stack
+            pos = input.pos
+            name = self.name
+            if stack and stack[-1][1] == pos and stack[-1][0].name == name:
+                # A rule wrapping a rule of the same name, such as the Rule
+                # of a Repetition.
+                return parse(self, input, currentresults, skip)
+
+            depths = profile.depths
+            depths[name] = depths.get(name, 0) + 1
+            frame = [self, pos, 0.0, pos]
+            stack.append(frame)
+            start = _clock()
             try:
-                rule.parse(input, results, self.get_skip(skip))
-                res = results[0]
+                result = parse(self, input, currentresults, skip)
+            finally:
+                elapsed = _clock() - start
+                stack.pop()
+                depths[name] -= 1
+
+            counts = profile.rules.get(name)
+            if counts is None:
+                counts = profile.rules[name] = [0, 0, 0, 0.0, 0.0, 0, 0]
+            counts[0] += 1
+            if result is FAIL:
+                counts[2] += 1
+                counts[6] += frame[3] - pos
+            else:
+                counts[1] += 1
+                counts[5] += input.pos - pos
+            if not depths[name]:
+                counts[3] += elapsed
+            counts[4] += elapsed - frame[2]
+
+            if stack:
+                caller = stack[-1]
+                caller[2] += elapsed
+                if result is not FAIL and input.pos > caller[3]:
+                    caller[3] = input.pos
+            return result
+        return counting_parse
+
+    def report(self, limit=None):
+        """ Render the counts per rule, the rules that took the most time
+            by themselves first.
+        """
 
-                if self.action:
-                    currentresults.append(self.action(res))
-                else:
-                    currentresults.append(res)
-                return
-            except SyntaxError as e:
-                all_errors.append(e)
-                # We continue since the SyntaxError just means that we didn't match and
-                # must try the next choice.
-                continue
+        rules = sorted(self.rules.items(), key=lambda i: -i[1][4])
+        lines = [u("Profile: {0} calls of {1} rules").format(sum(c[0] for n, c in rules), len(rules)),
+            u("{0:>9} {1:>9} {2:>9} {3:>10} {4:>10} {5:>9} {6:>11}  {7}").format(
+                "calls", "matched", "failed", "inclusive", "exclusive", "consumed", "backtracked", "rule")]
+        for name, (calls, matched, failed, inclusive, exclusive, consumed, backtracked) in rules[:limit]:
+            lines.append(u("{0:>9} {1:>9} {2:>9} {3:>9.4f}s {4:>9.4f}s {5:>9} {6:>11}  {7}").format(
+                calls, matched, failed, inclusive, exclusive, consumed, backtracked, name))
 
-        raise SyntaxError(u("In [{0}], none of the provided choices matched").format(self.name), input, all_errors)
+        return "\n".join(lines)
 
-    def post_subrule_name(self, subn):
-        self.name = u("either({0})").format(subn)
+_clock = getattr(time, "perf_counter", time.time)
 
 
-class Any(Rule):
-    ''' a Rule matching any single token in the stream.
-    '''
+class Events(object):
+    """ Callbacks called as the rules of given names are parsed, so that
+        large inputs can be handled piece by piece, see Parser.parse().
 
-    def __init__(self):
-        self.name = "Any"
+        enter(name, start) is called when a rule starts, match(name, result,
+        start, end) when it matched, and exit(name, start, end) right after.
+        The result of a rule with a match callback is given to it and is
+        not kept ; the rules calling it get None instead.
 
-    def parse(self, input, currentresults=None, skip=None):
+        Only the rules that are part of the parse send events. Their
+        events wait until the parser can't backtrack before them anymore,
+        which is when they are before the positions the choices and the
+        repetitions being tried may rewind to (see Input.marks), and the
+        ones of a rule that fails are dropped. When the whole parse fails,
+        the events that were sent up to then stay sent.
 
-        save_pos = input.pos
+        The rules are parsed without memoization, regular expressions nor
+        Machine, by their Instrumented copies. The ones written by the
+        standalone backend only send the events of the rules that are called
+        from outside of them.
+    """
 
-        self.try_skip(input, skip)
+    def __init__(self):
+        # name -> (enter, match, exit)
+        self.handlers = {}
 
-        if not input.has_next():
-            input.rewind_to(save_pos)
-            raise SyntaxError("Want anything, but no more input", input)
+    def on(self, name, enter=None, match=None, exit=None):
+        """ Set the callbacks of the rules named name.
+        """
+        self.handlers[name] = (enter, match, exit)
+        return self
 
-        any = input.current()
-        input.advance(any)
-        currentresults.append(any)
+    @staticmethod
+    def send(input, everything=False):
+        """ Call the handlers of the pending events of input that can't be
+            retracted anymore, or of all of them.
+        """
+        pending = input.pending
+        n = len(pending)
+        if not everything:
+            if input.growing:
+                return
+            if input.marks:
+                limit = min(input.marks)
+                n = 0
+                while n < len(pending) and pending[n][2] < limit:
+                    n += 1
+        if n:
+            sent = pending[:n]
+            del pending[:n]
+            input.sent += n
+            for handler, args, pos in sent:
+                handler(*args)
 
-class MemoRule(Rule):
-    """ A rule that memorizes itself for future uses.
+    @staticmethod
+    def retract(input, n):
+        """ Drop the pending events of input after the n-th one since the
+            start of the parse.
+        """
+        del input.pending[max(n - input.sent, 0):]
+
+    @staticmethod
+    def listening(parse, lookahead):
+        def listening_parse(self, input, currentresults=None, skip=None):
+            events = input.events
+            if events is None:
+                return parse(self, input, currentresults, skip)
+
+            pending = input.pending
+            n = input.sent + len(pending)
+            name = self.name
+            handlers = events.handlers.get(name)
+            pos = input.pos
+            listening = input.listening
+            if lookahead or handlers is None or (listening and listening[-1][:2] == (name, pos) and listening[-1][2] is not self):
+                # A rule wrapping a rule of the same name, such as the Rule
+                # of a Repetition, sends nothing more, and what a look-ahead
+                # matches is not part of the parse.
+                result = parse(self, input, currentresults, skip)
+                if result is FAIL or lookahead:
+                    Events.retract(input, n)
+                return result
+
+            enter, match, exit = handlers
+            if enter is not None:
+                pending.append((enter, (name, pos), pos))
+            listening.append((name, pos, self))
+            m = len(currentresults)
+            try:
+                result = parse(self, input, currentresults, skip)
+            finally:
+                listening.pop()
+            if result is FAIL:
+                Events.retract(input, n)
+                return FAIL
+
+            end = input.pos
+            if match is not None:
+                value = None
+                if len(currentresults) > m:
+                    value = currentresults[m]
+                    currentresults[m] = None
+                pending.append((match, (name, value, pos, end), end))
+            if exit is not None:
+                pending.append((exit, (name, pos, end), end))
+            Events.send(input)
+            return result
+        return listening_parse
+
+
+class Instrumented(object):
+    """ Copies of the rules of a grammar whose parse methods count what they
+        do in the Profile of the input, and send its Events, so that only the
+        parses that ask for them go through them. The rules themselves, which
+        other parses may be using in other threads, are left as they are.
+
+        A rule is copied with the rules it refers to when it is first asked
+        for, and the rules FunctionRule builds when they are built. The copies
+        are instances of subclasses of the classes of the rules.
     """
 
-    def __init__(self, rule):
-        self.memorized = None
-        self.rule = rule
-        self.name = "Memorizing({0})".format(rule.name)
+    # The subclass of each class of rules.
+    classes = {}
 
-    def parse(self, input, currentresults=None, skip=None):
-        """
+    def __init__(self):
+        # rule -> copy
+        self.copies = {}
+
+    def copy(self, rule):
+        """ Get the copy of rule.
         """
-        if not self.memorized:
-            # act = self.__dict__.get("action", None)
-            # if act: del self.__dict__["action"]
-            self.rule.parse(input, currentresults, self.get_skip(skip))
+        with _building:
+            copy = self.copies.get(rule)
+            if copy is not None:
+                return copy
+
+            todo = []
+            def copy_of(rule):
+                copy = self.copies.get(rule)
+                if copy is None:
+                    copy = self.copies[rule] = object.__new__(Instrumented.subclass(rule.__class__))
+                    copy.__dict__.update(rule.__dict__)
+                    copy.original = rule
+                    copy.instrumented = self
+                    todo.append(copy)
+                return copy
+
+            first = copy_of(rule)
+            while todo:
+                copy = todo.pop()
+                for name, value in list(copy.__dict__.items()):
+                    if name == "original":
+                        continue
+                    if isinstance(value, Rule):
+                        copy.__dict__[name] = copy_of(value)
+                    elif isinstance(value, (list, tuple)) and value and all(isinstance(r, Rule) for r in value):
+                        copy.__dict__[name] = value.__class__([copy_of(r) for r in value])
+                if isinstance(copy, Either):
+                    # The tables list the rules that were copied.
+                    copy.dispatches = {}
+            return first
 
-            res = currentresults[len(currentresults) - 1]
-            if not isinstance(res, list) and not isinstance(res, tuple):
-                self.memorized = Rule(res)
-            else:
-                self.memorized = Rule(*res)
-        else:
-            # The rule is now memorized, and we can execute it.
-            self.memorized.parse(input, currentresults, self.get_skip(skip))
+    @staticmethod
+    def subclass(cls):
+        sub = Instrumented.classes.get(cls)
+        if sub is None:
+            bases = (cls,)
+            if issubclass(cls, FunctionRule):
+                bases = (_InstrumentedFunctionRule, cls)
+            elif issubclass(cls, FunctionRule.InstanciatedRule):
+                bases = (_InstrumentedInstanciatedRule, cls)
+            parse = Profile.counting(Events.listening(cls.parse, issubclass(cls, (Not, And))))
+            sub = Instrumented.classes[cls] = type(cls.__name__, bases, {"parse": parse})
+        return sub
+
+
+class _InstrumentedFunctionRule(object):
+    """ The copies of FunctionRule parse with the copy of their instance.
+    """
+    def get_instance(self):
+        instance = self.instance
+        if instance is None:
+            instance = self.instance = self.instrumented.copy(self.original.get_instance())
+        return instance
+
+
+class _InstrumentedInstanciatedRule(object):
+    """ The copies of FunctionRule.InstanciatedRule parse with the copy of
+        the rule the function builds.
+    """
+    def get_rule(self):
+        rule = self.rule
+        if rule is None:
+            rule = self.rule = self.instrumented.copy(self.original.get_rule())
+        return rule
+
+
+class Incremental(object):
+    """ The outcome of Parser.parse_incremental() and Parser.reparse() ;
+        the result of the text, or the exception it raised such as a
+        SyntaxError, along with the memoization table to give to the next
+        reparse.
+    """
+
+    def __init__(self, text, memo, result, error=None):
+        self.text = text
+        self.memo = memo
+        self.result = result
+        self.error = error
 
 
 class Parser(object):
@@ -620,27 +3971,354 @@ class Parser(object):
         any rule, useful to remove white spaces and comments.
     """
 
-    def __init__(self, toprule):
+    engines = ("rules", "machine")
+
+    def __init__(self, toprule, packrat=False, memo_size=None, memo_policy="lru", error_tree=False, regular=False, engine="rules", profile=False):
+        """
+            Args:
+                toprule: the rule the parsing starts with.
+                packrat: memoize the outcome of rules per position, so that
+                    they are not parsed again when backtracking.
+                memo_size: the maximum number of outcomes kept by the packrat
+                    memoization, None for no limit.
+                memo_policy: how to evict outcomes when memo_size is reached,
+                    see Memo.
+                error_tree: keep the failures of all the rules that were tried
+                    to report them in SyntaxError.fullmessage(), which helps
+                    debugging grammars. Otherwise only the terminals expected
+                    at the farthest position are reported.
+                regular: compile the regular parts of the grammar into
+                    regular expressions, see compile_regular().
+                engine: "rules" to parse by calling the rules, or "machine"
+                    to parse with a Machine, which does not recurse. The rules
+                    are still called when there is an error tree, a
+                    memoization table, a profile or events.
+                profile: count what each rule does during a parse in a
+                    Profile, which is then the profile attribute. The rules
+                    are called without regular expressions, and parse slower.
+        """
+
+        if engine not in Parser.engines:
+            raise Exception(u("Unknown engine '{0}', expected one of {1}").format(engine, ", ".join(Parser.engines)))
 
         if not isinstance(toprule, Rule):
             toprule = Rule(toprule)
 
         self.toprule = toprule
+        self.packrat = packrat
+        self.memo_size = memo_size
+        self.memo_policy = memo_policy
+        self.error_tree = error_tree
+        self.regular = regular
+        self.engine = engine
+        self.profiling = profile
+        # The memoization table of the last parse, to look at its statistics.
+        self.memo = None
+        # The Profile of the last parse.
+        self.profile = None
+        # The Machine of the rules, compiled when it is first used.
+        self.machine = None
+        # The Instrumented copies of the rules, made for the first parse that
+        # profiles or sends events.
+        self.instrumented = None
+
+        find_left_recursion(self.toprule)
+        if regular:
+            compile_regular(self.toprule)
+
+
+    def input(self, text, regular=True, events=None):
+        """ Get the Input to parse text with.
+        """
+        return self.prepare(TextInput(text), regular, events)
+
+    def prepare(self, input, regular=True, events=None):
+        """ Set up an Input with the options of the parser, and the Events
+            to send if any.
+        """
+        input.error_tree = self.error_tree
+        input.regular = regular and self.regular and input.regular and not self.error_tree and not self.profiling and events is None
+
+        if self.packrat and events is None:
+            input.memo = self.memo = Memo(self.memo_size, self.memo_policy)
 
+        if self.profiling:
+            input.profile = self.profile = Profile()
 
-    def parse(self, input):
+        input.events = events
+        return input
+
+    def parse(self, input, events=None):
         """ Parse the given input and return the result of the parsing.
 
             An Exception will be raised if the parsing does not use the
             integrality of the input.
+
+            With events, the handlers of an Events are called as the rules
+            are parsed.
+        """
+
+        text = input
+        return self.run(self.input(text, events=events), lambda: self.input(text, regular=False))
+
+    def parse_stream(self, fileobj, chunk_size=65536, lookahead=None, encoding="utf-8", events=None):
+        """ Parse the content of a file-like object without reading it all
+            in memory, see StreamInput. With events, the handlers of an
+            Events are called as the rules are parsed.
+
+            The rules written by the standalone backend need the whole text,
+            and can't parse streams.
+        """
+
+        try:
+            start = fileobj.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            start = None
+
+        def reparse():
+            # The stream can only be parsed again if it can be rewound.
+            if start is None:
+                return None
+            fileobj.seek(start)
+            return self.prepare(StreamInput(fileobj, chunk_size, lookahead, encoding), regular=False)
+
+        return self.run(self.prepare(StreamInput(fileobj, chunk_size, lookahead, encoding), events=events), reparse)
+
+    def parse_file(self, path, events=None):
+        """ Parse a UTF-8 encoded file, which is mapped in memory rather
+            than read, see BytesInput. With events, the handlers of an
+            Events are called as the rules are parsed.
+
+            The rules compiled to regular expressions are parsed as usual,
+            since the expressions work on characters.
+        """
+
+        f = open(path, "rb")
+        try:
+            try:
+                import mmap
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped.
+                data = b""
+        finally:
+            # The map stays valid once the file is closed.
+            f.close()
+
+        try:
+            return self.run(self.prepare(BytesInput(data), regular=False, events=events), lambda: None)
+        except SyntaxError as e:
+            # It can't read the map once it is closed.
+            e.detach()
+            raise
+        finally:
+            if not isinstance(data, bytes):
+                data.close()
+
+    def parse_tokens(self, text, lexer, events=None):
+        """ Parse the tokens the Lexer finds in text, see TokenInput. With
+            events, the handlers of an Events are called as the rules are
+            parsed, with the indexes of the tokens as positions.
+        """
+
+        return self.run(self.prepare(TokenInput(lexer.lex(text)), events=events), lambda: None)
+
+    def iterparse(self, input, chunk_size=65536, lookahead=None, encoding="utf-8"):
+        """ Parse input with a top rule that is a Repetition, or a Rule with
+            only a Repetition, and yield the result of each repetition as
+            soon as it is parsed, rather than all of them at the end.
+
+            input is a text, a file-like object read as a StreamInput, or an
+            Input. The results are not kept once yielded, nor the memorized
+            outcomes of the rules before them, nor, for a StreamInput, the
+            text before them. The actions of the repetition and of the Rule
+            around it are not called. The rules are called rather than a
+            Machine.
+
+            The errors are the ones parse() would raise, once the
+            repetitions before them were yielded.
+        """
+
+        # The repetition, and the skip it inherits from the rules around it.
+        around = []
+        rule, skip = self.toprule, None
+        while not isinstance(rule, Repetition):
+            if rule.__class__ is not Rule or rule.single is None:
+                raise Exception(u("Can't iterate over {0}, which is not a repetition").format(self.toprule.name))
+            around.append((rule, skip))
+            skip = rule.get_skip(skip)
+            rule = rule.single
+
+        if isinstance(input, Input):
+            input = self.prepare(input)
+        elif hasattr(input, "read"):
+            input = self.prepare(StreamInput(input, chunk_size, lookahead, encoding))
+        else:
+            input = self.input(input)
+
+        for r, s in around:
+            r.try_skip(input, s)
+
+        subskip = rule.get_skip(skip)
+        marks = input.marks
+        times = 0
+        pos = input.pos
+        committed = False
+        while input.has_next() and (rule._to == -1 or times < rule._to):
+            pos = input.pos
+            results = []
+            # The repetition resumes from where it started.
+            marks.append(pos)
+            try:
+                if input.profile is not None:
+                    outcome = self.instrument(rule.rule).parse(input, results, subskip)
+                else:
+                    outcome = rule.rule.parse(input, results, subskip)
+            except Committed:
+                committed = True
+                break
+            mark = marks.pop()
+            if outcome is FAIL:
+                committed = mark is _COMMITTED
+                break
+            times += 1
+            input.forget_before(input.pos)
+            yield results[0]
+
+        if committed or (rule._from != -1 and times < rule._from):
+            if input.regular_matched:
+                # Find out what the regular expressions expected.
+                input.regular = False
+                input.memo = None
+                del marks[:]
+                input.seek(pos)
+                try:
+                    rule.rule.parse(input, [], subskip)
+                except Committed:
+                    pass
+            raise input.error(self.toprule)
+
+        if input.has_next():
+            raise Exception(u("Finished parsing, but all the input was not consumed by the parser. Leftovers: '{0}'").format(input.rest()))
+
+    def parse_many(self, texts, workers=None, rule=None, ordered=True, chunksize=16):
+        """ Parse many independent texts over a pool of worker processes,
+            yielding a tuple (index, result, error) per text ; error is the
+            exception the text raised, such as a SyntaxError, or None.
+
+            Since the rules can't be pickled, each worker imports the top rule
+            from rule, a "module:attribute" reference, which is looked for
+            among the loaded modules when it is not given. The results and
+            the errors that are not SyntaxError must be picklable.
+
+            Args:
+                texts: an iterable of texts, which is read as the workers
+                    need more texts rather than all at once.
+                workers: the number of processes, by default the number of
+                    processors.
+                ordered: yield the results in the order of texts, rather than
+                    as they are ready.
+                chunksize: how many texts are sent to a worker at a time.
+        """
+
+        # Only needed here, and slow to import.
+        import multiprocessing
+
+        if rule is None:
+            rule = self.reference()
+        options = dict(packrat=self.packrat, memo_size=self.memo_size, memo_policy=self.memo_policy,
+            error_tree=self.error_tree, regular=self.regular, engine=self.engine)
+
+        workers = workers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(workers, _parse_many_start, (rule, options))
+        # Only a few chunks are sent ahead of the results, so that texts can
+        # be a generator of more documents than fit in memory.
+        window = threading.Semaphore(2 * workers)
+        stopped = []
+
+        def chunks():
+            documents = enumerate(texts)
+            while True:
+                chunk = list(islice(documents, chunksize))
+                if not chunk:
+                    return
+                window.acquire()
+                if stopped:
+                    return
+                yield chunk
+
+        try:
+            for parsed in (pool.imap if ordered else pool.imap_unordered)(_parse_many_chunk, chunks()):
+                window.release()
+                for item in parsed:
+                    yield item
+        finally:
+            stopped.append(True)
+            window.release()
+            pool.terminate()
+            pool.join()
+
+    def reference(self):
+        """ Find the "module:attribute" reference of the top rule among the
+            loaded modules.
+        """
+        for name, module in list(sys.modules.items()):
+            for attribute, value in list(getattr(module, "__dict__", {}).items()):
+                if value is self.toprule:
+                    return u("{0}:{1}").format(name, attribute)
+        raise Exception(u("Can't find the module of {0}, give its reference as module:attribute").format(self.toprule.name))
+
+    def parse_incremental(self, text):
+        """ Parse text, keeping what is needed to parse it again once it
+            is edited with reparse(). Gets an Incremental.
+
+            The grammar should be made of combinators, whose actions and
+            predicates only depend on their arguments.
+        """
+
+        return self.incremental(text, IncrementalMemo(len(text)))
+
+    def reparse(self, previous, offset, removed, inserted):
+        """ Parse the text of a previous Incremental once the removed
+            characters at offset are replaced by the inserted text. Only the
+            rules that looked at the edited part are parsed again.
+
+            The memoization table goes to the new Incremental, so previous
+            can't be reparsed again.
+        """
+
+        text = previous.text[:offset] + inserted + previous.text[offset + removed:]
+        return self.incremental(text, previous.memo.edit(offset, removed, len(inserted)))
+
+    def incremental(self, text, memo):
+        input = self.prepare(IncrementalInput(text), regular=False)
+        input.memo = self.memo = memo
+        try:
+            return Incremental(text, memo, self.run(input, lambda: None))
+        except Exception as e:
+            return Incremental(text, memo, None, e)
+
+    def run(self, input, reparse):
+        """ Parse input with the top rule. reparse gets a new Input without
+            the regular expressions of compile_regular(), or None if there
+            is no way to parse again.
         """
 
-        input = TextInput(input)
         results = Results()
-        self.toprule.parse(input, results, None)
+        if self.parse_top(input, results) is FAIL:
+            if input.regular_matched:
+                # Find out what the regular expressions expected.
+                again = reparse()
+                if again is not None:
+                    input = again
+                    self.parse_top(input, Results())
+            raise input.error(self.toprule)
 
         if input.has_next():
-            raise Exception(u("Finished parsing, but all the input was not consumed by the parser. Leftovers: '{0}'").format(input.input[input.pos:]))
+            raise Exception(u("Finished parsing, but all the input was not consumed by the parser. Leftovers: '{0}'").format(input.rest()))
+
+        if input.events is not None:
+            Events.send(input, everything=True)
 
         # Everything went fine, sending the results.
         if len(results) == 1:
@@ -648,6 +4326,34 @@ class Parser(object):
         return results
 
 
+    def parse_top(self, input, results):
+        """ Parse input with the top rule, using the engine of the parser.
+            A choice committed by a Cut that fails is a failure of the top
+            rule.
+        """
+        try:
+            if input.profile is not None or input.events is not None:
+                return self.instrument(self.toprule).parse(input, results, None)
+            if self.engine == "machine" and input.memo is None and not input.error_tree:
+                if self.machine is None:
+                    self.machine = Machine(self.toprule)
+                return self.machine.parse(input, results)
+            return self.toprule.parse(input, results, None)
+        except Committed:
+            return FAIL
+
+    def instrument(self, rule):
+        """ Get the copy of one of the rules that counts what it does in the
+            Profile of the inputs and sends their Events.
+        """
+        instrumented = self.instrumented
+        if instrumented is None:
+            with _building:
+                if self.instrumented is None:
+                    self.instrumented = Instrumented()
+            instrumented = self.instrumented
+        return instrumented.copy(rule)
+
     def partial_parse(self, input, *args, **kwargs):
         """ Parse the given input and return only the result of the parsing,
             which is a tuple containing the (number of consumed characters, result of parsing).
@@ -658,3 +4364,32 @@ class Parser(object):
 
         return self.toprule.parse(input)
 
+
+
+# The Parser of a Parser.parse_many() worker process.
+_parse_many_parser = None
+
+def _parse_many_start(rule, options):
+    """ Build the Parser of a worker from the reference of its top rule.
+    """
+    global _parse_many_parser
+    import importlib
+    module, attribute = rule.split(":")
+    _parse_many_parser = Parser(getattr(importlib.import_module(module), attribute), **options)
+
+def _parse_many_chunk(documents):
+    """ Parse (index, text) tuples in a worker, and get their
+        (index, result, error) tuples.
+    """
+    parsed = []
+    for index, text in documents:
+        try:
+            parsed.append((index, _parse_many_parser.parse(text), None))
+        except Exception as e:
+            try:
+                import pickle
+                pickle.dumps(e)
+            except Exception:
+                e = Exception(u("{0}: {1}").format(e.__class__.__name__, e))
+            parsed.append((index, None, e))
+    return parsed
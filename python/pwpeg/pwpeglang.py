@@ -8,38 +8,7 @@ import re
 from .pwpeg import *
 from .helpers import *
 from .pwast import *
-
-re_regexp = re.compile("/(\\/|[^/])+/([idsmlux]+)?")
-
-def _regexp_action(contents, flags):
-    args = []
-
-    args.append('\'' + contents.replace('\'', '\\\'') + '\'')
-
-    if flags:
-        fs = []
-        for f in flags:
-            fs.append("re.{0}".format(f.upper()))
-        fs = " & ".join(fs)
-        args.append(fs)
-
-    return "re.compile({0})".format(", ".join(args))
-
-def replace_regexps(t):
-    return re_regexp.sub(lambda m: _regexp_action(m.group(0)[1:-1], m.group(2)), t)
-
-def concat(arr):
-    if arr is None or len(arr) == 0:
-        return ""
-
-    res = []
-    for a in arr:
-        if isinstance(a, list):
-            res.append(concat(a))
-        else:
-            res.append(a)
-
-    return "".join(res)
+from .pwast import _regexp_action
 
 PIPE = "|"
 SPACE = Rule(re.compile("\s*")).set_name("Whitespaces")
@@ -54,6 +23,7 @@ ARROW = "->"
 DOLLAR = "$"
 AMPS = "&"
 EXCL = "!"
+TILDE = "~"
 EQUAL = "="
 COLON = ":"
 COMMA = ","
@@ -155,6 +125,10 @@ predicate = Rule(
 ).set_action(lambda p: AstPredicate(concat(p[1:-1])))
 predicate.set_name("Predicate")
 
+###############################
+# ~
+cut = Rule(TILDE).set_action(lambda t: AstCut()).set_name("Cut")
+
 ###############################
 # rule_ident
 # rule_ident(balanced_paren, args)
@@ -230,7 +204,8 @@ production_group.set_productions(
     OneOrMore(Either(
         look_ahead,
         production,
-        predicate
+        predicate,
+        cut
     )),
     Optional(action)
 ).set_action(lambda rules, a: AstProductionGroup(rules).set_action(a))
@@ -0,0 +1,1038 @@
+#!/usr/bin/env python
+# Parser written by the standalone backend of pwpeg.
+
+# So that python 2 does not import the modules of pwpeg as relative
+# to a parser written in its package.
+from __future__ import absolute_import
+
+from pwpeg import *
+from pwpeg.helpers import *
+
+
+##############################################################
+# Start of included code
+from pwpeg.pwast import *
+from pwpeg.pwast import _regexp_action
+
+def multi_line_code(text):
+    # The lines of a multi line action without the indentation of the
+    # first one. The lines that do not start with it are only blanks, and
+    # each stands for a new line.
+    lines = text[text.index("\n", text.index("->")) + 1:].split("\n")[:-1]
+    if not lines:
+        return ""
+    indent = lines[0][:len(lines[0]) - len(lines[0].lstrip(" \t"))]
+    return "\n".join([l[len(indent):] if l.startswith(indent) else "\n" for l in lines])
+
+# End of included code
+##############################################################
+
+# Terminals
+_t0 = RegexpRule(re.compile('\\s*->[ \t]*\n(?:([ \t]+)[^\n]*\n(?:\\1[^\n]*\n|[ \t]+\n)*)?'))
+_m0 = _t0.regexp.match
+_t1 = RegexpRule(re.compile('->[^\n]*'))
+_m1 = _t1.regexp.match
+_t2 = RegexpRule(re.compile('[ \t]+'))
+_m2 = _t2.regexp.match
+_t3 = StringRule('%%')
+_t4 = RegexpRule(re.compile('((?!%%).)*', re.S))
+_m4 = _t4.regexp.match
+_t5 = StringRule('~')
+_t6 = RegexpRule(re.compile('[a-zA-Z_][a-zA-Z0-9_]*'))
+_m6 = _t6.regexp.match
+_t7 = StringRule(':')
+_t8 = StringRule('!')
+_t9 = StringRule('&')
+_t10 = RegexpRule(re.compile('-?[0-9]+'))
+_m10 = _t10.regexp.match
+_t11 = StringRule('|')
+_t12 = RegexpRule(re.compile('\x2f(\\\\\x2f|(?!\x2f).)*\x2f[idsmlux]*', re.S))
+_m12 = _t12.regexp.match
+_t13 = StringRule('*')
+_t14 = StringRule('+')
+_t15 = StringRule('?')
+_t16 = StringRule('<')
+_t17 = StringRule('>')
+_t18 = StringRule(',')
+_t19 = StringRule('[')
+_t20 = StringRule(']')
+_t21 = StringRule('skip')
+_t22 = StringRule('=')
+_t23 = RegexpRule(re.compile('(\\s+|#.*$)*', re.M))
+_m23 = _t23.regexp.match
+_t24 = RegexpRule(re.compile('\'(\\\\.|(?!\').)*\'', re.S))
+_m24 = _t24.regexp.match
+_t25 = RegexpRule(re.compile('"(\\\\.|(?!").)*"', re.S))
+_m25 = _t25.regexp.match
+_t26 = RegexpRule(re.compile('\\\\[^ \t\n\\[\\]\\|\\)]+'))
+_m26 = _t26.regexp.match
+
+
+# Forward declaration of Function rules
+
+
+# Actions
+_fn0 = lambda start, rules, end, _3: (AstFile(start.strip() if start else "", rules, end.strip() if end else ""))
+_fn1 = lambda _0, body, _2: (body)
+_fn2 = lambda decl, rules: (decl.set_productions(rules))
+_fn3 = lambda decl, sk, _2: (decl.set_skip(sk[1] if sk else None))
+_fn4 = lambda i, b: (AstRuleDeclaration(i).set_args(replace_regexps(concat(b))))
+_fn5 = lambda first, rest: (AstProductionChoices([first] + [r[1] for r in rest]))
+_fn6 = lambda rules, a: (AstProductionGroup(rules).set_action(a))
+_fn7 = lambda symbol, p, rep: (AstLookAhead(p.set_repetition(rep), symbol))
+_fn8 = lambda l, p, rep: (p.set_label(l).set_repetition(rep))
+_fn9 = lambda name, _1: (name)
+_fn10 = lambda t: (AstProduction(t))
+_fn11 = lambda d: (AstRuleCall(d))
+_fn12 = lambda _0, alts, _2: (alts)
+_fn13 = lambda r: (_regexp_action(r[1:r.rindex("/")], r[r.rindex("/") + 1:]))
+_fn14 = lambda s: ("'" + s[1:].replace('\'', '\\\'').replace('\\', '\\\\') + "'")
+_fn15 = lambda _0: ((0, -1))
+_fn16 = lambda _0: ((1, -1))
+_fn17 = lambda _0: ((0, 1))
+_fn18 = lambda _0, n, _2: ((n, n))
+_fn19 = lambda _0, fr, _2, to, _4: ((-1 if fr is None else fr, -1 if to is None else to))
+_fn20 = lambda n: (int(n))
+_fn21 = lambda p: (AstPredicate(concat(p[1:-1])))
+_fn22 = lambda _0: (AstCut())
+_fn23 = lambda text: (multi_line_code(text))
+_fn24 = lambda line: (line[2:].strip())
+
+# Parsing functions
+def _parse_action(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    ok3 = False
+    while True:
+        r = _parse_action_multi_line(inp, pos, skip)
+        if r is None:
+            break
+        pos, v4 = r
+        v2 = v4
+        ok3 = True
+        break
+    if not ok3:
+        r = _parse_action_single_line(inp, pos, skip)
+        if r is None:
+            pos = p1
+            return None
+        pos, v5 = r
+        v2 = v5
+    return pos, v2
+
+def _parse_action_multi_line(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m0(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t0)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    v3 = _fn23(v2)
+    return pos, v3
+
+def _parse_action_single_line(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m1(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t1)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    v3 = _fn24(v2)
+    return pos, v3
+
+def _parse_blanks(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m2(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t2)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    return pos, v2
+
+def _parse_code(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith('%%', pos):
+        inp.pos = pos
+        inp.expect(_t3)
+        pos = p1
+        return None
+    pos += 2
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m4(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t4)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith('%%', pos):
+        inp.pos = pos
+        inp.expect(_t3)
+        pos = p1
+        return None
+    pos += 2
+    v3 = _fn1('%%', v2, '%%')
+    return pos, v3
+
+def _parse_cut(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith('~', pos):
+        inp.pos = pos
+        inp.expect(_t5)
+        pos = p1
+        return None
+    pos += 1
+    v2 = _fn22('~')
+    return pos, v2
+
+def _parse_grammarrule(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_rule_declaration(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_production_group_choices(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v3 = r
+    v4 = _fn2(v2, v3)
+    return pos, v4
+
+def _parse_identifier(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m6(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t6)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    return pos, v2
+
+def _parse_label(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_identifier(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith(':', pos):
+        inp.pos = pos
+        inp.expect(_t7)
+        pos = p1
+        return None
+    pos += 1
+    v3 = _fn9(v2, ':')
+    return pos, v3
+
+def _parse_look_ahead(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    ok3 = False
+    while True:
+        if not s.startswith('!', pos):
+            inp.pos = pos
+            inp.expect(_t8)
+            break
+        pos += 1
+        v2 = '!'
+        ok3 = True
+        break
+    if not ok3:
+        if not s.startswith('&', pos):
+            inp.pos = pos
+            inp.expect(_t9)
+            pos = p1
+            return None
+        pos += 1
+        v2 = '&'
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_production(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v4 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v5 = None
+    if pos < n:
+        while True:
+            p6 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_repetition(inp, pos, skip)
+            if r is None:
+                pos = p6
+                break
+            pos, v7 = r
+            v5 = v7
+            break
+    v8 = _fn7(v2, v4, v5)
+    return pos, v8
+
+def _parse_number(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m10(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t10)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    v3 = _fn20(v2)
+    return pos, v3
+
+def _parse_predicate(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _r0.parse_at(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    v3 = _fn21(v2)
+    return pos, v3
+
+def _parse_production(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v2 = None
+    if pos < n:
+        while True:
+            p3 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_label(inp, pos, skip)
+            if r is None:
+                pos = p3
+                break
+            pos, v4 = r
+            v2 = v4
+            break
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    p5 = pos
+    ok6 = False
+    while True:
+        p7 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        r = _parse_rule_declaration(inp, pos, skip)
+        if r is None:
+            pos = p7
+            break
+        pos, v8 = r
+        ok6 = True
+        break
+    pos = p5
+    if ok6:
+        pos = p1
+        return None
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    ok10 = False
+    while True:
+        r = _parse_terminal(inp, pos, skip)
+        if r is None:
+            break
+        pos, v11 = r
+        v9 = v11
+        ok10 = True
+        break
+    if not ok10:
+        while True:
+            r = _parse_rule_call(inp, pos, skip)
+            if r is None:
+                break
+            pos, v12 = r
+            v9 = v12
+            ok10 = True
+            break
+    if not ok10:
+        r = _parse_rule_choices(inp, pos, skip)
+        if r is None:
+            pos = p1
+            return None
+        pos, v13 = r
+        v9 = v13
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v14 = None
+    if pos < n:
+        while True:
+            p15 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_repetition(inp, pos, skip)
+            if r is None:
+                pos = p15
+                break
+            pos, v16 = r
+            v14 = v16
+            break
+    v17 = _fn8(v2, v9, v14)
+    return pos, v17
+
+def _parse_production_group(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    p2 = pos
+    l3 = []
+    while pos < n:
+        p4 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        ok6 = False
+        while True:
+            r = _parse_look_ahead(inp, pos, skip)
+            if r is None:
+                break
+            pos, v7 = r
+            v5 = v7
+            ok6 = True
+            break
+        if not ok6:
+            while True:
+                r = _parse_production(inp, pos, skip)
+                if r is None:
+                    break
+                pos, v8 = r
+                v5 = v8
+                ok6 = True
+                break
+        if not ok6:
+            while True:
+                r = _parse_predicate(inp, pos, skip)
+                if r is None:
+                    break
+                pos, v9 = r
+                v5 = v9
+                ok6 = True
+                break
+        if not ok6:
+            r = _parse_cut(inp, pos, skip)
+            if r is None:
+                pos = p4
+                break
+            pos, v10 = r
+            v5 = v10
+        l3.append(v5)
+    if len(l3) < 1:
+        pos = p2
+        pos = p1
+        return None
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v11 = None
+    if pos < n:
+        while True:
+            p12 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_action(inp, pos, skip)
+            if r is None:
+                pos = p12
+                break
+            pos, v13 = r
+            v11 = v13
+            break
+    v14 = _fn6(l3, v11)
+    return pos, v14
+
+def _parse_production_group_choices(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_production_group(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    p3 = pos
+    l4 = []
+    while pos < n:
+        p5 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        p6 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        if not s.startswith('|', pos):
+            inp.pos = pos
+            inp.expect(_t11)
+            pos = p5
+            break
+        pos += 1
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        r = _parse_production_group(inp, pos, skip)
+        if r is None:
+            pos = p5
+            break
+        pos, v7 = r
+        v8 = ['|', v7]
+        l4.append(v8)
+    v9 = _fn5(v2, l4)
+    return pos, v9
+
+def _parse_regexp(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m12(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t12)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    v3 = _fn13(v2)
+    return pos, v3
+
+def _parse_repetition(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    ok3 = False
+    while True:
+        p4 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        if not s.startswith('*', pos):
+            inp.pos = pos
+            inp.expect(_t13)
+            pos = p4
+            break
+        pos += 1
+        v5 = _fn15('*')
+        v2 = v5
+        ok3 = True
+        break
+    if not ok3:
+        while True:
+            p6 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            if not s.startswith('+', pos):
+                inp.pos = pos
+                inp.expect(_t14)
+                pos = p6
+                break
+            pos += 1
+            v7 = _fn16('+')
+            v2 = v7
+            ok3 = True
+            break
+    if not ok3:
+        while True:
+            p8 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            if not s.startswith('?', pos):
+                inp.pos = pos
+                inp.expect(_t15)
+                pos = p8
+                break
+            pos += 1
+            v9 = _fn17('?')
+            v2 = v9
+            ok3 = True
+            break
+    if not ok3:
+        while True:
+            p10 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            if not s.startswith('<', pos):
+                inp.pos = pos
+                inp.expect(_t16)
+                pos = p10
+                break
+            pos += 1
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_number(inp, pos, skip)
+            if r is None:
+                pos = p10
+                break
+            pos, v11 = r
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            if not s.startswith('>', pos):
+                inp.pos = pos
+                inp.expect(_t17)
+                pos = p10
+                break
+            pos += 1
+            v12 = _fn18('<', v11, '>')
+            v2 = v12
+            ok3 = True
+            break
+    if not ok3:
+        p13 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        if not s.startswith('<', pos):
+            inp.pos = pos
+            inp.expect(_t16)
+            pos = p1
+            return None
+        pos += 1
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        v14 = None
+        if pos < n:
+            while True:
+                p15 = pos
+                if skip is not None:
+                    pos = skip.skip_from(inp, pos)
+                r = _parse_number(inp, pos, skip)
+                if r is None:
+                    pos = p15
+                    break
+                pos, v16 = r
+                v14 = v16
+                break
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        if not s.startswith(',', pos):
+            inp.pos = pos
+            inp.expect(_t18)
+            pos = p1
+            return None
+        pos += 1
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        v17 = None
+        if pos < n:
+            while True:
+                p18 = pos
+                if skip is not None:
+                    pos = skip.skip_from(inp, pos)
+                r = _parse_number(inp, pos, skip)
+                if r is None:
+                    pos = p18
+                    break
+                pos, v19 = r
+                v17 = v19
+                break
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        if not s.startswith('>', pos):
+            inp.pos = pos
+            inp.expect(_t17)
+            pos = p1
+            return None
+        pos += 1
+        v20 = _fn19('<', v14, ',', v17, '>')
+        v2 = v20
+    return pos, v2
+
+def _parse_rule_call(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_rule_identifier(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    v3 = _fn11(v2)
+    return pos, v3
+
+def _parse_rule_choices(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith('[', pos):
+        inp.pos = pos
+        inp.expect(_t19)
+        pos = p1
+        return None
+    pos += 1
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_production_group_choices(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith(']', pos):
+        inp.pos = pos
+        inp.expect(_t20)
+        pos = p1
+        return None
+    pos += 1
+    v3 = _fn12('[', v2, ']')
+    return pos, v3
+
+def _parse_rule_declaration(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_rule_identifier(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v3 = None
+    if pos < n:
+        while True:
+            p4 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            p5 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            if not s.startswith('skip', pos):
+                inp.pos = pos
+                inp.expect(_t21)
+                pos = p4
+                break
+            pos += 4
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_production(inp, pos, skip)
+            if r is None:
+                pos = p4
+                break
+            pos, v6 = r
+            v7 = ['skip', v6]
+            v3 = v7
+            break
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    if not s.startswith('=', pos):
+        inp.pos = pos
+        inp.expect(_t22)
+        pos = p1
+        return None
+    pos += 1
+    v8 = _fn3(v2, v3, '=')
+    return pos, v8
+
+def _parse_rule_identifier(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    r = _parse_identifier(inp, pos, skip)
+    if r is None:
+        pos = p1
+        return None
+    pos, v2 = r
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v3 = None
+    if pos < n:
+        while True:
+            p4 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _r1.parse_at(inp, pos, skip)
+            if r is None:
+                pos = p4
+                break
+            pos, v5 = r
+            v3 = v5
+            break
+    v6 = _fn4(v2, v3)
+    return pos, v6
+
+def _parse_space_and_comments(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    m = _m23(s, pos)
+    if m is None:
+        inp.pos = pos
+        inp.expect(_t23)
+        pos = p1
+        return None
+    pos = m.end()
+    v2 = m.group()
+    return pos, v2
+
+def _parse_string(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    ok3 = False
+    while True:
+        m = _m24(s, pos)
+        if m is None:
+            inp.pos = pos
+            inp.expect(_t24)
+            break
+        pos = m.end()
+        v4 = m.group()
+        v2 = v4
+        ok3 = True
+        break
+    if not ok3:
+        while True:
+            m = _m25(s, pos)
+            if m is None:
+                inp.pos = pos
+                inp.expect(_t25)
+                break
+            pos = m.end()
+            v5 = m.group()
+            v2 = v5
+            ok3 = True
+            break
+    if not ok3:
+        p6 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        m = _m26(s, pos)
+        if m is None:
+            inp.pos = pos
+            inp.expect(_t26)
+            pos = p1
+            return None
+        pos = m.end()
+        v7 = m.group()
+        v8 = _fn14(v7)
+        v2 = v8
+    return pos, v2
+
+def _parse_terminal(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    ok3 = False
+    while True:
+        r = _parse_regexp(inp, pos, skip)
+        if r is None:
+            break
+        pos, v4 = r
+        v2 = v4
+        ok3 = True
+        break
+    if not ok3:
+        r = _parse_string(inp, pos, skip)
+        if r is None:
+            pos = p1
+            return None
+        pos, v5 = r
+        v2 = v5
+    v6 = _fn10(v2)
+    return pos, v6
+
+def _parse__skip_toplevel(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    r = _parse_space_and_comments(inp, pos, skip)
+    if r is None:
+        return None
+    pos, v1 = r
+    return pos, v1
+
+def _parse_toplevel(inp, pos, skip):
+    s = inp.input
+    n = len(s)
+    skip = _skip_toplevel
+    p1 = pos
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v2 = None
+    if pos < n:
+        while True:
+            p3 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_code(inp, pos, skip)
+            if r is None:
+                pos = p3
+                break
+            pos, v4 = r
+            v2 = v4
+            break
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    p5 = pos
+    l6 = []
+    while pos < n:
+        p7 = pos
+        if skip is not None:
+            pos = skip.skip_from(inp, pos)
+        r = _parse_grammarrule(inp, pos, skip)
+        if r is None:
+            pos = p7
+            break
+        pos, v8 = r
+        l6.append(v8)
+    if len(l6) < 1:
+        pos = p5
+        pos = p1
+        return None
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v9 = None
+    if pos < n:
+        while True:
+            p10 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_code(inp, pos, skip)
+            if r is None:
+                pos = p10
+                break
+            pos, v11 = r
+            v9 = v11
+            break
+    if skip is not None:
+        pos = skip.skip_from(inp, pos)
+    v12 = None
+    if pos < n:
+        while True:
+            p13 = pos
+            if skip is not None:
+                pos = skip.skip_from(inp, pos)
+            r = _parse_blanks(inp, pos, skip)
+            if r is None:
+                pos = p13
+                break
+            pos, v14 = r
+            v12 = v14
+            break
+    v15 = _fn0(v2, l6, v9, v12)
+    return pos, v15
+
+
+# Rules
+action = CompiledRule(_parse_action, "action")
+action_multi_line = CompiledRule(_parse_action_multi_line, "action_multi_line")
+action_single_line = CompiledRule(_parse_action_single_line, "action_single_line")
+blanks = CompiledRule(_parse_blanks, "blanks")
+code = CompiledRule(_parse_code, "code")
+cut = CompiledRule(_parse_cut, "cut")
+grammarrule = CompiledRule(_parse_grammarrule, "grammarrule")
+identifier = CompiledRule(_parse_identifier, "identifier")
+label = CompiledRule(_parse_label, "label")
+look_ahead = CompiledRule(_parse_look_ahead, "look_ahead")
+number = CompiledRule(_parse_number, "number")
+predicate = CompiledRule(_parse_predicate, "predicate")
+production = CompiledRule(_parse_production, "production")
+production_group = CompiledRule(_parse_production_group, "production_group")
+production_group_choices = CompiledRule(_parse_production_group_choices, "production_group_choices")
+regexp = CompiledRule(_parse_regexp, "regexp")
+repetition = CompiledRule(_parse_repetition, "repetition")
+rule_call = CompiledRule(_parse_rule_call, "rule_call")
+rule_choices = CompiledRule(_parse_rule_choices, "rule_choices")
+rule_declaration = CompiledRule(_parse_rule_declaration, "rule_declaration")
+rule_identifier = CompiledRule(_parse_rule_identifier, "rule_identifier")
+space_and_comments = CompiledRule(_parse_space_and_comments, "space_and_comments")
+string = CompiledRule(_parse_string, "string")
+terminal = CompiledRule(_parse_terminal, "terminal")
+toplevel = CompiledRule(_parse_toplevel, "toplevel")
+_skip_toplevel = CompiledRule(_parse__skip_toplevel, "skip of toplevel")
+
+
+# Function Rules implementation
+
+
+# Rules that are not compiled
+_r0 = Rule.getrule(Balanced.instanciate("{", "}", "\\"))
+_r1 = Rule.getrule(Balanced.instanciate("(", ")", "\\"))
+
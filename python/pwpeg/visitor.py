@@ -1,3 +1,5 @@
+from .pwast import misplaced_cut
+
 def indent(txt):
     return "\n".join(["    " + t for t in txt.split("\n")])
 
@@ -55,6 +57,9 @@ class Visitor(object):
     def visit_AstPredicate(self, node, ctx):
         return self.compile_function(node.code, ctx)
 
+    def visit_AstCut(self, node, ctx):
+        return "Cut()"
+
     def visit_AstRuleCall(self, node, ctx):
         ctx.add_rule(node)
         node.code = node.decl.name + (".instanciate" + node.decl.args if node.decl.args else "")
@@ -103,9 +108,14 @@ class Visitor(object):
         ctx.merge(c)
         return self.visit_Repetition(node)
 
+    def check_cuts(self, node):
+        if misplaced_cut(node.productions) or (node.skip and misplaced_cut(node.skip)):
+            raise Exception("The cuts of rule {0} must be in one of its choices or repetitions".format(node.name))
+
     def visit_AstRuleDeclaration(self, node):
         if node.name in self.rules:
             raise Exception("Can't redefine existing rule {0}".format(node.name))
+        self.check_cuts(node)
 
         if node.args:
             self.rules_function[node.name] = node
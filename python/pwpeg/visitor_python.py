@@ -1,6 +1,6 @@
 from itertools import chain
 
-from visitor import Visitor, indent
+from .visitor import Context, Visitor, indent
 
 class PythonVisitor(Visitor):
 
@@ -56,7 +56,7 @@ class PythonVisitor(Visitor):
             res.append("\n# Skips")
             for name, r in sorted(chain(self.rules_simple.items(), self.rules_function.items())):
                 if r.skip:
-                    res.append("{0}.set_skip({1})".format(name, r.skip.name))
+                    res.append("{0}.set_skip({1})".format(name, self.visit(r.skip, Context())))
             res.append("")
 
         res.append("\n# Function Rules implementation")
@@ -88,5 +88,10 @@ class PythonVisitor(Visitor):
             res.append(self.code_end)
             res.append("\n# End of included code\n##############################################################")
 
+        if self.rules_simple:
+            res.append("\n# Regular parts of the grammar as regular expressions")
+            # A list, since python 2 calls can't take more than 255 arguments.
+            res.append("compile_regular(*[{0}])".format(", ".join(sorted(self.rules_simple))))
+
         return "\n".join(res)
 
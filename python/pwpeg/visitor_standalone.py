@@ -0,0 +1,696 @@
+"""
+    A backend that compiles a grammar into plain Python functions.
+
+    Where the PythonVisitor rebuilds the combinators of the grammar, this
+    visitor writes one function per rule in which the productions are
+    inlined ; strings are tested with startswith(), regular expressions are
+    matched directly and the results are kept in local variables.
+
+    Every construct mirrors the combinator the PythonVisitor would have
+    generated, so that the results and the calls to the actions are the
+    same. Function rules, which are built from their arguments at parse
+    time, as well as the rules that are not defined in the grammar are
+    still parsed with the combinators.
+
+    A cut sets a flag of the choice or the repetition it is in, which
+    raises Committed if what was tried fails once it is set.
+
+    The rules that call themselves at the position they start at, as found
+    by left_recursive(), grow a seed with grow_compiled() like the left
+    recursive combinators do.
+"""
+
+from ast import literal_eval
+import re
+
+from .pwpeg import regexp_first
+from .visitor import Context, indent
+from .visitor_python import PythonVisitor
+
+try:
+    _ascii_repr = ascii
+except NameError:
+    # The repr of unicode strings escapes what is beyond ASCII in python 2.
+    _ascii_repr = repr
+
+def literal(value):
+    """ Get the code of a string, written the same by python 2 and 3 ; only
+        the strings beyond ASCII keep their u, without which python 2 would
+        read them as bytes.
+    """
+    code = _ascii_repr(value).lstrip("u")
+    if any(ord(c) > 127 for c in value):
+        return "u" + code
+    return code
+
+
+class Sequence(object):
+    """ The productions of a Rule(), with its optional action.
+    """
+    def __init__(self, items, action=None):
+        self.items = items
+        self.action = action
+
+
+class Choice(object):
+    """ An Either().
+    """
+    def __init__(self, alternatives, action=None):
+        self.alternatives = alternatives
+        self.action = action
+
+
+class Repeat(object):
+    """ A Repetition(), which is an Optional() when it is <0, 1>.
+    """
+    def __init__(self, _from, _to, item):
+        self._from = _from
+        self._to = _to
+        self.item = item
+
+
+class LookAhead(object):
+    """ A Not() or an And().
+    """
+    def __init__(self, item, negative):
+        self.item = item
+        self.negative = negative
+
+
+class Check(object):
+    """ A Predicate.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+
+class Cut(object):
+    """ A Cut.
+    """
+
+
+class Literal(object):
+    """ A StringRule.
+    """
+    def __init__(self, code):
+        value = literal_eval(code)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        self.value = value
+
+
+class Pattern(object):
+    """ A RegexpRule, code being the expression building the regexp.
+    """
+    def __init__(self, code):
+        self.code = code
+
+
+class Call(object):
+    """ A call to another rule.
+    """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+def has_loops(node):
+    if isinstance(node, (Choice, Repeat, LookAhead)):
+        return True
+    if isinstance(node, Sequence):
+        return any(has_loops(i) for i in node.items)
+    return False
+
+
+def has_cut(node):
+    """ Tell if node commits the Choice or the Repeat it is in.
+    """
+    if isinstance(node, Cut):
+        return True
+    if isinstance(node, Sequence):
+        return any(has_cut(i) for i in node.items)
+    return False
+
+
+def left_calls(node, nullable):
+    """ Get the rules node calls at the position it starts at, and whether
+        it can match nothing, as a tuple (names, empty), nullable telling
+        which rules of the grammar can match nothing.
+    """
+    if isinstance(node, Sequence):
+        calls = []
+        for item in node.items:
+            sub, empty = left_calls(item, nullable)
+            calls.extend(sub)
+            if not empty:
+                return calls, False
+        return calls, True
+    if isinstance(node, Choice):
+        calls, empty = [], False
+        for alternative in node.alternatives:
+            sub, sub_empty = left_calls(alternative, nullable)
+            calls.extend(sub)
+            empty = empty or sub_empty
+        return calls, empty
+    if isinstance(node, Repeat):
+        calls, empty = left_calls(node.item, nullable)
+        return calls, empty or node._from == 0
+    if isinstance(node, LookAhead):
+        return left_calls(node.item, nullable)[0], True
+    if isinstance(node, Literal):
+        return [], not node.value
+    if isinstance(node, Pattern):
+        first = regexp_first(eval(node.code, {"re": re}))
+        return [], first is None or first[1]
+    if isinstance(node, Call) and not node.args:
+        # The rules that are not compiled may match nothing.
+        return [node.name], nullable.get(node.name, True)
+    return [], True
+
+
+def left_recursive(rules, order):
+    """ Get the names of the rules to grow a seed for, one per cycle of
+        rules calling each other at the same position, the first one reached
+        in order like find_left_recursion() does.
+    """
+    nullable = dict((name, False) for name in rules)
+    changed = True
+    while changed:
+        changed = False
+        for name, node in rules.items():
+            if not nullable[name] and left_calls(node, nullable)[1]:
+                nullable[name] = changed = True
+    calls = dict((name, [c for c in left_calls(node, nullable)[0] if c in rules]) for name, node in rules.items())
+
+    marked = set()
+    visited = set()
+    for start in order:
+        if start in visited:
+            continue
+        visited.add(start)
+        searching = set([start])
+        stack = [(start, iter(calls[start]))]
+        while stack:
+            name, subs = stack[-1]
+            for sub in subs:
+                if sub in searching:
+                    marked.add(sub)
+                elif sub not in visited:
+                    visited.add(sub)
+                    searching.add(sub)
+                    stack.append((sub, iter(calls[sub])))
+                    break
+            else:
+                stack.pop()
+                searching.discard(name)
+    return marked
+
+
+class FunctionWriter(object):
+    """ Write the body of a parsing function.
+
+        The generated code keeps the current position in the pos local
+        variable. Each production is written so that it either advances pos
+        and leaves its result in an expression, or runs the statements it
+        was given to fail with.
+    """
+
+    # Past this depth of nested loops, productions are moved to their own
+    # function to stay clear of the limits of the Python compiler.
+    max_loops = 12
+
+    def __init__(self, visitor, name):
+        self.visitor = visitor
+        self.name = name
+        self.lines = []
+        self.level = 1
+        self.loops = 0
+        self.nbvar = 0
+        self.nbsub = 0
+        # The flags of the choices and the repetitions the cuts commit.
+        self.cuts = []
+
+    def line(self, code):
+        self.lines.append("    " * self.level + code)
+
+    def fail(self, statements):
+        for s in statements:
+            self.line(s)
+
+    def var(self, prefix="v"):
+        self.nbvar += 1
+        return "{0}{1}".format(prefix, self.nbvar)
+
+    def function(self, node, skip=None):
+        """ Write a function parsing node, using the skip rule named skip
+            instead of the provided one if given.
+        """
+        self.line("s = inp.input")
+        self.line("n = len(s)")
+        if skip:
+            self.line("skip = {0}".format(skip))
+        value = self.write(node, ["return None"])
+        self.line("return pos, {0}".format(value))
+
+        return "def {0}(inp, pos, skip):\n{1}".format(self.name, "\n".join(self.lines))
+
+    def write(self, node, fail, values=None):
+        """ Write the code parsing node, and return the expression of its
+            result, or None if it has none.
+        """
+        # The flag of a cut is a local variable of the function.
+        if self.loops >= self.max_loops and has_loops(node) and not has_cut(node):
+            return self.write_outlined(node, fail)
+
+        return getattr(self, "write_" + node.__class__.__name__)(node, fail, values)
+
+    def write_outlined(self, node, fail):
+        self.nbsub += 1
+        name = "{0}_{1}".format(self.name, self.nbsub)
+        self.visitor.functions.append(FunctionWriter(self.visitor, name).function(node))
+
+        v = self.var()
+        self.line("r = {0}(inp, pos, skip)".format(name))
+        self.line("if r is None:")
+        self.level += 1
+        self.fail(fail)
+        self.level -= 1
+        self.line("pos, {0} = r".format(v))
+        return v
+
+    def write_Literal(self, node, fail, values):
+        value = literal(node.value)
+        self.line("if not s.startswith({0}, pos):".format(value))
+        self.level += 1
+        self.line("inp.pos = pos")
+        self.line("inp.expect({0})".format(self.visitor.terminal("StringRule({0})".format(value))))
+        self.fail(fail)
+        self.level -= 1
+        if node.value:
+            self.line("pos += {0}".format(len(node.value)))
+        return value
+
+    def write_Pattern(self, node, fail, values):
+        terminal = self.visitor.terminal("RegexpRule({0})".format(node.code))
+        v = self.var()
+        self.line("m = _m{0}(s, pos)".format(terminal[2:]))
+        self.line("if m is None:")
+        self.level += 1
+        self.line("inp.pos = pos")
+        self.line("inp.expect({0})".format(terminal))
+        self.fail(fail)
+        self.level -= 1
+        self.line("pos = m.end()")
+        self.line("{0} = m.group()".format(v))
+        return v
+
+    def write_Call(self, node, fail, values):
+        v = self.var()
+        if not node.args and node.name in self.visitor.rules_simple:
+            self.line("r = _parse_{0}(inp, pos, skip)".format(node.name))
+        else:
+            call = node.name + (".instanciate" + node.args if node.args else "")
+            self.line("r = {0}.parse_at(inp, pos, skip)".format(self.visitor.external(call)))
+        self.line("if r is None:")
+        self.level += 1
+        self.fail(fail)
+        self.level -= 1
+        self.line("pos, {0} = r".format(v))
+        return v
+
+    def commit(self, node):
+        """ Start the flag a cut in node sets, if there is one.
+        """
+        if not has_cut(node):
+            return None
+        committed = self.var("c")
+        self.line("{0} = False".format(committed))
+        self.cuts.append(committed)
+        return committed
+
+    def committed(self, committed, condition=None):
+        """ Raise Committed if the flag of commit() was set.
+        """
+        if committed is None:
+            return
+        self.cuts.pop()
+        self.line("if {0}:".format(committed + (" and " + condition if condition else "")))
+        self.line("    raise Committed({0!r})".format(self.name))
+
+    def write_Cut(self, node, fail, values):
+        self.line("{0} = True".format(self.cuts[-1]))
+        return None
+
+    def write_Check(self, node, fail, values):
+        self.line("if {0}({1}) is False:".format(node.fn, ", ".join(values or [])))
+        self.level += 1
+        self.fail(fail)
+        self.level -= 1
+        return None
+
+    def write_Sequence(self, node, fail, values):
+        start = self.var("p")
+        self.line("{0} = pos".format(start))
+
+        values = []
+        for item in node.items:
+            self.line("if skip is not None:")
+            self.line("    pos = skip.skip_from(inp, pos)")
+            # Restoring the position of an enclosing sequence supersedes
+            # restoring ours.
+            restore = fail if fail[0].startswith("pos = ") else ["pos = " + start] + fail
+            value = self.write(item, restore, values)
+            if value is not None:
+                values.append(value)
+
+        if node.action:
+            v = self.var()
+            self.line("{0} = {1}({2})".format(v, node.action, ", ".join(values)))
+            return v
+
+        if len(values) == 1:
+            return values[0]
+
+        v = self.var()
+        self.line("{0} = [{1}]".format(v, ", ".join(values)))
+        return v
+
+    def write_Choice(self, node, fail, values):
+        v = self.var()
+        ok = self.var("ok")
+        self.line("{0} = False".format(ok))
+
+        for i, alternative in enumerate(node.alternatives):
+            if i > 0:
+                self.line("if not {0}:".format(ok))
+                self.level += 1
+
+            last = i == len(node.alternatives) - 1
+            if last and not has_cut(alternative):
+                # The last alternative fails just like the whole choice.
+                self.line("{0} = {1}".format(v, self.write(alternative, fail)))
+            else:
+                committed = self.commit(alternative)
+                self.line("while True:")
+                self.level += 1
+                self.loops += 1
+                self.line("{0} = {1}".format(v, self.write(alternative, ["break"])))
+                self.line("{0} = True".format(ok))
+                self.line("break")
+                self.loops -= 1
+                self.level -= 1
+                self.committed(committed, "not " + ok)
+                if last:
+                    self.line("if not {0}:".format(ok))
+                    self.level += 1
+                    self.fail(fail)
+                    self.level -= 1
+
+            if i > 0:
+                self.level -= 1
+
+        if node.action:
+            self.line("{0} = {1}({0})".format(v, node.action))
+        return v
+
+    def write_Repeat(self, node, fail, values):
+        inner = Sequence([node.item])
+
+        if node._from == 0 and node._to == 1:
+            # An Optional.
+            v = self.var()
+            self.line("{0} = None".format(v))
+            committed = self.commit(inner)
+            self.line("if pos < n:")
+            self.level += 1
+            self.line("while True:")
+            self.level += 1
+            self.loops += 1
+            self.line("{0} = {1}".format(v, self.write(inner, ["break"])))
+            if committed:
+                self.line("{0} = False".format(committed))
+            self.line("break")
+            self.loops -= 1
+            self.level -= 2
+            self.committed(committed)
+            return v
+
+        start = self.var("p")
+        v = self.var("l")
+        self.line("{0} = pos".format(start))
+        self.line("{0} = []".format(v))
+        committed = self.commit(inner)
+
+        condition = "pos < n"
+        if node._to != -1:
+            condition += " and len({0}) < {1}".format(v, node._to)
+        self.line("while {0}:".format(condition))
+        self.level += 1
+        self.loops += 1
+        self.line("{0}.append({1})".format(v, self.write(inner, ["break"])))
+        if committed:
+            self.line("{0} = False".format(committed))
+        self.loops -= 1
+        self.level -= 1
+        self.committed(committed)
+
+        if node._from > 0:
+            self.line("if len({0}) < {1}:".format(v, node._from))
+            self.level += 1
+            self.line("pos = " + start)
+            self.fail(fail)
+            self.level -= 1
+        return v
+
+    def write_LookAhead(self, node, fail, values):
+        start = self.var("p")
+        ok = self.var("ok")
+        self.line("{0} = pos".format(start))
+        self.line("{0} = False".format(ok))
+        self.line("while True:")
+        self.level += 1
+        self.loops += 1
+        self.write(Sequence([node.item]), ["break"])
+        self.line("{0} = True".format(ok))
+        self.line("break")
+        self.loops -= 1
+        self.level -= 1
+        self.line("pos = " + start)
+        self.line(("if {0}:" if node.negative else "if not {0}:").format(ok))
+        self.level += 1
+        self.fail(fail)
+        self.level -= 1
+        return None
+
+
+class StandaloneVisitor(PythonVisitor):
+    """ Compile a grammar to a module of parsing functions.
+
+        For every rule `name` of the grammar, the module has a function
+        _parse_name(input, pos, skip) as well as a CompiledRule `name` that
+        can be given to a Parser like the rules of the PythonVisitor.
+    """
+
+    def __init__(self):
+        super(StandaloneVisitor, self).__init__()
+        self.terminals = []
+        self.externals = []
+        self.functions = []
+        self.actions = []
+        # The names of the rules, in the order of the grammar.
+        self.order = []
+
+    def compile_action(self, code, ctx, fnpattern="fn"):
+        """ Compile an action or a predicate to a module level function.
+        """
+        fn = self.compile_function(code, ctx, fnpattern)
+        if fn.startswith("lambda "):
+            self.actions.append(fn)
+            return "_fn{0}".format(len(self.actions) - 1)
+        return fn
+
+    def terminal(self, code):
+        """ Get the name of the module level terminal rule built by code,
+            used to match regexps and to report what was expected.
+        """
+        if code not in self.terminals:
+            self.terminals.append(code)
+        return "_t{0}".format(self.terminals.index(code))
+
+    def external(self, code):
+        """ Get the name of the module level rule for a call that is not
+            compiled.
+        """
+        if code not in self.externals:
+            self.externals.append(code)
+        return "_r{0}".format(self.externals.index(code))
+
+    #######################################################################
+
+    def visit_AstRuleDeclaration(self, node):
+        if node.args:
+            # Function rules are still built with combinators.
+            return super(StandaloneVisitor, self).visit_AstRuleDeclaration(node)
+
+        if node.name in self.rules:
+            raise Exception("Can't redefine existing rule {0}".format(node.name))
+        self.check_cuts(node)
+
+        self.rules_simple[node.name] = node
+        self.rules[node.name] = node
+        self.order.append(node.name)
+        node.ctx = Context()
+        node.ir = self.build(node.productions, node.ctx)
+        # A rule declaration always is a Rule() around its productions.
+        if not isinstance(node.ir, Sequence):
+            node.ir = Sequence([node.ir])
+        node.skip_ir = self.build(node.skip, Context()) if node.skip else None
+
+    def build(self, node, ctx):
+        return getattr(self, "build_" + node.__class__.__name__)(node, ctx)
+
+    def build_repetition(self, node, ir):
+        if node.repetition:
+            _from, _to = node.repetition
+            return Repeat(_from, _to, ir)
+        return ir
+
+    def build_AstProduction(self, node, ctx):
+        ctx.add_rule(node)
+        if node.code.startswith("re.compile("):
+            return self.build_repetition(node, Pattern(node.code))
+        return self.build_repetition(node, Literal(node.code))
+
+    def build_AstRuleCall(self, node, ctx):
+        ctx.add_rule(node)
+        return self.build_repetition(node, Call(node.decl.name, node.decl.args))
+
+    def build_AstLookAhead(self, node, ctx):
+        return LookAhead(self.build(node.production, Context()), node.symbol == "!")
+
+    def build_AstPredicate(self, node, ctx):
+        return Check(self.compile_action(node.code, ctx))
+
+    def build_AstCut(self, node, ctx):
+        return Cut()
+
+    def build_AstProductionGroup(self, node, ctx):
+        c = Context()
+        items = [self.build(p, c) for p in node.rules]
+
+        if len(items) > 1 or node.action:
+            ir = Sequence(items, self.compile_action(node.action, c, "action") if node.action else None)
+        else:
+            ir = items[0]
+
+        ctx.merge(c)
+        return self.build_repetition(node, ir)
+
+    def build_AstProductionChoices(self, node, ctx):
+        ctx.add_rule(node)
+
+        c = Context()
+        if len(node.rules) > 1:
+            ir = Choice([self.build(p, c) for p in node.rules])
+        else:
+            ir = self.build(node.rules[0], c)
+
+        if node.action:
+            if not isinstance(ir, Choice):
+                ir = Sequence([ir])
+            ir.action = self.compile_action(node.action, c, "action")
+
+        ctx.merge(c)
+        return self.build_repetition(node, ir)
+
+    #######################################################################
+
+    def compile(self, node):
+        self.visit(node)
+
+        grown = left_recursive(dict((name, sr.ir) for name, sr in self.rules_simple.items()), self.order)
+        for name, sr in sorted(self.rules_simple.items()):
+            skip = None
+            if sr.skip_ir:
+                skip = "_skip_" + name
+                self.functions.append(FunctionWriter(self, "_parse__skip_" + name).function(sr.skip_ir))
+            if name in grown:
+                self.functions.append(FunctionWriter(self, "_seed_" + name).function(sr.ir, skip))
+                self.functions.append("def _parse_{0}(inp, pos, skip):\n    return grow_compiled(_seed_{0}, inp, pos, skip)".format(name))
+            else:
+                self.functions.append(FunctionWriter(self, "_parse_" + name).function(sr.ir, skip))
+
+        res = [
+            "#!/usr/bin/env python",
+            "# Parser written by the standalone backend of pwpeg.",
+            "",
+            "# So that python 2 does not import the modules of pwpeg as relative",
+            "# to a parser written in its package.",
+            "from __future__ import absolute_import",
+            "",
+            "from pwpeg import *",
+            "from pwpeg.helpers import *",
+            ""
+        ]
+
+        if self.code_start:
+            res.append("\n##############################################################\n# Start of included code")
+            res.append(self.code_start)
+            res.append("\n# End of included code\n##############################################################")
+
+        res.append("\n# Terminals")
+        for i, code in enumerate(self.terminals):
+            res.append("_t{0} = {1}".format(i, code))
+            if code.startswith("RegexpRule("):
+                res.append("_m{0} = _t{0}.regexp.match".format(i))
+        res.append("")
+
+        res.append("\n# Forward declaration of Function rules")
+        for name, fr in sorted(self.rules_function.items()):
+            res.append("{0} = FunctionRule().set_name(\"{1}\")".format(name, fr.name))
+        res.append("")
+
+        res.append("\n# Actions")
+        for i, fn in enumerate(self.actions):
+            res.append("_fn{0} = {1}".format(i, fn.strip()))
+        for name, sr in sorted(self.rules_simple.items()):
+            for fn in sr.ctx.functions:
+                res.append(fn)
+                res.append("")
+
+        res.append("\n# Parsing functions")
+        for fn in self.functions:
+            res.append(fn)
+            res.append("")
+
+        res.append("\n# Rules")
+        for name, sr in sorted(self.rules_simple.items()):
+            res.append("{0} = CompiledRule(_parse_{0}, \"{0}\")".format(name))
+            if sr.skip_ir:
+                res.append("_skip_{0} = CompiledRule(_parse__skip_{0}, \"skip of {0}\")".format(name))
+        res.append("")
+
+        res.append("\n# Function Rules implementation")
+        for name, fr in sorted(self.rules_function.items()):
+            if fr.skip:
+                res.append("{0}.set_skip({1})".format(name, self.visit(fr.skip, Context())))
+            res.append("def _{0}{1}:".format(name, fr.args))
+            for fn in fr.ctx.functions:
+                res.append(indent(fn))
+                res.append("")
+
+            res.append("    return " + indent(fr.code)[4:])
+            res.append("{0}.set_fn(_{0})\n".format(name))
+        res.append("")
+
+        res.append("\n# Rules that are not compiled")
+        for i, code in enumerate(self.externals):
+            res.append("_r{0} = Rule.getrule({1})".format(i, code))
+        res.append("")
+
+        if self.code_end:
+            res.append("\n##############################################################\n# Start of included code")
+            res.append(self.code_end)
+            res.append("\n# End of included code\n##############################################################")
+
+        return "\n".join(res)
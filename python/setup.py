@@ -9,5 +9,6 @@ setup(name='PwPEG',
       author_email='christophe.eymard@ravelsoft.com',
       url='http://pwpeg.github.com/',
       packages=['pwpeg'],
+      package_data={'pwpeg': ['pwpeglang.pwpeg']},
       scripts=['scripts/pwpeg']
      )
@@ -6,6 +6,7 @@ sys.path.append(join(dirname(__file__), ".."))
 import re
 
 from pwpeg import *
+from pwpeg.helpers import Balanced
 
 def test(rules, texts, errors=[]):
     if isinstance(rules, list):
@@ -95,3 +96,752 @@ def fnrule():
     return Rule("a")
 test([FunctionRule(fnrule)],
     ["a"], [""])
+
+# Packrat memoization must not change the results.
+
+def test_packrat(rule, texts, **kwargs):
+    for t in texts:
+        expected = Parser(rule).parse(t)
+        p = Parser(rule, packrat=True, **kwargs)
+        res = p.parse(t)
+        if res != expected:
+            print("{0} with packrat gave {1} instead of {2} on '{3}'".format(rule, res, expected, t))
+
+word = Rule(_("\w+")).set_name("word")
+call = Rule(word, "(", ZeroOrMore(word), ")").set_action(lambda n, l, ws, r: (n, ws))
+packrat_rule = OneOrMore(Either(call, Rule(word, "!"), word))
+
+test_packrat(packrat_rule, ["a(b)", "a!", "a(b)c!d", "a()"])
+test_packrat(packrat_rule, ["a(b)d(e)f!g"], memo_size=2)
+test_packrat(packrat_rule, ["a(b)d(e)f!g"], memo_size=2, memo_policy="position")
+
+p = Parser(packrat_rule, packrat=True)
+p.parse("a!")
+if p.memo.hits == 0 or "word" not in p.memo.report():
+    print("packrat should have reused the outcome of word:\n" + p.memo.report())
+
+# Syntax errors report the terminals expected at the farthest position,
+# or the whole tree of failures when asked to.
+
+def test_error(rule, text, message, **kwargs):
+    try:
+        Parser(rule, **kwargs).parse(text)
+        print("{0} shouldn't parse '{1}'".format(rule, text))
+    except SyntaxError as e:
+        if e.fullmessage().split("\n")[0] != message:
+            print("{0} on '{1}' should fail with '{2}', not:\n{3}".format(rule, text, message, e.fullmessage()))
+
+test_error(call, "a(b!", 'Expected /\\w+/ or ")", but found "!"(1:4)')
+test_error(call, "a(b!", 'Expected /\\w+/ or ")", but found "!"(1:4)', packrat=True)
+test_error(Rule("a", Either("b", "c")), "ad", 'Expected "b" or "c", but found "d"(1:2)')
+test_error(Rule("a", Either("b", "c")), "ad", 'In "a", either("b", "c") (1:1)', error_tree=True)
+test_error(Rule(_("a\\s"), OneOrMore(_("b\\s")), "c"), "a\nb\nb\nd", 'Expected /b\\s/ or "c", but found "d"(4:1)')
+
+# Either only tries the choices that can start with the current character,
+# once it has been tried often enough to build its dispatch table.
+
+def test_first(rule, chars, nullable=False):
+    first = rule.first()
+    if first[:2] != (chars, nullable):
+        print("{0} should start with {1}, not {2}".format(rule, (chars, nullable), first[:2]))
+
+test_first(Rule(Optional("a"), _("[b-d]+"), "e"), frozenset("abcd"))
+test_first(Rule(Not("x"), Either("y", _("z|w?"))), frozenset("yzw"), True)
+test_first(Rule("a").set_skip(_(" *")), frozenset(" a"))
+test_first(Rule(_("\\d")), frozenset("0123456789") | frozenset([NON_ASCII]))
+# The str patterns of python 2 are bytes.
+test_first(Rule(_(str("[a-c]|d"))), frozenset("abcd"))
+test_first(Rule(Any(), "a"), None, True)
+test_first(Rule(Balanced("(", ")", "\\")), frozenset("("))
+
+dispatched = OneOrMore(Either(Rule("b", "c"), Rule(Optional("b"), "d"), word, Rule(_("[0-9]+")), Rule("+")))
+for i in range(Either.dispatch_after + 1):
+    test_packrat(dispatched, ["bcbd+d12", "d+bc"])
+# The str patterns and texts of python 2 dispatch as well.
+bytes_dispatched = OneOrMore(Either(Rule(_(str("[a-c]+")), "!"), _(str("[0-9]+|d"))))
+for i in range(Either.dispatch_after + 1):
+    test_packrat(bytes_dispatched, [str("ab!12"), str("dc!")])
+test_error(Rule(dispatched, ";"), "bc!", 'Expected "b", "d", /\\w+/, /[0-9]+/, "+" or ";", but found "!"(1:3)')
+
+# Regular parts of the grammar compiled to regular expressions must give the
+# same results and errors.
+
+def test_regular(rule, texts, compiled=True):
+    # The results of the rules before they are compiled.
+    expected = []
+    for t in texts:
+        try:
+            expected.append(Parser(rule).parse(t))
+        except Exception as e:
+            expected.append(str(e))
+
+    p = Parser(rule, regular=True)
+    if compiled and not isinstance((rule.regular or {}).get(None), Regular):
+        print("{0} should have been compiled to a regular expression".format(rule))
+    if Parser(rule).input(u("")).regular:
+        print("{0} should only be parsed with its regular expressions when asked to".format(rule))
+    for t, result in zip(texts, expected):
+        try:
+            results = [result, p.parse(t)]
+        except Exception as e:
+            results = [result, str(e)]
+        if repr(results[0]) != repr(results[1]):
+            print("regular {0} gave {1} instead of {2} on '{3}'".format(rule, results[1], results[0], t))
+
+kv = Rule(_("[a-z]+"), "=", Either(Rule(_("[0-9]+")).set_action(lambda n: int(n)), _('"[^"]*"')))
+test_regular(OneOrMore(kv, Optional(",")).set_skip(_(" *")),
+    ["a=1", "a = 1, b=\"x\" c=3", "a=1,,", "a=", "=1", "a=1 b"])
+test_regular(Rule(Either(Rule("a", "b"), "a"), "c", Not("d"), And(_("[a-z]")), Any()),
+    ["abce", "ace", "abcd", "acD"])
+test_regular(Rule(Repetition(2, 3, "a"), ZeroOrMore(Either("a", "b"), "c")),
+    ["aa", "aaacbc", "aaaacbc", "aaac", "aab"])
+
+nested = Rule()
+nested.set_productions("(", Optional(nested), ")")
+test_regular(nested, ["()", "(())", "(()"], compiled=False)
+
+# The skip rules are only parsed once per position, even when the choices
+# around them backtrack.
+
+skipped = []
+class CountedSkip(Rule):
+    def parse(self, input, currentresults=[], skip=None):
+        skipped.append(input.pos)
+        return super(CountedSkip, self).parse(input, currentresults, skip)
+counted_skip = CountedSkip(_(" *"))
+backtracking = lambda skip: OneOrMore(Either(Rule("a", "b"), Rule("a", "c"), "d")).set_skip(skip)
+expected = Parser(backtracking(_(" *"))).parse("a c d a b")
+if Parser(backtracking(counted_skip)).parse("a c d a b") != expected:
+    print("memoized skips should not change the results")
+if len(skipped) != len(set(skipped)):
+    print("skip should be parsed once per position, not at {0}".format(sorted(skipped)))
+
+# Streams are parsed chunk by chunk, releasing the text the parser won't
+# come back to.
+
+import io
+
+def test_stream(rule, texts, **kwargs):
+    for t in texts:
+        results = []
+        for parse in (lambda p: p.parse(t), lambda p: p.parse_stream(io.StringIO(u(t)), chunk_size=3)):
+            try:
+                results.append(parse(Parser(rule, **kwargs)))
+            except SyntaxError as e:
+                results.append(e.fullmessage())
+        if results[0] != results[1]:
+            print("{0} gave {1} on a stream instead of {2} on '{3}'".format(rule, results[1], results[0], t))
+
+test_stream(Rule(packrat_rule, ";"), ["a(b)c!d;", "a(b c!;", "a(b)\nc(d e!;"])
+test_stream(Rule(packrat_rule, ";"), ["a(b)c!d;", "a(b c!;"], packrat=True)
+test_stream(Rule(OneOrMore(kv, Optional(",")), ";").set_skip(_(" *")), ["a = 1, b=\"x y\" c=3;", "a=1 b;"], regular=True)
+
+# Regexps that run into the end of the window, to match or to fail, are tried
+# again with more text.
+for regexp, t in [('"[^"]*"', '"a string of 22 chars!"'), ("[a-z]+;", "abcdefghij;"), ("(ab)*c", "abababababc"),
+        ("[a-z]+;", "abcdefghij"), ("(?=(?P<a>x+))(?P=a)y", "xxxxxxxxy")]:
+    results = []
+    for parse in (lambda p: p.parse(t), lambda p: p.parse_stream(io.StringIO(u(t)), chunk_size=4)):
+        try:
+            results.append(parse(Parser(Rule(_(regexp)))))
+        except SyntaxError as e:
+            results.append(e.fullmessage())
+    if results[0] != results[1]:
+        print("{0} gave {1} on a stream in chunks of 4 instead of {2}".format(regexp, results[1], results[0]))
+
+p = Parser(OneOrMore(kv, ","))
+stream = p.prepare(StreamInput(io.StringIO(u("a=1,") * 1000), chunk_size=16))
+p.toprule.parse(stream, Results())
+if stream.offset < 3900 or len(stream.input) > 32:
+    print("the stream should only keep its last chunks, not {0} characters from {1}".format(len(stream.input), stream.offset))
+
+# Files are parsed on their bytes, only decoding what the rules matched.
+
+import os
+import tempfile
+
+def test_file(rule, texts):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    for t in texts:
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(u(t))
+        results = []
+        for parse in (lambda p: p.parse(u(t)), lambda p: p.parse_file(path)):
+            try:
+                results.append(repr(parse(Parser(rule))))
+            except SyntaxError as e:
+                results.append(e.fullmessage())
+                # The errors do not keep the file mapped.
+                if os.path.exists("/proc/self/maps") and path in open("/proc/self/maps").read():
+                    print("the error of '{0}' left {1} mapped".format(t, path))
+        if results[0] != results[1]:
+            print("{0} gave {1} on a file instead of {2} on '{3}'".format(rule, results[1], results[0], t))
+    os.remove(path)
+
+test_file(Rule(packrat_rule, ";"), ["a(b)c!d;", "a(b c!;", "a(b)\nc(d e!;", ""])
+test_file(Rule(OneOrMore(kv, Optional(",")), ";").set_skip(_(" *")), [u("a = 1, b=\"\u00e9t\u00e9\" c=3;"), u("a=\"\u00e9\" \u00e9=1;")])
+test_file(Rule(OneOrMore(Not("$"), Any()), "$"), [u("\u00e9\u20ac$"), u("\u00e9\u20ac")])
+
+# Beyond ASCII, regexps match characters rather than bytes.
+test_file(Rule(_(u("\u00e9+"))), [u("\u00e9\u00e9\u00e9"), u("e\u00e9")])
+test_file(Rule(_(u("(?u)\\w+"))), [u("\u00e9t\u00e9"), u(" \u00e9t\u00e9")])
+test_file(Rule(OneOrMore(_("."))), [u("\u00e9\u20ac!"), u("a\u00e9") * 200])
+test_file(Rule(_('"[^"]*"'), _(u("(?i)\u00c9"))), [u("\"\u00e9t\u00e9\"\u00e9"), u("\"") + u("\u00e9") * 300 + u("\"\u00c9")])
+test_file(Rule(_("a+"), _(u("(?<=\u00e9a)b"))), [u("ab"), u("ab")])
+
+# The standalone backend must give the same results as the combinators.
+
+import types
+from pwpeg.pwpeglang import toplevel
+from pwpeg.visitor_python import PythonVisitor
+from pwpeg.visitor_standalone import StandaloneVisitor
+
+def compile_grammar(grammar, visitor):
+    module = types.ModuleType("grammar")
+    exec(visitor.compile(Parser(toplevel).parse(grammar)), module.__dict__)
+    return module
+
+def test_backends(grammar, rule, texts):
+    combinators = compile_grammar(grammar, PythonVisitor())
+    standalone = compile_grammar(grammar, StandaloneVisitor())
+
+    for t in texts:
+        results = []
+        for m in (combinators, standalone):
+            try:
+                results.append(Parser(getattr(m, rule)).parse(t))
+            except SyntaxError as e:
+                results.append(str(e))
+        if results[0] != results[1]:
+            print("standalone {0} gave {1} instead of {2} on '{3}'".format(rule, results[1], results[0], t))
+
+test_backends("""
+file skip /\\s*/ = entries:entry+ -> dict(entries)
+entry = k:key "=" v:value ";"? -> (k, v)
+key = !"end" name:/[a-z]+/i -> name.lower()
+value = number | string | list | paren | "end"
+number = sign:"-"? digits:/[0-9]+/ {len(digits) < 6} -> int(digits) * (-1 if sign else 1)
+string = /"[^"]*"/ -> _0[1:-1]
+list = "[" items:value<0,3> "]" -> items
+paren = &"(" b:Balanced("(", ")", "\\\\") -> "".join(b)
+""", "file", ["a = 1", "a=1; B = -22 ; c=\"x y\"", "l = [1 2 3]", "l=[1 2 3 4]",
+    "x = (a (b) c)", "x = 1234567", "x = end", "x = ", "a=[]"])
+
+# The modules of the python backend compile their regular rules.
+words = compile_grammar("""
+words = /[a-z]+/ more*
+more = "," /[a-z]+/
+""", PythonVisitor()).words
+if not isinstance((words.regular or {}).get(None), Regular):
+    print("{0} should have been compiled by its module".format(words))
+# Even when they have more than the arguments a call takes.
+compile_grammar("\n".join('r{0} = "x{0}"'.format(i) for i in range(300)), PythonVisitor())
+
+# Reparsing after an edit must give the same results as parsing the edited text.
+
+def test_reparse(rule, text, edits):
+    parser = Parser(rule)
+    previous = parser.parse_incremental(text)
+    for offset, removed, inserted in edits:
+        text = text[:offset] + inserted + text[offset + removed:]
+        hits = previous.memo.hits
+        current = parser.reparse(previous, offset, removed, inserted)
+        try:
+            expected = PythonVisitor().compile(Parser(rule).parse(text))
+        except SyntaxError as e:
+            expected = e.fullmessage()
+        if current.error is not None:
+            result = current.error.fullmessage()
+        else:
+            result = PythonVisitor().compile(current.result)
+        if result != expected:
+            print("reparse gave {0} instead of {1} on '{2}'".format(result, expected, text))
+        if current.error is None and current.memo.hits == hits:
+            print("reparse did not reuse anything on '{0}'".format(text))
+        previous = current
+
+test_reparse(toplevel, """
+file = entries:entry+ -> dict(entries)
+# a comment
+entry = k:key "=" v:value ";"? -> (k, v)
+key = !"end" name:/[a-z]+/i -> name.lower()
+value = number | string
+""", [(7, 0, "s"), (60, 3, ""), (20, 0, "# more\n"), (1, 4, "fil e"), (1, 5, "file"), (130, 0, " | list")])
+
+# The inputs do not keep the regexps of every grammar they were used with.
+if IncrementalInput(u("")).reaches is IncrementalInput(u("")).reaches:
+    print("the incremental inputs should have their own regexp reaches")
+
+# Left recursive rules grow from their shorter matches, and build left
+# associative trees.
+
+from pwpeg.helpers import LeftAssociative, RightAssociative
+
+def test_left_recursion(rule, texts, **kwargs):
+    for t, expected in texts:
+        try:
+            result = Parser(rule, **kwargs).parse(t)
+        except SyntaxError as e:
+            result = str(e)
+        if result != expected:
+            print("{0} gave {1} instead of {2} on '{3}'".format(rule, result, expected, t))
+
+number = Rule(_("[0-9]+")).set_action(lambda n: int(n))
+difference = Rule().set_name("difference")
+difference.set_productions(Either(Rule(difference, "-", number).set_action(lambda a, o, b: (a, b)), number))
+product = Rule().set_name("product")
+product.set_productions(Either(Rule(product, "*", number).set_action(lambda a, o, b: ("*", a, b)), number))
+total = Rule().set_name("total")
+total.set_productions(Either(Rule(total, "+", product).set_action(lambda a, o, b: ("+", a, b)), product))
+
+for packrat in (False, True):
+    test_left_recursion(Rule(difference).set_skip(_(" *")),
+        [("1 - 2 - 3", ((1, 2), 3)), ("4", 4), ("- 2", 'Expected /[0-9]+/, but found "-"(1:1)')], packrat=packrat)
+    test_left_recursion(total, [("1+2*3*4+5", ("+", ("+", 1, ("*", ("*", 2, 3), 4)), 5)), ("2*3", ("*", 2, 3))], packrat=packrat)
+
+test_left_recursion(LeftAssociative(number, Either("+", "-")), [("1+2-3", ("-", ("+", 1, 2), 3)), ("1", 1)])
+test_left_recursion(RightAssociative(number, Either("+", "-")), [("1+2-3", ("+", 1, ("-", 2, 3))), ("1", 1)])
+
+expressions = compile_grammar("""
+sum = a:sum "+" b:term -> ("+", a, b)
+    | term
+term = a:term "*" b:/[0-9]+/ -> ("*", a, b)
+    | /[0-9]+/
+""", PythonVisitor())
+test_left_recursion(expressions.sum, [("1+2*3+4", ("+", ("+", "1", ("*", "2", "3")), "4"))])
+
+# The standalone backend grows them too.
+test_backends("""
+sum = a:sum "+" b:term -> ("+", a, b)
+    | term
+term = a:term "*" b:/[0-9]+/ -> ("*", a, b)
+    | /[0-9]+/
+""", "sum", ["1+2*3+4", "1", "+", "*2"])
+test_backends("""
+a = b "x" | "y"
+b = c a "z" | "w"
+c = /[ ]*/
+""", "a", ["yzx", "wx", "yzxzx", " wx", "y", "z"])
+test_backends("""
+list = LeftAssociative(/[0-9]+/, ",")
+""", "list", ["1,2,3", ",1"])
+
+# The rules parse straight into the results of the rule that parses them,
+# which predicates and look-aheads must not see.
+
+def test_results(rule, texts):
+    for t, expected in texts:
+        try:
+            result = Parser(rule).parse(t)
+        except SyntaxError as e:
+            result = None
+        if result != expected:
+            print("{0} gave {1} instead of {2} on '{3}'".format(rule, result, expected, t))
+
+test_results(Rule("a", Either(lambda *r: len(r) > 0, _("[0-9]")), Not("b"), Optional("c"), Rule(And("d"), _("d"))),
+    [("a1d", ["a", "1", None, "d"]), ("a1cd", ["a", "1", "c", "d"])])
+test_results(Rule(_("[0-9]+"), lambda n: int(n) > 5, Optional(Rule("!").set_action(lambda b: "bang"))),
+    [("7", ["7", None]), ("42!", ["42", "bang"]), ("3", None)])
+
+# The parsing machine must give the same results and errors as the rules,
+# without recursing.
+
+def test_machine(rule, texts):
+    for t in texts:
+        results = []
+        for engine in Parser.engines:
+            try:
+                results.append(Parser(rule, engine=engine).parse(t))
+            except Exception as e:
+                results.append(str(e))
+        if results[0] != results[1]:
+            print("the machine gave {0} instead of {1} for {2} on '{3}'".format(results[1], results[0], rule, t))
+
+test_machine(packrat_rule, ["a(b)", "a!", "a(b)c!d", "a()", "a(b!"])
+test_machine(Rule(OneOrMore(kv, Optional(",")), ";").set_skip(_(" *")), ["a = 1, b=\"x y\" c=3;", "a=1 b;", ";"])
+test_machine(Rule(Either(Rule("a", "b"), "a"), "c", Not("d"), And(_("[a-z]")), Any()), ["abce", "ace", "acd", "ac"])
+test_machine(Rule(Repetition(2, 3, "a"), ZeroOrMore(Either("a", "b"), "c"), Exactly(2, "d")), ["aabcdd", "aaaacdd", "adbcd"])
+test_machine(balanced, ["(a (b) c)", "(a (b c)"])
+test_machine(Rule(nested, Optional("!")), ["(())", "(())!", "(()"])
+test_machine(Rule("a", Either(lambda *r: len(r) > 0, _("[0-9]")), Optional("c"), Rule(And("d"), _("d"))), ["a1d", "a1cd", "a1e"])
+test_machine(Rule(Rule(difference).set_skip(_(" *")), Optional(MemoRule(Rule("x")))), ["1 - 2 - 3", "1 - 2 -", "1x"])
+
+depth = 2 * sys.getrecursionlimit()
+result = Parser(Balanced("(", ")", "\\"), engine="machine").parse("(" * depth + ")" * depth)
+if len(result) != 2 * depth:
+    print("the machine did not parse the nested parentheses")
+
+def test_parse_many(rule, texts, workers=2):
+    expected = []
+    for t in texts:
+        try:
+            expected.append((Parser(rule).parse(t), None))
+        except SyntaxError as e:
+            expected.append((None, str(e)))
+    for ordered in (True, False):
+        parsed = list(Parser(rule).parse_many(texts, workers=workers, ordered=ordered, chunksize=2))
+        if ordered and [index for index, result, error in parsed] != list(range(len(texts))):
+            print("parse_many did not keep the order of the texts")
+        results = [(result, None if error is None else str(error)) for index, result, error in sorted(parsed, key=lambda p: p[0])]
+        if results != expected:
+            print("parse_many gave {0} instead of {1}".format(results, expected))
+
+kv_list = Rule(OneOrMore(kv, Optional(",")), ";").set_skip(_(" *"))
+
+# The workers import kv_list from this module, which must not run the tests again.
+if __name__ == "__main__":
+    test_parse_many(kv_list,
+        ["a = 1, b=\"x y\" c=3;", "a=1 b;", ";", "a=1;", "b=2, c=3;", "c=;", "d=4;"])
+
+def test_threads(rule, texts, threads=4):
+    import threading
+    for engine in Parser.engines:
+        parser = Parser(rule, engine=engine)
+        expected = []
+        for t in texts:
+            try:
+                expected.append(Parser(rule, engine=engine).parse(t))
+            except Exception as e:
+                expected.append(str(e))
+        results = [None] * threads
+
+        def run(i):
+            results[i] = []
+            for t in texts * 20:
+                try:
+                    results[i].append(parser.parse(t))
+                except Exception as e:
+                    results[i].append(str(e))
+
+        workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        for r in results:
+            if r != expected * 20:
+                print("the {0} engine gave different results when parsing from threads".format(engine))
+                break
+
+def _indented():
+    indent = MemoRule(Rule(_("[ \t]*")))
+    return Rule(indent, "x\n", ZeroOrMore(indent, "y\n"))
+
+word = MemoRule(Rule(_("[a-z]+")))
+test_threads(Rule(OneOrMore(FunctionRule(_indented))), ["  x\n  y\n\tx\n\ty\n", " x\n y\n  y\n", "\tx\n\ty\n"])
+test_threads(Rule(word, "-", word), ["ab-ab", "cd-cd", "ab-cd"])
+# The choices build their dispatch tables while the threads parse.
+test_threads(OneOrMore(Either(Rule("b", "c"), Rule(Optional("b"), "d"), Rule(_("[0-9]+")), "+")), ["bc", "d", "12+bd"])
+
+def test_profile(rule, text, expected):
+    parse = Rule.__dict__["parse"]
+    parser = Parser(rule, profile=True)
+    if parser.parse(text) != Parser(rule).parse(text):
+        print("profiling changed the result of {0} on '{1}'".format(rule, text))
+    if Rule.__dict__["parse"] is not parse:
+        print("profiling changed the rules the other parses use")
+    for name, counts in expected.items():
+        if parser.profile.rules.get(name, [])[:3] != counts[:3] or parser.profile.rules[name][5:] != counts[3:]:
+            print("the profile of {0} is {1} instead of {2}:\n{3}".format(name, parser.profile.rules.get(name), counts, parser.profile.report()))
+
+digit = Rule(_("[0-9]")).set_name("digit")
+number = Rule(OneOrMore(digit)).set_name("number")
+test_profile(Rule(OneOrMore(Either(Rule(number, "a"), Rule(number, "b")).set_name("choice"))), "12a3b",
+    # calls, matched, failed, matched characters, backtracked characters
+    {"digit": [7, 4, 3, 4, 0], "number": [3, 3, 0, 4, 0], "choice": [2, 2, 0, 5, 0], "number, \"a\"": [2, 1, 1, 3, 1]})
+test_profile(Rule(Not(Rule("a", "b").set_name("ab")), _("[a-z]+")), "ac", {"ab": [1, 0, 1, 0, 1]})
+# The rules that function rules build while parsing are counted too.
+test_profile(Rule(OneOrMore(FunctionRule(lambda: Rule(_("[a-z]"))))), "ab", {"/[a-z]/": [2, 2, 0, 2, 0]})
+
+from pwpeg.cache import CompileCache
+import shutil
+
+def test_cache(grammar):
+    directory = tempfile.mkdtemp()
+    try:
+        writes = []
+
+        def write():
+            writes.append(grammar)
+            return PythonVisitor().compile(Parser(toplevel).parse(grammar))
+
+        cache = CompileCache(directory)
+        source = cache.source(grammar, "combinators", write)
+        again = CompileCache(directory)
+        if again.source(grammar, "combinators", write) != source or len(writes) != 1 or (again.hits, again.misses) != (1, 0):
+            print("the cache did not keep the module written from {0}".format(grammar))
+        module = types.ModuleType("grammar")
+        exec(again.code(grammar, "combinators", write), module.__dict__)
+        if len(writes) != 1 or Parser(module.number).parse("-12") != -12:
+            print("the cache did not keep the bytecode of the module written from {0}".format(grammar))
+
+        again.source(grammar + "\n", "combinators", write)
+        if len(writes) != 2:
+            print("the cache should write the module again when the grammar changes")
+
+        small = CompileCache(directory, max_size=len(source) * 3)
+        small.trim()
+        if sum(size for mtime, size, path in small.entries()) > len(source) * 3:
+            print("the cache should remove the modules past its size")
+    finally:
+        shutil.rmtree(directory)
+
+test_cache("""number = sign:"-"? digits:/[0-9]+/ -> int(digits) * (-1 if sign else 1)""")
+
+# The shipped parser of the grammar language is written from pwpeglang.pwpeg,
+# and must build the same modules as the rules of pwpeglang.py.
+
+import pwpeg.pwpeglang_parser
+
+def test_bootstrap(grammar):
+    compiled = []
+    for rule in (toplevel, pwpeg.pwpeglang_parser.toplevel):
+        try:
+            compiled.append(PythonVisitor().compile(Parser(rule).parse(grammar)))
+        except Exception as e:
+            compiled.append(str(e))
+    if compiled[0] != compiled[1]:
+        print("pwpeglang_parser gave {0} instead of {1} on '{2}'".format(compiled[1], compiled[0], grammar))
+
+meta_grammar = open(join(dirname(pwpeg.__file__), "pwpeglang.pwpeg")).read()
+test_bootstrap(meta_grammar)
+test_bootstrap("""%%
+import os
+%%
+# comment
+a(x, y) skip /\\s*/ = b:[c | \\d]<2,> e:"x\\"y" 'z' /a\\/b/i ->
+    r = 1
+    return r
+c = !d &e+ f { b } -> 2 | g?
+%%
+end
+%%
+""")
+test_bootstrap("a = ")
+
+if StandaloneVisitor().compile(Parser(toplevel).parse(meta_grammar)).rstrip("\n") != open(join(dirname(pwpeg.__file__), "pwpeglang_parser.py")).read().rstrip("\n"):
+    print("pwpeglang_parser.py was not written again from pwpeglang.pwpeg")
+
+# Rule names are only written from the ones of their productions when
+# asked for.
+
+def test_name(rule, name):
+    if rule.name != name:
+        print("the rule should be named {0}, not {1}".format(name, rule.name))
+
+test_name(Rule("a", OneOrMore("b"), Optional(Not("c")), MemoRule(Rule("d"))), '"a", ["b"]+, [Not "c"]?, Memorizing("d")')
+forward = Rule().set_name("forward")
+forward.set_productions("x")
+test_name(forward, "forward")
+forward = Rule()
+test_name(forward, "")
+forward.set_productions(Optional("(", forward, ")"))
+test_name(forward, '["(", _, ")"]?')
+
+try:
+    Rule("a").set_action(lambda a, **kwargs: a)
+    print("actions taking kwargs should be refused")
+except Exception:
+    pass
+
+import functools
+try:
+    Rule("a").set_action(functools.partial(lambda a, **kwargs: a))
+    # Python 2 can't tell the arguments of partial objects.
+    if sys.version_info >= (3,):
+        print("callables without code taking kwargs should be refused")
+except Exception:
+    pass
+if Parser(Rule(_("[0-9]+")).set_action(int)).parse("12") != 12:
+    print("builtin actions should be accepted")
+
+# Events are only sent for the rules that are part of the parse, in order.
+
+def test_events(rule, text, names, expected, result=None):
+    sent = []
+    events = Events()
+    for name in names:
+        events.on(name, enter=lambda name, start: sent.append(("enter", name, start)),
+            match=lambda name, value, start, end: sent.append((name, value)),
+            exit=lambda name, start, end: sent.append(("exit", name, end)))
+    try:
+        res = Parser(rule).parse(text, events=events)
+        if res != result:
+            print("parsing '{0}' with events gave {1} instead of {2}".format(text, res, result))
+    except SyntaxError:
+        pass
+    if sent != expected:
+        print("parsing '{0}' sent {1} instead of {2}".format(text, sent, expected))
+
+record = Rule(_("[a-z]+"), ";").set_name("record").set_action(lambda w, s: w)
+test_events(OneOrMore(Either(Rule(record, "!"), record)), "a;b;!c;", ["record"],
+    [("enter", "record", 0), ("record", "a"), ("exit", "record", 2), ("enter", "record", 2), ("record", "b"), ("exit", "record", 4),
+    ("enter", "record", 5), ("record", "c"), ("exit", "record", 7)], [None, [None, "!"], None])
+test_events(Rule(And(record), record), "a;", ["record"], [("enter", "record", 0), ("record", "a"), ("exit", "record", 2)])
+# What matched before the error is sent.
+test_events(Rule(OneOrMore(record), "end"), "a;b;c;x", ["record"], [("enter", "record", 0), ("record", "a"), ("exit", "record", 2), ("enter", "record", 2)])
+
+digit = Rule(_("[0-9]")).set_name("digit")
+difference = Rule().set_name("difference")
+difference.set_productions(Either(Rule(difference, "-", digit).set_action(lambda a, m, b: (a, b)), digit))
+test_events(difference, "1-2-3", ["digit"], [("enter", "digit", 0), ("digit", "1"), ("exit", "digit", 1), ("enter", "digit", 2), ("digit", "2"),
+    ("exit", "digit", 3), ("enter", "digit", 4), ("digit", "3"), ("exit", "digit", 5)], ((None, None), None))
+test_events(difference, "1-2", ["difference"], [("enter", "difference", 0), ("enter", "difference", 0), ("difference", "1"),
+    ("exit", "difference", 1), ("difference", (None, "2")), ("exit", "difference", 3)])
+
+# The other parses of the same rules, in the handlers or in other threads,
+# neither send the events nor go through what sends them.
+parse = Rule.__dict__["parse"]
+others = []
+events = Events().on("record", match=lambda name, value, start, end: others.append(
+    (Parser(record).parse("x;", events=Events()), Rule.__dict__["parse"] is parse)))
+Parser(OneOrMore(record)).parse("a;b;", events=events)
+if others != [("x", True), ("x", True)]:
+    print("the parses in the handlers gave {0}".format(others))
+
+# iterparse() yields the results parse() would give, one repetition at a time.
+
+def test_iterparse(rule, texts):
+    parser = Parser(rule)
+    for t in texts:
+        try:
+            expected = list(parser.parse(t))
+        except Exception as e:
+            expected = e.__class__
+        for source in (t, io.StringIO(u(t))):
+            got = []
+            try:
+                for result in parser.iterparse(source, chunk_size=2):
+                    got.append(result)
+            except Exception as e:
+                got = e.__class__
+            if got != expected:
+                print("iterparse of '{0}' gave {1} instead of {2}".format(t, got, expected))
+
+record = Rule(_("[a-z]+"), ";").set_action(lambda w, s: w)
+test_iterparse(OneOrMore(record), ["a;b;cc;", "", "a;b;x", "a;;"])
+test_iterparse(Rule(ZeroOrMore(record)).set_skip(_(" *")), [" a; b;", "", " a;!"])
+test_iterparse(Repetition(1, 2, record), ["a;b;", "a;b;c;"])
+
+class Records(object):
+    """ A stream of records that counts how many were read. """
+    def __init__(self, n):
+        self.n = n
+        self.read_records = 0
+    def read(self, size):
+        if self.read_records == self.n:
+            return ""
+        self.read_records += 1
+        return "abc;"
+
+records = Records(100)
+for result in Parser(OneOrMore(record)).iterparse(records, chunk_size=4):
+    if records.read_records > 3:
+        print("iterparse should yield the first record before reading the others")
+    break
+
+# A Cut commits the choice or the repetition being tried, which then fails
+# with a SyntaxError, with every engine.
+
+def test_cut(rule, text, expected):
+    for engine in Parser.engines:
+        for packrat in (False, True):
+            try:
+                got = Parser(rule, engine=engine, packrat=packrat).parse(text)
+            except SyntaxError as e:
+                got = str(e).splitlines()[0]
+            if got != expected:
+                print("{0} with cuts ({1}, packrat {2}) gave {3} instead of {4}".format(text, engine, packrat, got, expected))
+
+word = Rule(_("[a-z]+"))
+braces = Either(Rule("{", Cut(), word, "}").set_action(lambda o, w, c: w), Rule("{", _("x*"), "?").set_action(lambda o, x, q: "?"))
+test_cut(braces, "{a}", "a")
+test_cut(braces, "{x?", 'Expected "}", but found "?"(1:3)')
+test_cut(Rule(word, ZeroOrMore(",", Cut(), word), Optional(",")).set_action(lambda w, more, c: c), "a,b,", 'Expected /[a-z]+/, but found "None"(1:5)')
+test_cut(Rule(Optional("(", Cut(), word, ")"), word), "(a b", 'Expected ")", but found " "(1:3)')
+test_cut(Rule(Not(Rule("a", Cut(), "b")), word), "ac", "ac")
+test_cut(Either(Rule(Optional("a", Cut(), "b"), "c"), "ad"), "ad", 'Expected "b", but found "d"(1:2)')
+
+# A committed failure leaves nothing behind in the input, which can be
+# parsed again.
+grown = Rule().set_name("grown")
+grown.set_productions(Either(Rule(grown, "+", Cut(), word), word))
+for rule, text in [(braces, "{x?"), (Rule(word, ZeroOrMore(",", Cut(), word)), "a,b,"),
+        (Rule(Optional("(", Cut(), word, ")"), word), "(a b"), (Either(Rule(Optional("a", Cut(), "b"), "c"), "ad"), "ad"),
+        (Rule(Not(Either(Rule("a", Cut(), "b"), "c")), word), "ac"), (grown, "a+b+1")]:
+    for engine in Parser.engines:
+        parser = Parser(rule, engine=engine)
+        input = parser.input(text)
+        outcomes = []
+        for i in range(2):
+            input.seek(0)
+            outcomes.append(parser.parse_top(input, Results()))
+            if input.marks or input.seeds or input.growing:
+                print("{0} left {1}, {2} and {3} in the input after a cut failed".format(rule, input.marks, input.seeds, input.growing))
+        if outcomes[0] is not outcomes[1]:
+            print("{0} gave {1} when parsed again instead of {2}".format(rule, outcomes[1], outcomes[0]))
+
+records = Rule("records:\n", Cut(), ZeroOrMore(record, "\n"))
+parser = Parser(Either(records, Rule("records:\n", _("(?s).*"))))
+buffered = StreamInput(io.StringIO(u("records:\n") + u("abc;\n") * 5000), 64)
+parser.run(parser.prepare(buffered), lambda: None)
+if buffered.offset < 20000:
+    print("the text before a cut should be released, not kept from {0}".format(buffered.offset))
+
+test_bootstrap("""a = "(" ~ b ")" | [c ~ d]* !['x' ~ 'y' | 'z']""")
+test_backends("""
+values skip /\\s*/ = [value ";"]*
+value = "{" ~ members:[value ["," ~ value]*]? "}" -> ("obj", members)
+    | "[" ~ items:value* "]" -> items
+    | /[a-z]+/
+    | "{" "?" -> "?"
+""", "values", ["{a, [b c]};", "{?;", "{a, };", "[a;", "{a b};"])
+
+for grammar in ("a = b ~ c", "a = !['b' ~ 'c'] 'd' | 'e'", "a skip ['b' ~ 'c'] = 'd'"):
+    for visitor in (PythonVisitor(), StandaloneVisitor()):
+        try:
+            visitor.compile(Parser(toplevel).parse(grammar))
+            print("the cut of '{0}' commits nothing and should be refused".format(grammar))
+        except Exception:
+            pass
+
+# A Lexer splits a text into tokens in one pass, which the rules parse from
+# a TokenInput.
+
+lexer = Lexer([("number", "[0-9]+"), ("if", r"if\b"), ("name", "[a-z]+"), ("op", "[-+=()]"), ("space", r"\s+"), ("comment", "#[^\n]*")],
+    skip=["space", "comment"])
+if list(lexer.lex("if x = 12 # twelve\n")) != [("if", "if"), ("name", "x"), ("op", "="), ("number", "12")]:
+    print("the lexer gave {0}".format(list(lexer.lex("if x = 12 # twelve\n"))))
+
+def test_tokens(rule, text, expected):
+    for engine in Parser.engines:
+        for packrat in (False, True):
+            try:
+                got = Parser(rule, engine=engine, packrat=packrat).parse_tokens(text, lexer)
+            except SyntaxError as e:
+                got = str(e)
+            if got != expected:
+                print("the tokens of '{0}' ({1}, packrat {2}) gave {3} instead of {4}".format(text, engine, packrat, got, expected))
+
+operand = Either(Token("number"), Token("name"))
+statement = Either(Rule(Token("if"), operand), Rule(Token("name"), "=", operand, ZeroOrMore(Either("+", "-"), Cut(), operand)))
+test_tokens(Rule(OneOrMore(statement)), "x = 1 + y\nif x", [["x", "=", "1", [["+", "y"]]], ["if", "x"]])
+test_tokens(Rule(OneOrMore(statement)), "x = 1 +\n  = 2", 'Expected number or name, but found "="(2:3)')
+test_tokens(Rule(OneOrMore(statement)), "x = 1 $", 'Unexpected "$"(1:7)')
+test_tokens(Rule(OneOrMore(statement)), "if", 'Expected number or name, but found "None"(1:3)')
+test_tokens(Rule(OneOrMore(_("[a-z]"))), "a b", ["a", "b"])
+test_tokens(Rule(_("[a-z]"), _("[a-z]")), "a bc", 'Expected /[a-z]/, but found "bc"(1:3)')
+test_tokens(Rule(Any(), "(", Cut(), ZeroOrMore(Any(), Not(")")), Any(), ")"), "f(a b)", ["f", "(", ["a"], "b", ")"])
+
+refused = [[("word", "[a-z]*")], [("word", "(?P<w>[a-z]+)")]]
+if sys.version_info >= (3,):
+    # Only python 3 tells bytes from text.
+    refused += [[("word", b"[a-z]+")], [("word", re.compile(b"[a-z]+"))]]
+for tokens in refused:
+    try:
+        Lexer(tokens)
+        print("the lexer should refuse {0}".format(tokens))
+    except Exception as e:
+        if type(e) is not Exception:
+            print("the lexer should tell why it refuses {0}, not raise {1!r}".format(tokens, e))